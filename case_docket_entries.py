@@ -1,11 +1,15 @@
+import argparse
 import asyncio
 import pandas as pd
-import aiohttp
-import pickle
 
 from configuration.config import Config
 from services.api_services import ApiSession
-from util import async_timed, get
+from services.cache_services import ResponseCache
+from services.checkpoint_services import Checkpoint
+from services.fetch_services import FetchRequest, fetch_all, fetch_batched, report_failures, write_to_store
+from services.store_services import CaseStore
+from services.sync_services import sync_docket_entries
+from util import async_timed
 
 
 config = Config()
@@ -14,18 +18,51 @@ api_base_url = config.base_api_url
 
 
 @async_timed()
-async def main(*target_caseids):
-    async with aiohttp.ClientSession() as session:
+async def main(*target_caseids, incremental=False, resume=False, batch=False, chunk_size=None, use_cache=True):
+    async with api.session() as session:
         params = {'documents': 'false', 'docket_text': 'true'}
-        headers = {'Authorization': f'Bearer {api.access_token}', 'Content-Type': 'application/json'}
-        urls = [f'{api_base_url}/cases/entries/{caseid}' for caseid in target_caseids]
-        requests = [get(session, url, params=params, headers=headers) for url in urls]
-        dataframes = await asyncio.gather(*requests)
-        with open('/Users/jwt/PycharmProjects/cpi_program/data_files/docket_entries.pkl', 'wb') as f:
-            pickle.dump(dataframes, f, pickle.HIGHEST_PROTOCOL)
+        store = CaseStore('/Users/jwt/PycharmProjects/cpi_program/data_files/docket_entries')
+        if incremental:
+            # only pull entries entered since the last sync and full dockets for new cases
+            await sync_docket_entries(session, target_caseids, store, auth=api.tokens)
+            store.compact()
+            return
+        checkpoint = Checkpoint('/Users/jwt/PycharmProjects/cpi_program/data_files/docket_entries_manifest.jsonl')
+        if resume:
+            # skip completed cases; failed and timed out cases are retried
+            print(f'Resuming: {checkpoint.summary()}, retrying {len(checkpoint.failure_queue())} failure(s)')
+            target_caseids = checkpoint.pending(target_caseids)
+        else:
+            checkpoint.reset()
+        # each case is written to the store and checkpointed as soon as it arrives
+        on_result = write_to_store(store, checkpoint)
+        cache = ResponseCache() if use_cache else None
+        if batch:
+            results = await fetch_batched(session, target_caseids, params=params, chunk_size=chunk_size,
+                                          on_result=on_result, auth=api.tokens, cache=cache)
+        else:
+            requests = [FetchRequest(caseid, f'{api_base_url}/cases/entries/{caseid}', params)
+                        for caseid in target_caseids]
+            results = await fetch_all(session, requests, on_result=on_result, auth=api.tokens,
+                                      cache=cache)
+        report_failures(results)
+        # fold the per-case files into the dataset that later stages read
+        store.compact()
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Download docket entries for pro se cases')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only fetch entries entered since the last sync and full dockets for new cases')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue the last run: fetch only cases that did not complete and retry failures')
+    parser.add_argument('--batch', action='store_true',
+                        help='fetch many cases per request through the multi-case endpoint')
+    parser.add_argument('--chunk-size', type=int, default=None,
+                        help='initial number of cases per batched request; adapts to response size and latency')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='always download from the API instead of reusing cached responses')
+    args = parser.parse_args()
     df = pd.read_csv('/Users/jwt/PycharmProjects/cpi_program/data_files/civil_cases_2018-2022.csv')
     df[['Date Filed', 'Date Terminated', 'DateAgg']] = df[['Date Filed', 'Date Terminated', 'DateAgg']].apply(
         pd.to_datetime, yearfirst=True,
@@ -34,4 +71,5 @@ if __name__ == '__main__':
     df1 = df[mask]
     target_caseids = df1['Case ID'].tolist()
     # caseids = [41091, 41099, 41106]
-    asyncio.run(main(*target_caseids))
+    asyncio.run(main(*target_caseids, incremental=args.incremental, resume=args.resume,
+                     batch=args.batch, chunk_size=args.chunk_size, use_cache=not args.no_cache))
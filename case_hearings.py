@@ -4,13 +4,13 @@ import pandas as pd
 import numpy as np
 import json
 import httpx
-import aiohttp
-from aiohttp import ClientSession
-import pickle
 
 from configuration.config import Config
 from services.api_services import ApiSession
-from util import async_timed, get, get_httpx
+from services.cache_services import ResponseCache
+from services.fetch_services import FetchRequest, fetch_all, report_failures, write_to_store
+from services.store_services import CaseStore
+from util import async_timed
 
 from colorama import Fore, Style
 
@@ -21,14 +21,17 @@ api_base_url = config.base_api_url
 
 @async_timed()
 async def main(*caseids):
-    async with aiohttp.ClientSession() as session:
+    async with api.session() as session:
         params = {'deadline_class': 'hrg'}
-        headers = {'Authorization': f'Bearer {api.access_token}', 'Content-Type': 'application/json'}
-        urls = [f'{api_base_url}/cases/deadlines/{caseid}' for caseid in caseids]
-        requests = [get(session, url, params=params, headers=headers) for url in urls]
-        dataframes = await asyncio.gather(*requests)
-        with open('data_files/dataframes_hearings.pkl', 'wb') as f:
-            pickle.dump(dataframes, f, pickle.HIGHEST_PROTOCOL)
+        requests = [FetchRequest(caseid, f'{api_base_url}/cases/deadlines/{caseid}', params)
+                    for caseid in caseids]
+        store = CaseStore('data_files/hearings')
+        # each case is written to the store as soon as it arrives
+        results = await fetch_all(session, requests, on_result=write_to_store(store),
+                                  auth=api.tokens, cache=ResponseCache())
+        report_failures(results)
+        # fold the per-case files into the dataset that later stages read
+        store.compact()
 
 
 if __name__ == '__main__':
@@ -1,17 +1,41 @@
+import argparse
 from collections import OrderedDict
 from datetime import datetime
 from dataclasses import dataclass, field
 from enum import Enum
-from typing import List
+from functools import partial
+from typing import Dict, List, Optional, Tuple, Union
 import re
+import sys
 
-import dill
 import pandas as pd
 from colorama import Fore
 
 from util import timeit
+from services.dataset_services import FILING_YEAR, write_dataset
+from services.index_services import CaseIndex
+from services.keyword_services import KeywordRule, keyword_rule
+from services.parallel_services import balanced_chunks, resolve_jobs, run_chunks
+from services.stage_cache_services import StageCache
+from services.store_services import CaseStore
+from services.text_services import DocketText
 from services.dataframe_services import create_merged_ua_dates_or_deadlines, cleanup_merged_deadlines, \
-    create_dataframe_docket_entries, create_dataframe_deadlines, create_dataframe_hearings, calculate_intervals
+    load_combined_docket_entries, create_dataframe_deadlines, create_dataframe_hearings, calculate_intervals, \
+    memory_by_column
+
+CASES_CSV = 'data_files/civil_cases_2020-2023.csv'
+STORE_PATHS = ['data_files/docket_entries', 'data_files/deadlines', 'data_files/hearings']
+# subtypes of the documents that open a case, besides 2255 motions; see _find_complaint
+COMPLAINT_SUB_TYPES = ['cmp', 'pwrithc', 'ntcrem', 'emerinj', 'bkntc', 'setagr']
+SCREENING_SUB_TYPES = ['dummyscr', 'pdpro']
+# keyword rules for docket text, compiled once per run
+UA_RULE = KeywordRule(["screening", 'complaint', 'pauperis', 'habeas', 'reopen', 'social security', 'bankruptcy',
+                       'prepayment', '2255'])
+LEAVE_TO_PROCEED_RULE = KeywordRule(["order on leave to proceed", 'granted'], require_all=True)
+EIGHTH_AMENDMENT_RULE = KeywordRule(["eighth amendment"])
+WITHOUT_PREJUDICE_RULE = KeywordRule(["without prejudice"])
+# with the amended complaint's document number when there is one, see _alternative_ua_date_calculation
+ALTERNATIVE_UA_KEYWORDS = ('leave to proceed', 'pauperis', 'screening')
 
 
 class DismissalType(Enum):
@@ -316,29 +340,28 @@ class CaseDates:
             amended_complaint_docnum = None
 
         if amended_complaint_docnum is None:
-            matches = ['leave to proceed', 'pauperis', 'screening']
+            rule = keyword_rule(ALTERNATIVE_UA_KEYWORDS, ignore_case=True)
         else:
-            matches = ['leave to proceed', amended_complaint_docnum, 'pauperis', "screening"]
+            rule = keyword_rule(ALTERNATIVE_UA_KEYWORDS + (amended_complaint_docnum,), ignore_case=True)
         # check ua_dates['ua_text'] for word match against list of matches
         if ua_dates.shape[0] > 0:
-            for index, row in ua_dates.iterrows():
-                if any(x in row['ua_text'].lower() for x in matches):
-                    try:
-                        if row['ua_date'] > self.dismissal_date_prior_to_screening:
-                            self.ua_date = row['ua_date']
-                            continue  # self.ua_date = ua_da
-                    except NameError:
-                        self.ua_date = row['ua_date']
-                        continue
-                    except TypeError:
+            for index, row in ua_dates.loc[rule.mask(ua_dates['ua_text'])].iterrows():
+                try:
+                    if row['ua_date'] > self.dismissal_date_prior_to_screening:
                         self.ua_date = row['ua_date']
-                        continue
+                        continue  # self.ua_date = ua_da
+                except NameError:
+                    self.ua_date = row['ua_date']
+                    continue
+                except TypeError:
+                    self.ua_date = row['ua_date']
+                    continue
         else:
             self.ua_date = None
 
     def _calculate_judgment_without_prejudice_date(self):
         jgm_dates = ([datetime.strptime(x['judgment_date'], '%Y-%m-%d') for x in self.judgment_dates if
-                      "without prejudice" in x['judgment_text']])
+                      WITHOUT_PREJUDICE_RULE.search(x['judgment_text'])])
         jgm_dates.sort()
         try:
             jgm_dates = [x for x in jgm_dates if x < self.notice_of_appeal_date]
@@ -349,26 +372,63 @@ class CaseDates:
             self.judgment_without_prejudice_date = jgm_dates[-1]
 
 
-def _find_target_dates(df: pd.DataFrame, keywords: List[str], check_all: bool = False) -> List[tuple]:
+class CaseEvents:
+    """
+    The docket entries of one case, routed by subtype and type in a single pass. Extractors take the rows they care
+    about from here instead of each filtering the whole case again.
     """
-    Function to find dates for a case.  Utilizes keywords to find candidate dates and appends
-    to a list.
+
+    def __init__(self, target: pd.DataFrame):
+        self.frame = target
+        self._by_sub_type: Dict[str, List[int]] = {}
+        self._by_type: Dict[str, List[int]] = {}
+        for position, (dp_type, sub_type) in enumerate(zip(target['dp_type'].tolist(),
+                                                           target['dp_sub_type'].tolist())):
+            self._by_type.setdefault(dp_type, []).append(position)
+            self._by_sub_type.setdefault(sub_type, []).append(position)
+
+    @classmethod
+    def of(cls, target: Union[pd.DataFrame, 'CaseEvents']) -> 'CaseEvents':
+        return target if isinstance(target, CaseEvents) else cls(target)
+
+    def positions(self, *sub_types: str, dp_type: Optional[str] = None) -> List[int]:
+        """
+        Positions of the rows of any of the subtypes, in docket order; with dp_type, only those of that type, or all
+        rows of that type when no subtype is given
+        """
+        if not sub_types:
+            return self._by_type.get(dp_type, [])
+        positions = sorted(position for sub_type in sub_types for position in self._by_sub_type.get(sub_type, []))
+        if dp_type is not None:
+            of_type = set(self._by_type.get(dp_type, []))
+            positions = [position for position in positions if position in of_type]
+        return positions
+
+    def take(self, *positions: List[int], in_docket_order: bool = True) -> pd.DataFrame:
+        """
+        The rows at the given positions
+
+        :param positions: lists of positions, e.g. from positions()
+        :param in_docket_order: False keeps the lists one after the other, as a concat of separate filters would
+        """
+        taken = [position for part in positions for position in part]
+        return self.frame.iloc[sorted(set(taken)) if in_docket_order else taken]
+
+    def select(self, *sub_types: str, dp_type: Optional[str] = None) -> pd.DataFrame:
+        return self.take(self.positions(*sub_types, dp_type=dp_type))
+
+
+def _find_target_dates(df: pd.DataFrame, rule: KeywordRule) -> List[tuple]:
+    """
+    Function to find dates for a case.  Utilizes a keyword rule to find candidate dates and returns them as a list.
 
     :param df: dataframe of events for that case
-    :param keywords: list of keywords to search for
+    :param rule: compiled keywords to search for, any or all of them
+    :return: (date filed, text, seqno) of the matching events, in docket order
     """
-    df['dt_text'] = df['dt_text'].str.lower()
-    target_dates = []
-
-    for index, row in df.iterrows():
-        a_string = row['dt_text']
-        if check_all:
-            if all(x in a_string for x in keywords):
-                target_dates.append((row['de_date_filed'], row['dt_text'], row['de_seqno']))
-        else:
-            if any(x in a_string for x in keywords):
-                target_dates.append((row['de_date_filed'], row['dt_text'], row['de_seqno']))
-    return target_dates
+    # the text is lowercased once, when the case's entries are taken, see get_docker_entries_for_case
+    found = df.loc[rule.mask(df['dt_text'])]
+    return list(zip(found['de_date_filed'].tolist(), found['dt_text'].tolist(), found['de_seqno'].tolist()))
 
 
 def _complaint_dismissed(case: CaseDates, target: pd.DataFrame) -> CaseDates:
@@ -392,20 +452,19 @@ def _find_complaint(target: pd.DataFrame) -> CaseDates:
     complaints were filed
 
     """
-    case = CaseDates(caseid=target['de_caseid'].iloc[0])
-    cmp = target.query('dp_type == "motion" and dp_sub_type == "2255" or dp_sub_type=="cmp" or dp_sub_type=="pwrithc" '
-                       'or dp_sub_type == "ntcrem" or dp_sub_type == "emerinj" or dp_sub_type == "bkntc" '
-                       'or dp_sub_type == "setagr" ')
+    events = CaseEvents.of(target)
+    case = CaseDates(caseid=events.frame['de_caseid'].iloc[0])
+    cmp = events.take(events.positions('2255', dp_type='motion'), events.positions(*COMPLAINT_SUB_TYPES))
     if not cmp.empty:
         cmp.sort_values(by=['de_seqno'], inplace=True)
         case.complaint_docnum = cmp['de_document_num'].iloc[0].astype(int)
         case.complaint_docnum = f'[{int(case.complaint_docnum)}]'
         case.complaint_date = cmp['de_date_filed'].iloc[0]
     # was case transferred?
-    case = _get_transfer_date(case, target)
-    case = _get_screening_date(case, target)
+    case = _get_transfer_date(case, events)
+    case = _get_screening_date(case, events)
     # was an amended complaint, 2255 motion filed?
-    case = _get_amended_complaints(case, target)
+    case = _get_amended_complaints(case, events)
     return case
 
 
@@ -414,7 +473,7 @@ def _get_transfer_date(case, target):
     Function to find the transfer date for a case.
 
     """
-    trf = target.query('dp_sub_type == "distin"')
+    trf = CaseEvents.of(target).select('distin')
     trf.drop_duplicates(subset='de_seqno', keep='first', inplace=True)
     if not trf.empty:
         case.transfer_date = trf['de_date_filed'].iloc[0]
@@ -422,9 +481,7 @@ def _get_transfer_date(case, target):
 
 
 def _get_amended_complaints(case, target):
-    events = ['amdcmp', 'pamdcmp']
-    mask = target['dp_sub_type'].isin(events)
-    amdcmp = target[mask]
+    amdcmp = CaseEvents.of(target).select('amdcmp', 'pamdcmp')
     if not amdcmp.empty:
         amdcmp.drop_duplicates(subset='de_seqno', keep='first', inplace=True)
         for index, row in amdcmp.iterrows():
@@ -447,13 +504,13 @@ def _get_screening_date(case: CaseDates, target: pd.DataFrame) -> CaseDates:
     Function to find the screening date for a case where there was no ifp request. 
     
     :param case: CaseDates object
-    :param target: dataframe of events for a case
+    :param target: events of a case, as a dataframe or CaseEvents
     :return: CaseDates object
     -------
 
     """
     # Check for dummy screening motion
-    screening = target.query('dp_sub_type == "dummyscr" or dp_sub_type == "pdpro" ')
+    screening = CaseEvents.of(target).select(*SCREENING_SUB_TYPES)
     if not screening.empty:
         case.screening_docnum = screening['dp_seqno'].iloc[0].astype(int)
         case.screening_docnum = f'[{int(case.screening_docnum)}]'
@@ -468,12 +525,12 @@ def _get_ifp_date(case_dates: CaseDates, target: pd.DataFrame) -> pd.DataFrame:
     Function to find the ifp date for a case if it exists.
 
     :param case_dates: CaseDates object
-    :param target: dataframe of events for a case
+    :param target: events of a case, as a dataframe or CaseEvents
     :return: CaseDates object
     -------
 
     """
-    ifp = target.loc[target['dp_sub_type'] == 'ifp']
+    ifp = CaseEvents.of(target).select('ifp')
     if not ifp.empty:
         ifp_docnum = ifp['de_document_num'].iloc[0].astype(int)
         ifp_docnum = f'[{int(ifp_docnum)}]'
@@ -486,11 +543,9 @@ def _get_ifp_date(case_dates: CaseDates, target: pd.DataFrame) -> pd.DataFrame:
 
 
 def _get_ua_date(case_dates, target):
-    ua = target.loc[target['dp_sub_type'] == 'madv']
+    ua = CaseEvents.of(target).select('madv')
     if not ua.empty:
-        matches = ["screening", 'complaint', 'pauperis', 'habeas', 'reopen',
-                   'social security', 'bankruptcy', 'prepayment', '2255']
-        ua_dates = _find_target_dates(ua, matches)
+        ua_dates = _find_target_dates(ua, UA_RULE)
         if ua_dates:
             for ua_date in ua_dates:
                 case_dates.ua_dates.append({'ua_date': ua_date[0], 'ua_text': ua_date[1]})
@@ -551,14 +606,12 @@ def _early_dismissal(case_dates, target) -> CaseDates:
     Function to check for voluntary dismissal or other dismissal prior to screening 
    
     :param case_dates: CaseDates object
-    :param target: dataframe of events for a case
+    :param target: events of a case, as a dataframe or CaseEvents
 
     """
-    s1 = target.loc[target['dp_sub_type'] == 'voldism']
-    s2 = target.loc[target['dp_sub_type'] == 'termcs']
-    s3 = target.loc[target['dp_sub_type'] == 'termpscs']
-    s4 = target.loc[target['dp_sub_type'] == 'dismcmp']
-    dism = pd.concat([s1, s2, s3, s4])
+    events = CaseEvents.of(target)
+    dism = events.take(*(events.positions(sub_type) for sub_type in ['voldism', 'termcs', 'termpscs', 'dismcmp']),
+                       in_docket_order=False)
     dism.drop_duplicates(subset='de_seqno', keep='first', inplace=True)
     # take the last date filed
     if not dism.empty:
@@ -575,7 +628,7 @@ def _early_dismissal(case_dates, target) -> CaseDates:
 
 def _get_reopen_date(case_dates, target):
     # Check for reopen motion
-    reopen = target.loc[target['dp_sub_type'] == 'ropncs']
+    reopen = CaseEvents.of(target).select('ropncs')
     if not reopen.empty:
         reopen.sort_values(by=['de_date_filed'], inplace=True, ascending=True)
         for index, row in reopen.iterrows():
@@ -584,17 +637,16 @@ def _get_reopen_date(case_dates, target):
 
 
 def _get_leave_to_proceed(case_dates, target):
-    ltp = target.loc[target['dp_sub_type'] == 'leave']
+    events = CaseEvents.of(target)
+    ltp = events.select('leave')
     if ltp.empty:
-        ltp = target.loc[target['dp_type'] == 'order']
-        matches = ["order on leave to proceed", 'granted']
-        ltp_dates = _find_target_dates(ltp, matches, check_all=True)
+        ltp = events.select(dp_type='order')
+        ltp_dates = _find_target_dates(ltp, LEAVE_TO_PROCEED_RULE)
         # remove duplicates
         ltp_dates = set(ltp_dates)
         # catching edge cases
         if not ltp_dates:
-            matches = ["eighth amendment"]
-            ltp_dates = _find_target_dates(ltp, matches, check_all=False)
+            ltp_dates = _find_target_dates(ltp, EIGHTH_AMENDMENT_RULE)
             ltp_dates = set(ltp_dates)
 
         for ltp_date in ltp_dates:
@@ -612,7 +664,7 @@ def _get_leave_to_proceed(case_dates, target):
 
 def _get_pretrial_conference_date(case_dates, target):
     # Check for pretrial conference minutes. Subtype 'minutes' is not needed for identification
-    pretrial = target.loc[target['dp_sub_type'] == 'ptcnf']
+    pretrial = CaseEvents.of(target).select('ptcnf')
     pretrial.sort_values(by=['de_date_filed'], inplace=True, ascending=True)
     if not pretrial.empty:
         case_dates.initial_pretrial_conference_date = pretrial['de_date_filed'].iloc[0]
@@ -710,7 +762,7 @@ def get_case_deadlines(case_id: int, target_dline: pd.DataFrame, target_hearing:
 
 
 def _get_judgment_date(case_dates, target):
-    judgments = target.loc[target['dp_sub_type'] == 'jgm']
+    judgments = CaseEvents.of(target).select('jgm')
     if not judgments.empty:
         judgments.drop_duplicates(subset=['dp_seqno'], inplace=True)
         judgments.sort_values(by=['de_date_filed'], inplace=True, ascending=True)
@@ -733,7 +785,7 @@ def _get_motion_for_reconsideration(case_dates, target):
 
 
 def _get_notice_of_appeal(case_dates, target):
-    noa = target.loc[target['dp_sub_type'] == 'ntcapp']
+    noa = CaseEvents.of(target).select('ntcapp')
     if not noa.empty:
         noa.drop_duplicates(subset=['dp_seqno'], inplace=True)
         noa.sort_values(by=['de_date_filed'], inplace=True, ascending=True)
@@ -742,31 +794,127 @@ def _get_notice_of_appeal(case_dates, target):
     return case_dates
 
 
-def get_case_milestone_dates(case_id: int, target: pd.DataFrame, case_type: str) -> pd.DataFrame:
+def _docnums(values: pd.Series) -> List[str]:
+    # numpy's cast, as the per-case functions do it on a single value
+    return [f'[{int(value)}]' for value in values.to_numpy().astype(int)]
+
+
+def _set_fields(fields: Dict[int, dict], rows: pd.DataFrame, **columns):
+    for caseid, *values in zip(rows['de_caseid'].tolist(), *[list(column) for column in columns.values()]):
+        fields[caseid].update(zip(columns, values))
+
+
+def _combined_text(df_entries: pd.DataFrame, keys: pd.DataFrame, docket_text: Optional[DocketText]) -> pd.Series:
+    """
+    The text of the given entries with their parts joined, as combine_docket_text_into_one_row joins it
+
+    :return: series indexed by de_caseid and de_seqno
+    """
+    index = pd.MultiIndex.from_frame(df_entries[['de_caseid', 'de_seqno']])
+    parts = df_entries.loc[index.isin(pd.MultiIndex.from_frame(keys[['de_caseid', 'de_seqno']]))]
+    if docket_text is not None:
+        parts = docket_text.attach(parts)
+    else:
+        parts = parts.assign(dt_text=parts['dt_text'].str.lower())
+    return parts.groupby(['de_caseid', 'de_seqno'], sort=False)['dt_text'].apply(' '.join)
+
+
+def find_first_events(df_entries: pd.DataFrame, docket_text: Optional[DocketText] = None) -> Dict[int, dict]:
+    """
+    Finds the complaint, transfer, screening, IFP, pretrial conference, reopen and judgment fields of CaseDates for
+    every case at once, with a few operations over the whole entries table instead of a query per case. The fields are
+    the ones _find_complaint, _get_transfer_date, _get_screening_date, _get_ifp_date, _get_pretrial_conference_date,
+    _get_reopen_date and _get_judgment_date set, under the same conditions.
+
+    :param df_entries: docket entries of one or more cases, in docket order
+    :param docket_text: store the text was popped into; when None the text is still in df_entries
+    :return: CaseDates fields by case ID, for get_case_milestone_dates
+    """
+    # one row per entry, as combine_docket_text_into_one_row leaves them
+    entries = df_entries.drop_duplicates(subset=['de_caseid', 'de_seqno'], keep='first')
+    entries = entries.assign(de_document_num=entries['de_document_num'].fillna(0).astype(int))
+    sub_type = entries['dp_sub_type']
+    fields = {caseid: {} for caseid in pd.unique(entries['de_caseid']).tolist()}
+
+    complaints = entries.loc[((entries['dp_type'] == 'motion') & (sub_type == '2255')) |
+                             sub_type.isin(COMPLAINT_SUB_TYPES)]
+    complaints = complaints.sort_values(by=['de_caseid', 'de_seqno'], kind='stable').drop_duplicates('de_caseid')
+    _set_fields(fields, complaints, complaint_docnum=_docnums(complaints['de_document_num']),
+                complaint_date=complaints['de_date_filed'])
+    transfers = entries.loc[sub_type == 'distin'].drop_duplicates('de_caseid')
+    _set_fields(fields, transfers, transfer_date=transfers['de_date_filed'])
+    for case_fields in fields.values():
+        case_fields['screening_docnum'] = '0'
+    screenings = entries.loc[sub_type.isin(SCREENING_SUB_TYPES)].drop_duplicates('de_caseid')
+    _set_fields(fields, screenings, screening_docnum=_docnums(screenings['dp_seqno']),
+                screening_date=screenings['de_date_filed'])
+
+    # the IFP motion is only looked for once a complaint or screening was found
+    ifp_cases = {caseid for caseid, case_fields in fields.items()
+                 if case_fields.get('complaint_date') or case_fields.get('screening_date')}
+    for caseid in ifp_cases:
+        fields[caseid]['ifp_docnum'] = '0'
+    ifps = entries.loc[(sub_type == 'ifp') & entries['de_caseid'].isin(ifp_cases)].drop_duplicates('de_caseid')
+    _set_fields(fields, ifps, ifp_docnum=_docnums(ifps['de_document_num']), ifp_date=ifps['de_date_filed'])
+
+    pretrials = entries.loc[sub_type == 'ptcnf'].sort_values(by=['de_caseid', 'de_date_filed'], kind='stable')
+    pretrials = pretrials.drop_duplicates('de_caseid')
+    _set_fields(fields, pretrials, initial_pretrial_conference_date=pretrials['de_date_filed'])
+
+    reopens = entries.loc[sub_type == 'ropncs'].sort_values(by=['de_caseid', 'de_date_filed'], kind='stable')
+    for caseid, dates in reopens.groupby('de_caseid', sort=False)['de_date_filed'].agg(list).items():
+        fields[caseid]['case_reopen_dates'] = dates
+
+    # judgments are only collected for reopened cases
+    judgments = entries.loc[(sub_type == 'jgm') & entries['de_caseid'].isin(reopens['de_caseid'].unique())]
+    judgments = judgments.drop_duplicates(subset=['de_caseid', 'dp_seqno'])
+    if not judgments.empty:
+        texts = _combined_text(df_entries, judgments, docket_text)
+        judgments = judgments.assign(dt_text=texts.reindex(pd.MultiIndex.from_frame(
+            judgments[['de_caseid', 'de_seqno']])).to_numpy())
+        judgments = judgments.sort_values(by=['de_caseid', 'de_date_filed'], kind='stable')
+        for caseid, date, seqno, text in zip(judgments['de_caseid'].tolist(), judgments['de_date_filed'].tolist(),
+                                             judgments['dp_seqno'].tolist(), judgments['dt_text'].tolist()):
+            fields[caseid].setdefault('judgment_dates', []).append({'judgment_date': date, 'seqno': seqno,
+                                                                    'judgment_text': text})
+    return fields
+
+
+def get_case_milestone_dates(case_id: int, target: pd.DataFrame, case_type: str,
+                             first_events: Optional[dict] = None) -> pd.DataFrame:
     """
     Wrapper Function to get case milestone dates for a case. Milestones include:
     Complaint, Screening, Under Advisement, IFP Motion, Dismissal, Reopen, Leave to Proceed, Pretrial Conference,
+
+    :param first_events: the case's fields from find_first_events; when None they are found from target
     """
     case_dates = []
     print(Fore.BLUE + f'Getting ua dates for {case_id}...', flush=True)
     try:
         case_dates.append({'case_id': case_id})
+        # the case's rows are routed by subtype once, for all the extractors below
+        events = CaseEvents(target)
         # locate complaints
-        case_dates = _find_complaint(target)
+        if first_events is None:
+            case_dates = _find_complaint(events)
+        else:
+            case_dates = CaseDates(caseid=target['de_caseid'].iloc[0], **first_events)
+            case_dates = _get_amended_complaints(case_dates, events)
         case_dates.case_type = case_type
-        if case_dates.complaint_date or case_dates.screening_date:
+        if first_events is None and (case_dates.complaint_date or case_dates.screening_date):
             # check for ifp motion
-            case_dates = _get_ifp_date(case_dates, target)
-        case_dates = _early_dismissal(case_dates, target)
-        case_dates = _get_ua_date(case_dates, target)
+            case_dates = _get_ifp_date(case_dates, events)
+        case_dates = _early_dismissal(case_dates, events)
+        case_dates = _get_ua_date(case_dates, events)
         # check for leave to proceed
-        case_dates = _get_leave_to_proceed(case_dates, target)
-        case_dates = _get_pretrial_conference_date(case_dates, target)
-        case_dates = _get_reopen_date(case_dates, target)
-        if len(case_dates.case_reopen_dates) >= 1:
-            case_dates = _get_judgment_date(case_dates, target)
+        case_dates = _get_leave_to_proceed(case_dates, events)
+        if first_events is None:
+            case_dates = _get_pretrial_conference_date(case_dates, events)
+            case_dates = _get_reopen_date(case_dates, events)
+            if len(case_dates.case_reopen_dates) >= 1:
+                case_dates = _get_judgment_date(case_dates, events)
         # check for case re-openings
-        case_dates = _get_notice_of_appeal(case_dates, target)
+        case_dates = _get_notice_of_appeal(case_dates, events)
         print(Fore.WHITE + f'Finished getting case dates for: {case_id}')
         case_dates_dict = case_dates.dict()
         return case_dates_dict
@@ -774,41 +922,75 @@ def get_case_milestone_dates(case_id: int, target: pd.DataFrame, case_type: str)
         print(Fore.RED + f'No dates found for {case_id}: {e}', flush=True)
 
 
-def get_docker_entries_for_case(caseid, df_entries):
-    target = df_entries.loc[df_entries['de_caseid'] == caseid]
+def get_docker_entries_for_case(caseid, df_entries: Union[pd.DataFrame, CaseIndex],
+                                docket_text: Optional[DocketText] = None):
+    """
+    Takes the entries of one case and puts their docket text back on them
+
+    :param caseid: case ID
+    :param df_entries: docket entries indexed by de_caseid, or a dataframe of docket entries
+    :param docket_text: store the text was popped into; when None the text is still in df_entries and is lowercased here
+    """
+    if isinstance(df_entries, CaseIndex):
+        target = df_entries.get(caseid)
+    else:
+        target = df_entries.loc[df_entries['de_caseid'] == caseid]
+    if docket_text is not None:
+        # already lowercased when it was stored
+        target = docket_text.attach(target)
+    else:
+        target['dt_text'] = target['dt_text'].str.lower()
     target['de_document_num'].fillna(0, inplace=True)
     target['de_document_num'] = target['de_document_num'].astype(int)
     target['dp_dpseqno_ptr'].fillna(0, inplace=True)
     target['dp_dpseqno_ptr'] = target['dp_dpseqno_ptr'].astype(int)
-    target['dt_text'] = target['dt_text'].str.lower()
-    target = combine_docket_text_into_one_row(target)
+    if target['de_seqno'].duplicated().any():
+        # entries not combined when they were loaded, see combine_docket_text
+        return combine_docket_text_into_one_row(target)
+    # the shape combine_docket_text_into_one_row leaves: a fresh index and the text last
+    target = target.reset_index(drop=True)
+    if target.columns[-1] != 'dt_text':
+        target = target[[*target.columns.drop('dt_text'), 'dt_text']]
     return target
 
 
-@timeit
-def main():
-    # get saved docket entries
-    with open('data_files/docket_entries.pkl', 'rb') as f:
-        dataframes_entries = dill.load(f)
-
-    df_entries = create_dataframe_docket_entries(dataframes_entries)
-    df_entries['dt_text'] = df_entries['dt_text'].str.lower()
-
-    with open('data_files/dataframes_deadlines.pkl', 'rb') as f:
-        dataframes_deadlines = dill.load(f)
-
-    df_deadlines = create_dataframe_deadlines(dataframes_deadlines)
-
-    with open('data_files/dataframes_hearings.pkl', 'rb') as f:
-        dataframes_hearings = dill.load(f)
-
-    df_hearings = create_dataframe_hearings(dataframes_hearings)
+def _extract_cases(cases: List[Tuple[int, str]], df_entries: Union[pd.DataFrame, CaseIndex], docket_text: DocketText,
+                   df_deadlines: Union[pd.DataFrame, CaseIndex],
+                   df_hearings: Union[pd.DataFrame, CaseIndex]) -> Dict[int, Tuple]:
+    """
+    Finds the milestone dates and deadlines of a chunk of cases; runs in a worker process when extracting in parallel
+
+    :param cases: case ID and case type of each case
+    :param df_entries: docket entries of the cases, without their text, or a CaseIndex over them
+    :param docket_text: docket text of the cases
+    :param df_deadlines: deadlines of the cases, or a CaseIndex over them
+    :param df_hearings: hearings of the cases, or a CaseIndex over them
+    :return: milestone dates and deadlines by case ID
+    """
+    entries = CaseIndex.of(df_entries, 'de_caseid')
+    deadlines = CaseIndex.of(df_deadlines, 'sd_caseid')
+    hearings = CaseIndex.of(df_hearings, 'sd_caseid')
+    # the first-event milestones of the whole chunk are found at once
+    first_events = find_first_events(entries.frame, docket_text)
+    results = {}
+    for caseid, case_type in cases:
+        target = get_docker_entries_for_case(caseid, entries, docket_text)
+        ua_date = get_case_milestone_dates(caseid, target, case_type, first_events.get(caseid, {}))
+        results[caseid] = (ua_date, get_case_deadlines(caseid, deadlines.get(caseid), hearings.get(caseid), case_type))
+    return results
+
+
+def extract_case_metrics(start_date: str, jobs: int = 1) -> Dict[str, pd.DataFrame]:
+    """
+    Finds the milestone dates and deadlines of every pro se case filed since start_date and the intervals between them
 
-    # delete dataframes to free up memory
-    del dataframes_entries, dataframes_deadlines, dataframes_hearings
+    :param start_date: first filing date, e.g. '2020-01-01'
+    :param jobs: number of worker processes; 0 for one per CPU core
+    :return: dict with the ua_dates, deadline_dates and case_metrics frames
+    """
     ua_dates = []
     deadline_dates = []
-    cases = pd.read_csv('data_files/civil_cases_2020-2023.csv')
+    cases = pd.read_csv(CASES_CSV)
     # filter dataframe to return cases where IsProse is y
     mask = cases['IsProse'] == 'y'
     cases = cases[mask]
@@ -818,27 +1000,53 @@ def main():
         pd.to_datetime, yearfirst=True,
         dayfirst=False, errors='coerce')
     cases = cases.drop(columns=['Diversity Plaintiff', 'Diversity Defendant', 'IsProse'])
-    cases = cases.loc[cases['Date Filed'] >= datetime(2020, 1, 1)]
+    cases = cases.loc[cases['Date Filed'] >= datetime.fromisoformat(start_date)]
     cases['Case ID'] = cases['Case ID'].astype(int)
     cases.drop_duplicates(keep='first', inplace=True)
 
     caseids = cases['Case ID'].tolist()
     # caseids = [42630]
 
-    # gather information for each case and find the ua dates and deadlines
+    # get saved docket entries, deadlines and hearings; only the cases and columns used below are read
+    # multi-part entries are combined once for the whole table, and the combined table is kept in the stage cache
+    store = 'data_files/docket_entries'
+    df_entries = StageCache().run('combined_docket_entries', load_combined_docket_entries, inputs=[store],
+                                  params={'path': store, 'caseids': caseids})
+    # the text is lowercased once and kept compressed apart from the entries until a case needs it
+    docket_text = DocketText.pop(df_entries)
+    print(Fore.WHITE + f'Docket entries by column:\n{memory_by_column(df_entries)}', flush=True)
+    print(Fore.WHITE + f'Docket text: {docket_text.nbytes / 1024 ** 2:.1f} MB compressed', flush=True)
+    df_deadlines = create_dataframe_deadlines([CaseStore('data_files/deadlines').read(caseids=caseids)])
+    df_hearings = create_dataframe_hearings([CaseStore('data_files/hearings').read(caseids=caseids)])
+
+    # index every frame by case once, so that each case below takes its rows without scanning the others
+    case_index = CaseIndex(cases, 'Case ID')
+    entries = CaseIndex(df_entries, 'de_caseid')
+    deadlines = CaseIndex(df_deadlines, 'sd_caseid')
+    hearings = CaseIndex(df_hearings, 'sd_caseid')
+    del df_entries, df_deadlines, df_hearings
+
+    # gather information for each case and find the ua dates and deadlines; each chunk of cases gets only its own rows
+    jobs = resolve_jobs(jobs)
+    chunks = balanced_chunks(caseids, {caseid: entries.rows(caseid) for caseid in caseids}, jobs)
+
+    def _payload(chunk: List[int]) -> tuple:
+        chunk_cases = [(caseid, case_index.first(caseid, 'Group')) for caseid in chunk]
+        if len(chunks) == 1:
+            # extracted in this process: the indexes are passed as they are rather than copies of their rows
+            return chunk_cases, entries, docket_text, deadlines, hearings
+        return chunk_cases, entries.take(chunk), docket_text.subset(chunk), deadlines.take(chunk), hearings.take(chunk)
+
+    # built one chunk at a time as the workers take them
+    payloads = (_payload(chunk) for chunk in chunks)
+    results = {}
+    for chunk_results in run_chunks(_extract_cases, payloads, jobs):
+        results.update(chunk_results)
+    # merged in case order, so the result does not depend on the number of jobs
     for caseid in caseids:
-        case_type = cases.loc[cases['Case ID'] == caseid, 'Group'].iloc[0]
-        target = get_docker_entries_for_case(caseid, df_entries)
-        ua_dates.append(get_case_milestone_dates(caseid, target, case_type))
-        target_dline = df_deadlines.loc[df_deadlines['sd_caseid'] == caseid]
-        target_hearings = df_hearings.loc[df_hearings['sd_caseid'] == caseid]
-        deadline_dates.append(get_case_deadlines(caseid, target_dline, target_hearings, case_type))
-
-    # save objects to disk for later use
-    with open('data_files/ua_dates.pkl', 'wb') as f:
-        dill.dump(ua_dates, f)
-    with open('data_files/deadline_dates.pkl', 'wb') as f:
-        dill.dump(deadline_dates, f)
+        ua_date, deadline_date = results[caseid]
+        ua_dates.append(ua_date)
+        deadline_dates.append(deadline_date)
 
     deadline_dates = [x for x in deadline_dates if x is not None]
     ua_dates = [x for x in ua_dates if x is not None]
@@ -848,10 +1056,26 @@ def main():
     df = create_merged_ua_dates_or_deadlines(df, deadline_dates_df)
     df = cleanup_merged_deadlines(df)
     df = calculate_intervals(df)
+    return {'ua_dates': ua_dates_df, 'deadline_dates': deadline_dates_df, 'case_metrics': df}
+
 
-    with open('data_files/case_metrics.pkl', 'wb') as f:
-        dill.dump(df, f)
+@timeit
+def main(jobs: int = 1):
+    # served from the stage cache when neither the case list, the stored dockets nor this code have changed; the
+    # number of jobs does not change the outputs, so it is not part of the fingerprint
+    outputs = StageCache().run('case_metrics', partial(extract_case_metrics, jobs=jobs),
+                               inputs=[CASES_CSV, *STORE_PATHS], params={'start_date': '2020-01-01'},
+                               code=[sys.modules[__name__]])
+    # save objects to disk for later use
+    write_dataset(outputs['ua_dates'], 'data_files/ua_dates', case_column='caseid')
+    write_dataset(outputs['deadline_dates'], 'data_files/deadline_dates', case_column='caseid')
+    write_dataset(outputs['case_metrics'], 'data_files/case_metrics', partition_by=FILING_YEAR,
+                  case_column='Case ID', date_column='Date Filed')
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Find the milestone dates and deadlines of pro se cases')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of worker processes extracting cases in parallel; 0 for one per CPU core')
+    args = parser.parse_args()
+    main(jobs=args.jobs)
@@ -0,0 +1,48 @@
+import asyncio
+import pandas as pd
+
+from colorama import Fore
+
+from configuration.config import Config
+from services.api_services import ApiSession
+from services.cache_services import ResponseCache
+from services.fetch_services import fetch_case_bundles
+from services.store_services import CaseStore
+from util import async_timed
+
+
+config = Config()
+api = ApiSession.instance()
+
+
+@async_timed()
+async def main(*caseids):
+    """
+    Refreshes docket entries, deadlines and hearings for every case in one pass over a shared connection pool.
+    Replaces running case_docket_entries.py, case_deadlines.py and case_hearings.py one after another.
+    """
+    stores = {'entries': CaseStore('data_files/docket_entries'),
+              'deadlines': CaseStore('data_files/deadlines'),
+              'hearings': CaseStore('data_files/hearings')}
+    async with api.session() as session:
+        # every frame is written to its store as soon as it arrives
+        bundles = await fetch_case_bundles(session, caseids, stores=stores, auth=api.tokens,
+                                           cache=ResponseCache())
+
+    # fold the per-case files into the datasets that later stages read
+    for store in stores.values():
+        store.compact()
+    failed = [bundle.caseid for bundle in bundles if not bundle.ok]
+    if failed:
+        print(Fore.RED + f'Failed: {failed}', flush=True)
+
+
+if __name__ == '__main__':
+    df = pd.read_csv('data_files/civil_cases_2018-2022.csv')
+    df[['Date Filed', 'Date Terminated', 'DateAgg']] = df[['Date Filed', 'Date Terminated', 'DateAgg']].apply(
+        pd.to_datetime, yearfirst=True,
+        dayfirst=False, errors='coerce')
+    mask = df['IsProse'] == 'y'
+    df1 = df[mask]
+    caseids = df1['Case ID'].tolist()
+    asyncio.run(main(*caseids))
@@ -25,3 +25,30 @@ class Config:
     pending_cases_endpoint = os.getenv("PENDING_CASES_ENDPOINT")
     pending_cases_endpoint_by_judge = os.getenv("PENDING_CASES_ENDPOINT_BY_JUDGE")
     time_in_court_endpoint = os.getenv("TIME_IN_COURT")
+    api_timeout = float(os.getenv("API_TIMEOUT", 300.0))
+    api_connect_timeout = float(os.getenv("API_CONNECT_TIMEOUT", 30.0))
+    fetch_concurrency = int(os.getenv("FETCH_CONCURRENCY", 10))
+    fetch_concurrency_min = int(os.getenv("FETCH_CONCURRENCY_MIN", 1))
+    fetch_concurrency_max = int(os.getenv("FETCH_CONCURRENCY_MAX", 64))
+    fetch_decrease_factor = float(os.getenv("FETCH_DECREASE_FACTOR", 0.5))
+    fetch_latency_tolerance = float(os.getenv("FETCH_LATENCY_TOLERANCE", 3.0))
+    fetch_retry_after_cap = float(os.getenv("FETCH_RETRY_AFTER_CAP", 300.0))
+    fetch_retries = int(os.getenv("FETCH_RETRIES", 4))
+    fetch_backoff_base = float(os.getenv("FETCH_BACKOFF_BASE", 1.0))
+    fetch_backoff_cap = float(os.getenv("FETCH_BACKOFF_CAP", 60.0))
+    fetch_chunk_size = int(os.getenv("FETCH_CHUNK_SIZE", 50))
+    fetch_chunk_max = int(os.getenv("FETCH_CHUNK_MAX", 500))
+    fetch_chunk_target_latency = float(os.getenv("FETCH_CHUNK_TARGET_LATENCY", 10.0))
+    fetch_chunk_max_rows = int(os.getenv("FETCH_CHUNK_MAX_ROWS", 100000))
+    get_data_chunk_size = int(os.getenv("GET_DATA_CHUNK_SIZE", 200))
+    token_cache_path = os.getenv("API_TOKEN_CACHE", os.path.expanduser("~/.cache/cpi_program/token.json"))
+    token_ttl = int(os.getenv("API_TOKEN_TTL", 3600))
+    token_refresh_margin = int(os.getenv("API_TOKEN_REFRESH_MARGIN", 300))
+    response_cache_dir = os.getenv("RESPONSE_CACHE_DIR", os.path.expanduser("~/.cache/cpi_program/responses"))
+    response_cache_ttl = float(os.getenv("RESPONSE_CACHE_TTL", 24 * 3600))
+    response_cache_max_bytes = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+    docket_database_uri = os.getenv("DOCKET_DATABASE_URI")
+    dataset_case_bucket_size = int(os.getenv("DATASET_CASE_BUCKET_SIZE", 1000))
+    stage_cache_dir = os.getenv("STAGE_CACHE_DIR", os.path.expanduser("~/.cache/cpi_program/stages"))
+    stage_cache_max_bytes = int(os.getenv("STAGE_CACHE_MAX_BYTES", 5 * 1024 ** 3))
+    stage_cache_enabled = os.getenv("STAGE_CACHE", "on").lower() not in ("0", "off", "false", "no")
@@ -1,11 +1,11 @@
-import pandas as pd
 import datetime
 from configuration.config import Config
 from db.dbsession import get_postgres_db_session
-from services.api_services import ApiSession, get_data
+from services.api_services import ApiSession, get_data_concurrently
+from services.cache_services import ResponseCache
 from services.db_services import get_reflected_tables
 from services.case_services import get_civil_cases_by_date, create_event
-from services.dataframe_services import create_merged_df, add_nos_grouping
+from services.dataframe_services import create_merged_df_from_candidates, add_nos_grouping
 
 api = ApiSession.instance()
 get_postgres_db_session()
@@ -27,67 +27,28 @@ def main():
     pro_se = stats[mask]
     pro_se.to_csv('/Users/jwt/PycharmProjects/cpi_program/data_files/pro_se.csv', index=False)
 
-    # retrieve complaints from ecf for cases
-    url = f'{api_base_url}{config.docket_entries_by_case_and_type}'
+    # retrieve complaints, habeas complaints, 2255 motions, notices of removal, emergency injunctions and bankruptcy
+    # appeals from ecf for cases; the six queries run at the same time
+    type_url = f'{api_base_url}{config.docket_entries_by_case_and_type}'
+    subtype_url = f'{api_base_url}{config.docket_entries_by_case_and_typeSub}'
     params = {'documents': False, 'docket_text': False}
     case_ids = pro_se['Case ID'].to_list()
-    complaints = get_data(case_ids, api.access_token, url, params, event=None,
-                          overall_type='cmp')
-    complaints.to_csv('/Users/jwt/PycharmProjects/cpi_program/data_files/complaints.csv', index=False)
-
-    # retrieve habeas complaints from ecf for cases
-    url = f'{api_base_url}{config.docket_entries_by_case_and_typeSub}'
-    event = create_event(('motion', 'pwrithc'))
-    habeas_complaints = get_data(case_ids, api.access_token, url, params, event=event,
-                                 overall_type=None)
-    habeas_complaints.to_csv('/Users/jwt/PycharmProjects/cpi_program/data_files/habeas_complaints.csv', index=False)
-
-    # retrieve 2255 motions from ecf for cases
-    params = {'documents': False, 'docket_text': False}
-    event = create_event(('motion', '2255'))
-    motion_2255 = get_data(case_ids, api.access_token, url, params, event=event,
-                           overall_type=None)
-    motion_2255.to_csv('/Users/jwt/PycharmProjects/cpi_program/data_files/motion_2255.csv', index=False)
-
-    # retrieve notice of removal from ecf for cases
-    params = {'documents': False, 'docket_text': False}
-    event = create_event(('notice', 'ntcrem'))
-    notice_removal = get_data(case_ids, api.access_token, url, params, event=event,
-                              overall_type=None)
-    notice_removal.to_csv('/Users/jwt/PycharmProjects/cpi_program/data_files/notice_removal.csv', index=False)
-
-    # retrieve emergency injunctions from ecf for cases
-
-    params = {'documents': False, 'docket_text': False}
-    event = create_event(('motion', 'emerinj'))
-    injunctions = get_data(case_ids, api.access_token, url, params, event=event,
-                           overall_type=None)
-    injunctions.to_csv('/Users/jwt/PycharmProjects/cpi_program/data_files/injunctions.csv', index=False)
-
-    # retrieve bankruptcy  appeals from ecf for cases
-    params = {'documents': False, 'docket_text': False}
-    event = create_event(('appeal', 'bkntc'))
-    bk_appeal = get_data(case_ids, api.access_token, url, params, event=event,
-                         overall_type=None)
-    bk_appeal.to_csv('/Users/jwt/PycharmProjects/cpi_program/data_files/bk_appeal.csv', index=False)
-
-    # merge complaint dataframes
-    complaints_df = create_merged_df(pro_se, complaints)
-
-    # habeas corpus complaints
-    habeas_df = create_merged_df(pro_se, habeas_complaints)
-
-    # 2255 motions
-    df_2255 = create_merged_df(pro_se, motion_2255)
-
-    # Notice of Removals
-    notice_df = create_merged_df(pro_se, notice_removal)
-
-    injunctions_df = create_merged_df(pro_se, injunctions)
-
-    df = pd.concat(
-        [complaints_df, habeas_df, df_2255, notice_df, injunctions_df], ignore_index=True)
-    df.drop_duplicates(subset=['Case ID'], keep='first', inplace=True)
+    queries = {'complaints': (type_url, None, 'cmp'),
+               'habeas_complaints': (subtype_url, create_event(('motion', 'pwrithc')), None),
+               'motion_2255': (subtype_url, create_event(('motion', '2255')), None),
+               'notice_removal': (subtype_url, create_event(('notice', 'ntcrem')), None),
+               'injunctions': (subtype_url, create_event(('motion', 'emerinj')), None),
+               'bk_appeal': (subtype_url, create_event(('appeal', 'bkntc')), None)}
+    # closed cases do not change between runs; reuse earlier responses and revalidate stale ones
+    frames = get_data_concurrently(case_ids, params, queries, api.tokens, cache=ResponseCache())
+    for name, frame in frames.items():
+        frame.to_csv(f'/Users/jwt/PycharmProjects/cpi_program/data_files/{name}.csv', index=False)
+
+    # merge complaints, habeas corpus complaints, 2255 motions, notices of removal and injunctions in one pass; a case
+    # takes its row from the first of these that it appears in
+    df = create_merged_df_from_candidates(pro_se, [frames['complaints'], frames['habeas_complaints'],
+                                                   frames['motion_2255'], frames['notice_removal'],
+                                                   frames['injunctions']])
     df.to_csv('/Users/jwt/PycharmProjects/cpi_program/data_files/prose_merged.csv', index=False)
 
 
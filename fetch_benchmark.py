@@ -0,0 +1,203 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import multiprocessing
+import socket
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+from typing import Callable, Dict, List
+
+import aiohttp
+import numpy as np
+import pandas as pd
+from colorama import Fore
+
+from configuration.config import Config
+from services.api_connection import TokenManager
+from services.api_services import get_data_async
+from services.cache_services import ResponseCache
+from services.concurrency_services import AdaptiveLimiter
+from services.case_services import create_event
+from services.fetch_services import FetchRequest, create_connector, fetch_all, fetch_batched, fetch_case_bundles, \
+    write_to_store
+from services.store_services import CaseStore
+from test.mock_ecf_server import MockEcfSettings, configure, run_server
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_server(port: int, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f'mock server did not start on port {port}')
+
+
+def _latency_trace(latencies: List[float]) -> aiohttp.TraceConfig:
+    """
+    Records the time from sending each HTTP request to receiving its response headers
+    """
+
+    async def on_request_start(session, context, params):
+        context.start = asyncio.get_running_loop().time()
+
+    async def on_request_end(session, context, params):
+        latencies.append(asyncio.get_running_loop().time() - context.start)
+
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(on_request_start)
+    trace.on_request_end.append(on_request_end)
+    return trace
+
+
+async def _docket_entries(session, caseids, workdir, auth, cache):
+    base = Config.base_api_url
+    store = CaseStore(f'{workdir}/docket_entries')
+    requests = [FetchRequest(caseid, f'{base}/cases/entries/{caseid}', {'documents': 'false', 'docket_text': 'true'})
+                for caseid in caseids]
+    return await fetch_all(session, requests, headers={'Content-Type': 'application/json'},
+                           on_result=write_to_store(store), auth=auth, cache=cache)
+
+
+async def _docket_entries_batched(session, caseids, workdir, auth, cache):
+    store = CaseStore(f'{workdir}/docket_entries_batched')
+    return await fetch_batched(session, caseids, {'Content-Type': 'application/json'},
+                               params={'documents': 'false', 'docket_text': 'true'}, on_result=write_to_store(store),
+                               auth=auth, cache=cache)
+
+
+async def _deadlines(session, caseids, workdir, auth, cache, params=None, name='deadlines'):
+    base = Config.base_api_url
+    store = CaseStore(f'{workdir}/{name}')
+    requests = [FetchRequest(caseid, f'{base}/cases/deadlines/{caseid}', params) for caseid in caseids]
+    return await fetch_all(session, requests, headers={'Content-Type': 'application/json'},
+                           on_result=write_to_store(store), auth=auth, cache=cache)
+
+
+async def _hearings(session, caseids, workdir, auth, cache):
+    return await _deadlines(session, caseids, workdir, auth, cache, params={'deadline_class': 'hrg'}, name='hearings')
+
+
+async def _refresh(session, caseids, workdir, auth, cache):
+    stores = {name: CaseStore(f'{workdir}/refresh_{name}') for name in ('entries', 'deadlines', 'hearings')}
+    return await fetch_case_bundles(session, caseids, {'Content-Type': 'application/json'}, stores=stores, auth=auth,
+                                    cache=cache)
+
+
+async def _cpi_stats(session, caseids, workdir, auth, cache):
+    base = Config.base_api_url
+    params = {'documents': False, 'docket_text': False}
+    queries = [(Config.docket_entries_by_case_and_type, None, 'cmp'),
+               (Config.docket_entries_by_case_and_typeSub, create_event(('motion', 'pwrithc')), None),
+               (Config.docket_entries_by_case_and_typeSub, create_event(('motion', '2255')), None),
+               (Config.docket_entries_by_case_and_typeSub, create_event(('notice', 'ntcrem')), None),
+               (Config.docket_entries_by_case_and_typeSub, create_event(('motion', 'emerinj')), None),
+               (Config.docket_entries_by_case_and_typeSub, create_event(('appeal', 'bkntc')), None)]
+    # like get_data_concurrently, on the benchmark's session
+    limiter = AdaptiveLimiter()
+    return await asyncio.gather(*[get_data_async(session, caseids, None, f'{base}{endpoint}', params, event,
+                                                 overall_type, auth=auth, cache=cache, limiter=limiter)
+                                  for endpoint, event, overall_type in queries])
+
+
+# one scenario per fetch script, doing what the script does against the mock server
+SCENARIOS: Dict[str, Callable] = {'case_docket_entries': _docket_entries,
+                                  'case_docket_entries --batch': _docket_entries_batched,
+                                  'case_deadlines': _deadlines,
+                                  'case_hearings': _hearings,
+                                  'case_refresh': _refresh,
+                                  'cpi_stats': _cpi_stats}
+
+
+async def run_scenario(name: str, caseids: List[int], workdir: str, use_cache: bool) -> Dict:
+    """
+    Runs one scenario and measures it. Peak memory is the Python heap of this process as seen by tracemalloc, which
+    does not include the server running in its own process.
+    """
+    latencies: List[float] = []
+    auth = TokenManager(cache_path=f'{workdir}/token.json')
+    # scenarios share URLs, so each gets its own cache to keep the first run of every scenario cold
+    cache = ResponseCache(f'{workdir}/responses/{name.replace(" ", "_")}') if use_cache else None
+    tracemalloc.start()
+    start = time.perf_counter()
+    # the fetch layer reports every request; keep that out of the measurement
+    with contextlib.redirect_stdout(io.StringIO()):
+        async with aiohttp.ClientSession(connector=create_connector(),
+                                         trace_configs=[_latency_trace(latencies)]) as session:
+            await SCENARIOS[name](session, caseids, workdir, auth, cache)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'scenario': name, 'requests': len(latencies), 'seconds': round(elapsed, 3),
+            'requests/s': round(len(latencies) / elapsed, 1) if elapsed else None,
+            'p50 ms': round(float(np.percentile(latencies, 50)) * 1000, 1) if latencies else None,
+            'p99 ms': round(float(np.percentile(latencies, 99)) * 1000, 1) if latencies else None,
+            'peak MB': round(peak / 1024 ** 2, 1)}
+
+
+def main(args: SimpleNamespace) -> pd.DataFrame:
+    """
+    Starts the mock ECF API in a separate process, points Config at it and runs every requested scenario in turn
+    """
+    settings = MockEcfSettings(latency=args.latency, latency_per_row=args.latency_per_row, jitter=args.jitter,
+                               error_rate=args.error_rate, error_statuses=(429, 503), retry_after=args.retry_after,
+                               entries=args.entries, text_size=args.text_size,
+                               cases=args.cases, seed=args.seed)
+    port = _free_port()
+    server = multiprocessing.Process(target=run_server, args=(settings, '127.0.0.1', port), daemon=True)
+    server.start()
+    try:
+        _wait_for_server(port)
+        configure(f'http://127.0.0.1:{port}')
+        if args.concurrency:
+            Config.fetch_concurrency = args.concurrency
+        Config.fetch_backoff_base = args.backoff_base
+        caseids = list(range(settings.first_caseid, settings.first_caseid + args.cases))
+        rows = []
+        with tempfile.TemporaryDirectory() as workdir:
+            for name in args.scenarios or SCENARIOS:
+                print(Fore.YELLOW + f'Running {name} for {len(caseids)} case(s)...', flush=True)
+                for run in range(args.repeat):
+                    row = asyncio.run(run_scenario(name, caseids, workdir, args.cache))
+                    rows.append(dict(row, run=run + 1))
+    finally:
+        server.terminate()
+        server.join()
+    report = pd.DataFrame(rows)
+    print(Fore.WHITE + report.to_string(index=False), flush=True)
+    if args.output:
+        report.to_csv(args.output, index=False)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the fetch scripts against a local mock of the ECF API')
+    parser.add_argument('--cases', type=int, default=200, help='number of cases to fetch')
+    parser.add_argument('--scenarios', nargs='*', choices=list(SCENARIOS), help='scenarios to run, default all')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='runs per scenario; with --cache later runs are served from the response cache')
+    parser.add_argument('--latency', type=float, default=0.02, help='server latency per response in seconds')
+    parser.add_argument('--latency-per-row', type=float, default=0.0, help='server latency per row in seconds')
+    parser.add_argument('--jitter', type=float, default=0.2, help='fraction of the latency varied at random')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 429 or 503')
+    parser.add_argument('--retry-after', type=float, default=None, help='Retry-After sent with injected errors')
+    parser.add_argument('--entries', type=int, default=60, help='average docket entries per case')
+    parser.add_argument('--text-size', type=int, default=200, help='approximate length of the docket text')
+    parser.add_argument('--concurrency', type=int, default=None,
+                        help='initial number of requests in flight, overrides FETCH_CONCURRENCY')
+    parser.add_argument('--backoff-base', type=float, default=0.05, help='first retry backoff window in seconds')
+    parser.add_argument('--cache', action='store_true', help='use a response cache shared by the runs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='also write the report to this CSV file')
+    main(parser.parse_args())
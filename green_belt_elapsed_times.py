@@ -1,10 +1,9 @@
 import pandas as pd
 import numpy as np
-import dill
 import openpyxl
 
-with open('data_files/green_belt_dates.pkl', 'rb') as f:
-    df = dill.load(f)
+from services.dataset_services import read_dataset
+from services.stage_cache_services import StageCache
 
 
 def _calculate_total_elapsed_time(complaint_date, transfer_date, ua_date, dismissal_date, full_fee_paid,
@@ -24,46 +23,51 @@ def _calculate_total_elapsed_time(complaint_date, transfer_date, ua_date, dismis
     return total_elapsed_time
 
 
-df = pd.DataFrame(df)
+def calculate_elapsed_times():
+    df = read_dataset('data_files/green_belt_dates')
+    df['complaint_date'] = pd.to_datetime(df['complaint_date'])
+    df['ifp_submission_date'] = pd.to_datetime(df['ifp_submission_date'])
+    df['ifp_order_submission_date'] = pd.to_datetime(df['ifp_order_submission_date'])
+    df['partial_payment_date'] = pd.to_datetime(df['partial_payment_date'])
+    df['transfer_date'] = pd.to_datetime(df['transfer_date'])
 
-df['complaint_date'] = pd.to_datetime(df['complaint_date'])
-df['ifp_submission_date'] = pd.to_datetime(df['ifp_submission_date'])
-df['ifp_order_submission_date'] = pd.to_datetime(df['ifp_order_submission_date'])
-df['partial_payment_date'] = pd.to_datetime(df['partial_payment_date'])
-df['transfer_date'] = pd.to_datetime(df['transfer_date'])
+    df['IFP_Submission_Elapsed_Time'] = (df['ifp_submission_date'] - df['complaint_date']).dt.days
+    df['IFP_Submission_Elapsed_Time'] = df['IFP_Submission_Elapsed_Time'].astype('Int64')
+    df['IFP_Submission_Elapsed_Time'].fillna(0, inplace=True)
 
-df['IFP_Submission_Elapsed_Time'] = (df['ifp_submission_date'] - df['complaint_date']).dt.days
-df['IFP_Submission_Elapsed_Time'] = df['IFP_Submission_Elapsed_Time'].astype('Int64')
-df['IFP_Submission_Elapsed_Time'].fillna(0, inplace=True)
+    df['IFP_Order_Elapsed_Time'] = (df['ifp_order_submission_date'] - df['ifp_submission_date']).dt.days
+    df['IFP_Order_Elapsed_Time'] = df['IFP_Order_Elapsed_Time'].astype('Int64')
+    df['IFP_Order_Elapsed_Time'].fillna(0, inplace=True)
 
-df['IFP_Order_Elapsed_Time'] = (df['ifp_order_submission_date'] - df['ifp_submission_date']).dt.days
-df['IFP_Order_Elapsed_Time'] = df['IFP_Order_Elapsed_Time'].astype('Int64')
-df['IFP_Order_Elapsed_Time'].fillna(0, inplace=True)
+    df['Payment_Elapsed_Time'] = (df['partial_payment_date'] - df['ifp_order_submission_date']).dt.days
+    df['Payment_Elapsed_Time'] = df['Payment_Elapsed_Time'].astype('Int64')
+    df['Payment_Elapsed_Time'].fillna(0, inplace=True)
 
-df['Payment_Elapsed_Time'] = (df['partial_payment_date'] - df['ifp_order_submission_date']).dt.days
-df['Payment_Elapsed_Time'] = df['Payment_Elapsed_Time'].astype('Int64')
-df['Payment_Elapsed_Time'].fillna(0, inplace=True)
+    df['Total_Elapsed_Time'] = df.apply(
+        lambda x: _calculate_total_elapsed_time(x['complaint_date'], x['transfer_date'], x['ua_date'],
+                                                x['dismissal_date_for_no_trust_fund_statement'], x['full_fee_paid'],
+                                                x['partial_payment_date']), axis=1)
 
-df['Total_Elapsed_Time'] = df.apply(
-    lambda x: _calculate_total_elapsed_time(x['complaint_date'], x['transfer_date'], x['ua_date'],
-                                            x['dismissal_date_for_no_trust_fund_statement'], x['full_fee_paid'],
-                                            x['partial_payment_date']), axis=1)
+    df_not_ua = df[df['Total_Elapsed_Time'].isnull()]
+    df_ua = df.loc[df['Total_Elapsed_Time'].notnull()]
+    df_ua['Total_Elapsed_Time'] = df_ua['Total_Elapsed_Time'].astype('Int64')
 
-df_not_ua = df[df['Total_Elapsed_Time'].isnull()]
-df_ua = df.loc[df['Total_Elapsed_Time'].notnull()]
-df_ua['Total_Elapsed_Time'] = df_ua['Total_Elapsed_Time'].astype('Int64')
+    # df['Total_Elapsed_Time'].fillna(0, inplace=True)
 
+    df_ua_agg = df_ua[['caseid', 'case_type', 'case_number', 'Total_Elapsed_Time', 'IFP_Submission_Elapsed_Time',
+                       'IFP_Order_Elapsed_Time', 'Payment_Elapsed_Time']]
+    # df_not_ua_agg = df_not_ua[['caseid', 'case_type', 'case_number', 'Total_Elapsed_Time',
+    #                            'IFP_Submission_Elapsed_Time', 'IFP_Order_Elapsed_Time', 'Payment_Elapsed_Time']]
+    return {'cases': df, 'ua_cases': df_ua, 'ua_times': df_ua_agg}
 
-# df['Total_Elapsed_Time'].fillna(0, inplace=True)
 
+# the workbook below can be reworked without recalculating the elapsed times
+outputs = StageCache().run('green_belt_elapsed_times', calculate_elapsed_times, inputs=['data_files/green_belt_dates'],
+                           code=[calculate_elapsed_times, _calculate_total_elapsed_time])
 
-df_ua_agg = df_ua[['caseid', 'case_type', 'case_number', 'Total_Elapsed_Time', 'IFP_Submission_Elapsed_Time',
-                   'IFP_Order_Elapsed_Time', 'Payment_Elapsed_Time']]
-# df_not_ua_agg = df_not_ua[['caseid', 'case_type', 'case_number', 'Total_Elapsed_Time', 'IFP_Submission_Elapsed_Time',
-#                            'IFP_Order_Elapsed_Time', 'Payment_Elapsed_Time']]
 with pd.ExcelWriter('data_files/green_belt_metrics.xlsx') as writer:
-    df.to_excel(writer, sheet_name='Case Data Raw')
-    df_ua.to_excel(writer, sheet_name='UA Case Data Raw')
-    df_ua_agg.to_excel(writer, sheet_name='UA Case Data Times')
+    outputs['cases'].to_excel(writer, sheet_name='Case Data Raw')
+    outputs['ua_cases'].to_excel(writer, sheet_name='UA Case Data Raw')
+    outputs['ua_times'].to_excel(writer, sheet_name='UA Case Data Times')
     # df_not_ua.to_excel(writer, sheet_name='Not UA Case Data Raw')
     # df_not_ua_agg.to_excel(writer, sheet_name='Not UA Case Data Times')
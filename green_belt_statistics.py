@@ -1,18 +1,28 @@
+import argparse
 from collections import OrderedDict
 from datetime import datetime
 from dataclasses import dataclass, field
 from enum import Enum
-from typing import List, Optional
-from flashtext import KeywordProcessor
+from typing import Dict, List, Optional, Tuple, Union
 
-import dill
 import pandas as pd
 from colorama import Fore
 
 from util import timeit
-from services.dataframe_services import create_dataframe_docket_entries
+from services.dataset_services import write_dataset
+from services.index_services import CaseIndex
+from services.keyword_services import KeywordRule
+from services.parallel_services import balanced_chunks, resolve_jobs, run_chunks
+from services.stage_cache_services import StageCache
+from services.text_services import DocketText
+from services.dataframe_services import load_combined_docket_entries, memory_by_column
 
 date_format = '%Y-%m-%d'
+# keyword rules for docket text, compiled once per run; whole words regardless of case, as flashtext matched them
+IFP_ORDER_RULE = KeywordRule(['initial partial filing fee'], whole_words=True, ignore_case=True)
+TRUST_ORDER_RULE = KeywordRule(['trust fund account'], whole_words=True, ignore_case=True)
+UA_RULE = KeywordRule(["screening", 'complaint', 'pauperis', 'habeas', 'reopen', 'social security', 'bankruptcy',
+                       'prepayment', '2255'])
 
 
 class DismissalType(Enum):
@@ -93,18 +103,12 @@ class CaseDates:
         return _dict
 
     def _calculate_ifp_order_date(self):
-        keyword_processor = KeywordProcessor()
-        keyword_processor.add_keyword('initial partial filing fee')
-        results = [order['ua_date'] for order in self.prose_orders if
-                   len(keyword_processor.extract_keywords(order['dkt_text'])) > 0]
+        results = [order['ua_date'] for order in self.prose_orders if IFP_ORDER_RULE.search(order['dkt_text'])]
         if len(results) > 0:
             self.ifp_order_submission_date = datetime.strptime(results[0], date_format).date()
 
     def _calculate_trust_order_date(self):
-        keyword_processor = KeywordProcessor()
-        keyword_processor.add_keyword('trust fund account')
-        results = [order['ua_date'] for order in self.prose_orders if
-                   len(keyword_processor.extract_keywords(order['dkt_text'])) > 0]
+        results = [order['ua_date'] for order in self.prose_orders if TRUST_ORDER_RULE.search(order['dkt_text'])]
         if len(results) > 0:
             self.trust_fund_order_submission_date = datetime.strptime(results[0], date_format).date()
     def _calculate_ua_date(self):
@@ -113,8 +117,6 @@ class CaseDates:
 
         ua_dates = pd.DataFrame(self.ua_dates)
         if not ua_dates.empty:
-            keyword_processor = KeywordProcessor()
-            keyword_processor.add_keyword('leave to proceed in forma pauperis')
             ua_dates['ua_date'] = [datetime.strptime(x, date_format) for x in ua_dates['ua_date']]
 
             ua_dates['ua_date'] = pd.to_datetime(ua_dates['ua_date'])
@@ -124,26 +126,17 @@ class CaseDates:
             self.ua_date = None
 
 
-def _find_target_dates(df: pd.DataFrame, keywords: List[str], check_all: bool = False) -> List[tuple]:
+def _find_target_dates(df: pd.DataFrame, rule: KeywordRule) -> List[tuple]:
     """
-    Function to find dates for a case.  Utilizes keywords to find candidate dates and appends
-    to a list.
+    Function to find dates for a case.  Utilizes a keyword rule to find candidate dates and returns them as a list.
 
     :param df: dataframe of events for that case
-    :param keywords: list of keywords to search for
+    :param rule: compiled keywords to search for, any or all of them
+    :return: (date filed, text, seqno) of the matching events, in docket order
     """
-    df['dt_text'] = df['dt_text'].str.lower()
-    target_dates = []
-
-    for index, row in df.iterrows():
-        a_string = row['dt_text']
-        if check_all:
-            if all(x in a_string for x in keywords):
-                target_dates.append((row['de_date_filed'], row['dt_text'], row['de_seqno']))
-        else:
-            if any(x in a_string for x in keywords):
-                target_dates.append((row['de_date_filed'], row['dt_text'], row['de_seqno']))
-    return target_dates
+    # the text is lowercased once, when the case's entries are taken, see get_docker_entries_for_case
+    found = df.loc[rule.mask(df['dt_text'])]
+    return list(zip(found['de_date_filed'].tolist(), found['dt_text'].tolist(), found['de_seqno'].tolist()))
 
 
 def _find_complaint(target: pd.DataFrame) -> CaseDates:
@@ -240,9 +233,7 @@ def _get_ua_dates_for_later_processing(case_dates, target):
     else:
         ua = target.loc[target['dp_sub_type'] == 'madv']
         if not ua.empty:
-            matches = ["screening", 'complaint', 'pauperis', 'habeas', 'reopen',
-                       'social security', 'bankruptcy', 'prepayment', '2255']
-            ua_dates = _find_target_dates(ua, matches)
+            ua_dates = _find_target_dates(ua, UA_RULE)
             if ua_dates:
                 for ua_date in ua_dates:
                     case_dates.ua_dates.append({'ua_date': ua_date[0], 'ua_text': ua_date[1]})
@@ -349,28 +340,61 @@ def _check_for_prose_orders(case_dates, target):
     return case_dates
 
 
-def get_docker_entries_for_case(caseid, df_entries):
-    target = df_entries.loc[df_entries['de_caseid'] == caseid]
+def get_docker_entries_for_case(caseid, df_entries: Union[pd.DataFrame, CaseIndex],
+                                docket_text: Optional[DocketText] = None):
+    """
+    Takes the entries of one case and puts their docket text back on them
+
+    :param caseid: case ID
+    :param df_entries: docket entries indexed by de_caseid, or a dataframe of docket entries
+    :param docket_text: store the text was popped into; when None the text is still in df_entries and is lowercased here
+    """
+    if isinstance(df_entries, CaseIndex):
+        target = df_entries.get(caseid)
+    else:
+        target = df_entries.loc[df_entries['de_caseid'] == caseid]
+    if docket_text is not None:
+        # already lowercased when it was stored
+        target = docket_text.attach(target)
+    else:
+        target['dt_text'] = target['dt_text'].str.lower()
     target['de_document_num'].fillna(0, inplace=True)
     target['de_document_num'] = target['de_document_num'].astype(int)
     target['dp_dpseqno_ptr'].fillna(0, inplace=True)
     target['dp_dpseqno_ptr'] = target['dp_dpseqno_ptr'].astype(int)
-    target['dt_text'] = target['dt_text'].str.lower()
-    target = combine_docket_text_into_one_row(target)
+    if target['de_seqno'].duplicated().any():
+        # entries not combined when they were loaded, see combine_docket_text
+        return combine_docket_text_into_one_row(target)
+    # the shape combine_docket_text_into_one_row leaves: a fresh index and the text last
+    target = target.reset_index(drop=True)
+    if target.columns[-1] != 'dt_text':
+        target = target[[*target.columns.drop('dt_text'), 'dt_text']]
     return target
 
 
-@timeit
-def main():
-    # get saved docket entries
-    with open('data_files/green_belt_docket_entries.pkl', 'rb') as f:
-        dataframes_entries = dill.load(f)
+def _extract_cases(cases: List[Tuple[int, str, str]], df_entries: Union[pd.DataFrame, CaseIndex],
+                   docket_text: DocketText) -> Dict[int, Optional[dict]]:
+    """
+    Finds the milestone dates of a chunk of cases; runs in a worker process when extracting in parallel
+
+    :param cases: case ID, case type and case number of each case
+    :param df_entries: docket entries of the cases, without their text, or a CaseIndex over them
+    :param docket_text: docket text of the cases
+    :return: milestone dates by case ID
+    """
+    entries = CaseIndex.of(df_entries, 'de_caseid')
+    results = {}
+    for caseid, case_type, case_number in cases:
+        target = get_docker_entries_for_case(caseid, entries, docket_text)
+        results[caseid] = get_case_milestone_dates(caseid, target, case_type, case_number)
+    return results
 
-    df_entries = create_dataframe_docket_entries(dataframes_entries)
-    df_entries['dt_text'] = df_entries['dt_text'].str.lower()
 
-    # delete dataframes to free up memory
-    del dataframes_entries
+@timeit
+def main(jobs: int = 1):
+    """
+    :param jobs: number of worker processes; 0 for one per CPU core
+    """
     ua_dates = []
     cases = pd.read_csv('data_files/civil_cases_2020-2023.csv')
     # filter dataframe to return cases where IsProse is y
@@ -389,19 +413,52 @@ def main():
 
     # caseids = [45809]
 
-    # gather information for each case and find the ua dates and deadlines
+    # get saved docket entries; only the cases and columns used below are read
+    # multi-part entries are combined once for the whole table, and the combined table is kept in the stage cache
+    store = 'data_files/green_belt_docket_entries'
+    df_entries = StageCache().run('combined_docket_entries', load_combined_docket_entries, inputs=[store],
+                                  params={'path': store, 'caseids': caseids})
+    # the text is lowercased once and kept compressed apart from the entries until a case needs it
+    docket_text = DocketText.pop(df_entries)
+    print(Fore.WHITE + f'Docket entries by column:\n{memory_by_column(df_entries)}', flush=True)
+    print(Fore.WHITE + f'Docket text: {docket_text.nbytes / 1024 ** 2:.1f} MB compressed', flush=True)
+
+    # index both frames by case once, so that each case below takes its rows without scanning the others
+    case_index = CaseIndex(cases, 'Case ID')
+    entries = CaseIndex(df_entries, 'de_caseid')
+    del df_entries
+
+    # gather information for each case and find the ua dates; each chunk of cases gets only its own rows
+    jobs = resolve_jobs(jobs)
+    chunks = balanced_chunks(caseids, {caseid: entries.rows(caseid) for caseid in caseids}, jobs)
+
+    def _payload(chunk: List[int]) -> tuple:
+        chunk_cases = [(caseid, case_index.first(caseid, 'Group'), str.strip(case_index.first(caseid, 'Case Number')))
+                       for caseid in chunk]
+        if len(chunks) == 1:
+            # extracted in this process: the index is passed as it is rather than a copy of its rows
+            return chunk_cases, entries, docket_text
+        return chunk_cases, entries.take(chunk), docket_text.subset(chunk)
+
+    # built one chunk at a time as the workers take them
+    payloads = (_payload(chunk) for chunk in chunks)
+    results = {}
+    for chunk_results in run_chunks(_extract_cases, payloads, jobs):
+        results.update(chunk_results)
+    # merged in case order, so the result does not depend on the number of jobs
     for caseid in caseids:
-        case_type = cases.loc[cases['Case ID'] == caseid, 'Group'].iloc[0]
-        case_number = str.strip(cases.loc[cases['Case ID'] == caseid, 'Case Number'].iloc[0])
-        target = get_docker_entries_for_case(caseid, df_entries)
-        ua_dates.append(get_case_milestone_dates(caseid, target, case_type, case_number))
+        ua_dates.append(results[caseid])
 
     # save objects to disk for later use
-    with open('data_files/green_belt_dates.pkl', 'wb') as f:
-        dill.dump(ua_dates, f)
+    ua_dates = pd.DataFrame([x for x in ua_dates if x is not None])
+    write_dataset(ua_dates, 'data_files/green_belt_dates', case_column='caseid')
 
     # df = calculate_intervals(df)
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Find the milestone dates of green belt cases')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of worker processes extracting cases in parallel; 0 for one per CPU core')
+    args = parser.parse_args()
+    main(jobs=args.jobs)
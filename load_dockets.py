@@ -0,0 +1,29 @@
+import argparse
+
+from colorama import Fore
+
+from models.docket import DocketDeadline, DocketEntry, DocketHearing
+from services.docket_db_services import DocketDatabase
+from services.store_services import CaseStore
+from util import timeit
+
+
+@timeit
+def main(batch_size: int = 500):
+    """
+    Loads the fetched docket entries, deadlines and hearings into the docket database so that single cases and event
+    subtypes can be queried without loading every case. Cases already in the database are replaced.
+    """
+    db = DocketDatabase.from_config()
+    for model, path in ((DocketEntry, 'data_files/docket_entries'),
+                        (DocketDeadline, 'data_files/deadlines'),
+                        (DocketHearing, 'data_files/hearings')):
+        rows = db.load(model, CaseStore(path), batch_size=batch_size)
+        print(Fore.GREEN + f'{model.__tablename__}: {rows} row(s) loaded', flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load fetched dockets into the docket database')
+    parser.add_argument('--batch-size', type=int, default=500, help='cases loaded per transaction')
+    args = parser.parse_args()
+    main(batch_size=args.batch_size)
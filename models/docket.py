@@ -0,0 +1,57 @@
+from sqlalchemy import Column, Date, Index, Integer, String, Text
+
+from db.modelbase import Base
+
+
+class DocketEntry(Base):
+    """
+    One row of a case docket as returned by the docket entries endpoints. Multi-part entries have one row per part.
+    """
+    __tablename__ = 'docket_entries'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    de_caseid = Column(Integer, nullable=False)
+    de_seqno = Column(Integer, nullable=False)
+    dp_seqno = Column(Integer)
+    dp_partno = Column(Integer)
+    dp_dpseqno_ptr = Column(Integer)
+    dp_deseqno_ptr = Column(Integer)
+    de_type = Column(String(16))
+    dp_type = Column(String(16))
+    dp_sub_type = Column(String(16))
+    de_document_num = Column(Integer)
+    de_date_filed = Column(Date)
+    de_date_enter = Column(Date)
+    dp_dispositive = Column(String(4))
+    dp_action_type = Column(String(16))
+    dt_text = Column(Text)
+
+    __table_args__ = (Index('ix_docket_entries_case_subtype', 'de_caseid', 'dp_sub_type'),
+                      Index('ix_docket_entries_case_seqno', 'de_caseid', 'de_seqno'))
+
+
+class _ScheduleColumns:
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    sd_caseid = Column(Integer, nullable=False)
+    sd_seqno = Column(Integer)
+    sd_class = Column(String(8))
+    sd_type = Column(String(16))
+    sd_dtset = Column(Date)
+    sd_dtsatis = Column(Date)
+    de_seqno = Column(Integer)
+
+
+class DocketDeadline(_ScheduleColumns, Base):
+    """
+    A deadline set in a case, as returned by the case deadlines endpoint
+    """
+    __tablename__ = 'docket_deadlines'
+    __table_args__ = (Index('ix_docket_deadlines_case_type', 'sd_caseid', 'sd_type'),)
+
+
+class DocketHearing(_ScheduleColumns, Base):
+    """
+    A hearing set in a case, as returned by the case deadlines endpoint for deadline class hrg
+    """
+    __tablename__ = 'docket_hearings'
+    __table_args__ = (Index('ix_docket_hearings_case_type', 'sd_caseid', 'sd_type'),)
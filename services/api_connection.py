@@ -1,17 +1,136 @@
+"""
+Module that obtains bearer tokens from the ecfapi token endpoint. Tokens are requested lazily on first use, cached on
+disk together with their expiry so that consecutive runs can share one login, and refreshed shortly before they
+expire.
+
+"""
+import asyncio
+import base64
+import json
+import os
+import time
+import weakref
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Optional
+
 import httpx
 
 from configuration.config import Config
 
 
+def _request_token() -> Dict:
+    config = Config()
+    data = {'username': config.username, 'password': config.password}
+    r = httpx.post(config.token_url, data=data, verify=False)
+    r.raise_for_status()
+    return r.json()
+
+
 def get_api_token():
     """
     Get the API token from the ecfapi endpoint.
     """
-    config = Config()
-    url = config.token_url
-    data = {'username': config.username, 'password': config.password}
-    r = httpx.post(url, data=data, verify=False)
-    return r.json()['access_token']
+    return _request_token()['access_token']
+
+
+def _jwt_expiry(token: str) -> Optional[float]:
+    """
+    Reads the exp claim of a JWT without verifying it. Returns None for tokens that are not JWTs.
+    """
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))['exp'])
+    except (IndexError, ValueError, KeyError, TypeError):
+        return None
+
+
+class TokenManager:
+    """
+    Caches the API bearer token in memory and on disk and refreshes it before it expires
+    """
+
+    def __init__(self, cache_path: Optional[str] = None):
+        config = Config()
+        self.cache_path = Path(cache_path or config.token_cache_path)
+        self.username = config.username
+        self.refresh_margin = config.token_refresh_margin
+        self.ttl = config.token_ttl
+        self.access_token: Optional[str] = None
+        self.expires_at = 0.0
+        self._rejected: Optional[str] = None
+        self._lock = Lock()
+        # one per event loop, as an asyncio.Lock cannot be shared between loops
+        self._async_locks: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]' = \
+            weakref.WeakKeyDictionary()
+
+    def _valid(self) -> bool:
+        return bool(self.access_token) and time.time() < self.expires_at - self.refresh_margin
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_path) as f:
+                cached = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        if cached.get('username') == self.username and cached.get('access_token') != self._rejected:
+            self.access_token = cached.get('access_token')
+            self.expires_at = cached.get('expires_at', 0.0)
+
+    def _save_cache(self):
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.cache_path.with_suffix('.tmp')
+        # the token grants API access, so keep the cache readable by the owner only
+        with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            json.dump({'username': self.username, 'access_token': self.access_token,
+                       'expires_at': self.expires_at}, f)
+        os.replace(tmp_path, self.cache_path)
+
+    def refresh(self) -> str:
+        """
+        Logs in again and caches the new token
+        """
+        response = _request_token()
+        self.access_token = response['access_token']
+        if response.get('expires_in'):
+            self.expires_at = time.time() + float(response['expires_in'])
+        else:
+            self.expires_at = _jwt_expiry(self.access_token) or time.time() + self.ttl
+        self._save_cache()
+        return self.access_token
 
+    def get_token(self) -> str:
+        """
+        Returns a token that is valid for at least the refresh margin, logging in only when needed
+        """
+        with self._lock:
+            if not self._valid():
+                self._load_cache()
+            if not self._valid():
+                self.refresh()
+            return self.access_token
 
+    async def get_token_async(self) -> str:
+        """
+        get_token for coroutines. A login runs on a worker thread so that the requests in flight carry on, and the
+        coroutines that find the token expired wait for that one login instead of each logging in.
+        """
+        if self._valid():
+            return self.access_token
+        lock = self._async_locks.setdefault(asyncio.get_running_loop(), asyncio.Lock())
+        async with lock:
+            if self._valid():
+                return self.access_token
+            return await asyncio.to_thread(self.get_token)
 
+    def invalidate(self, token: str):
+        """
+        Marks a token rejected by the server (401) as expired. Only the token that was rejected is dropped so that many
+        requests failing at once trigger a single login.
+        """
+        with self._lock:
+            self._rejected = token
+            if token == self.access_token:
+                self.access_token = None
+                self.expires_at = 0.0
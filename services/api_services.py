@@ -4,14 +4,49 @@ a Pandas DataFrame and returned to the calling function.
 
 """
 
-from typing import Dict
+import asyncio
+import atexit
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Awaitable, Dict, Optional, Tuple, TypeVar
+
+import aiohttp
 import httpx
 import pandas as pd
+from colorama import Fore
 
 from configuration.config import Config
+from services.api_connection import TokenManager
+from services.cache_services import ResponseCache
+from services.concurrency_services import AdaptiveLimiter
+from services.fetch_services import FetchRequest, FetchResult, create_connector, fetch_all
+from util.json_columns import decode_data
+
+
+class _TokenAuth(httpx.Auth):
+    """
+    Adds the bearer token to every request of the sync client and logs in again once when a token is rejected
+    """
+
+    def __init__(self, tokens: TokenManager):
+        self.tokens = tokens
+
+    def auth_flow(self, request: httpx.Request):
+        token = self.tokens.get_token()
+        request.headers['Authorization'] = f'Bearer {token}'
+        response = yield request
+        if response.status_code == 401:
+            self.tokens.invalidate(token)
+            request.headers['Authorization'] = f'Bearer {self.tokens.get_token()}'
+            yield request
 
 
 class ApiSession:
+    """
+    Single entry point to the ECF API. Owns the token manager and long-lived keep-alive connection pools: an httpx
+    client for sync callers and one aiohttp session per event loop for async callers. Auth, default headers, timeouts
+    and pool limits are set here so that scripts only say what to fetch.
+    """
     _instance = None
 
     def __init__(self):
@@ -19,43 +54,165 @@ class ApiSession:
 
     @classmethod
     def instance(cls):
+        # no network call here: the token is requested the first time access_token is read
         if cls._instance is None:
             cls._instance = cls.__new__(cls)
-            cls._instance.access_token = ApiSession._get_api_token(cls)
+            cls._instance.tokens = TokenManager()
             cls._instance.url = Config.base_api_url
-            cls._instance.headers = {'Authorization': f'Bearer {cls._instance.access_token}'}
+            cls._instance._client = None
+            cls._instance._async_session = None
+            cls._instance._async_loop = None
+            cls._instance._async_users = 0
+            atexit.register(cls._instance.close)
         return cls._instance
 
-    def _get_api_token(self) -> str:
+    @property
+    def access_token(self) -> str:
+        return self.tokens.get_token()
+
+    @property
+    def headers(self) -> Dict:
+        return {'Authorization': f'Bearer {self.access_token}'}
+
+    @property
+    def client(self) -> httpx.Client:
+        """
+        Keep-alive httpx client shared by every sync request, created on first use
+        """
+        if self._client is None or self._client.is_closed:
+            config = Config()
+            self._client = httpx.Client(auth=_TokenAuth(self.tokens), headers={'Accept': 'application/json'},
+                                        timeout=httpx.Timeout(config.api_timeout, connect=config.api_connect_timeout),
+                                        limits=httpx.Limits(max_connections=config.fetch_concurrency_max,
+                                                            max_keepalive_connections=config.fetch_concurrency_max),
+                                        verify=False)
+        return self._client
+
+    @contextlib.asynccontextmanager
+    async def session(self) -> AsyncIterator[aiohttp.ClientSession]:
         """
-        Get the API token from the ecfapi endpoint.
+        Shared aiohttp session for the running event loop. Nested uses get the same session, which is closed when the
+        outermost use ends. Requests made with it still need auth=ApiSession.instance().tokens in the fetch layer,
+        which refreshes the token while a long run is in progress.
+
+        Usage:
+        async with api.session() as session:
+            results = await fetch_all(session, requests, auth=api.tokens)
         """
-        config = Config()
-        url = config.token_url
-        data = {'username': config.username, 'password': config.password}
-        r = httpx.post(url, data=data, verify=False)
-        return r.json()['access_token']
+        loop = asyncio.get_running_loop()
+        session = self._async_session
+        if session is None or session.closed or self._async_loop is not loop:
+            config = Config()
+            session = aiohttp.ClientSession(connector=create_connector(), headers={'Accept': 'application/json'},
+                                            timeout=aiohttp.ClientTimeout(total=config.api_timeout,
+                                                                          connect=config.api_connect_timeout))
+            self._async_session = session
+            self._async_loop = loop
+            self._async_users = 0
+        self._async_users += 1
+        try:
+            yield session
+        finally:
+            self._async_users -= 1
+            if not self._async_users:
+                self._async_session = None
+                await session.close()
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def _data(self, response: httpx.Response) -> pd.DataFrame:
+        response.raise_for_status()
+        return decode_data(response.content)
 
     def get(self, url: str, payload: Dict = None) -> pd.DataFrame:
+        return self._data(self.client.get(url, params=_query_params(payload)))
+
+    def post(self, url: str, payload: Dict = None) -> pd.DataFrame:
         if payload:
-            r = httpx.get(url, params=payload, headers=self.headers, verify=False, timeout=None).json()
-        else:
-            r = httpx.get(url).json()
-        return pd.DataFrame(r['data'])
+            return self._data(self.client.post(url, json=payload))
+        return self.get(url)
+
+
+T = TypeVar('T')
+
+
+def _run(coroutine: Awaitable[T]) -> T:
+    """
+    Runs a coroutine to completion for the sync wrappers. asyncio.run refuses to start a loop inside a running one, so
+    when called from async code or a notebook the coroutine runs on its own loop in a worker thread, and the calling
+    loop is blocked until it is done; async callers should await get_data_async instead
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
 
-    def post(self, **kwargs):
-        httpx.headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
-        if kwargs['payload']:
-            r = s.post(kwargs['url'], json=kwargs['payload']).json()
-        else:
-            r = s.get(kwargs['url']).json()
-        return pd.DataFrame(r['data'])
 
+def _query_params(params: Optional[Dict]) -> Optional[Dict]:
+    # aiohttp only accepts str, int and float query values; the API expects lowercase booleans
+    if not params:
+        return params
+    return {key: str(value).lower() if isinstance(value, bool) else value for key, value in params.items()}
 
-def get_data(case_ids, access_token, url, params, event, overall_type) -> pd.DataFrame:
+
+async def get_data_async(session: aiohttp.ClientSession, case_ids, access_token, url, params, event, overall_type,
+                         chunk_size: Optional[int] = None, auth: Optional[TokenManager] = None,
+                         cache: Optional[ResponseCache] = None,
+                         limiter: Optional[AdaptiveLimiter] = None) -> pd.DataFrame:
+    """
+    Async version of get_data that runs on a caller-supplied session. Case IDs are split into chunks that are posted
+    concurrently; each chunk is decoded into a DataFrame as soon as it arrives and the chunks are concatenated once at
+    the end. Chunks that still fail after retries are reported and their case IDs are listed in
+    df.attrs['failed_case_ids'] instead of failing the whole call.
+
+    :param session: aiohttp session shared by all chunks
+    :param chunk_size: number of case IDs per request, defaults to Config.get_data_chunk_size
+    :param auth: TokenManager used instead of access_token; refreshes the token and re-authenticates on 401
+    :param cache: optional ResponseCache; each chunk is cached by its URL, params and case IDs
+    :param limiter: AdaptiveLimiter shared with queries running at the same time
+    :return: dataframe of data
+    """
+    headers = {'Content-Type': 'application/json'}
+    if auth is None:
+        headers['Authorization'] = f'Bearer {access_token}'
+
+    if event:
+        data = {'subtype': event}
+    if overall_type:
+        data = {'overall_type': overall_type}
+    chunk_size = chunk_size or Config.get_data_chunk_size
+    chunks = [case_ids[i:i + chunk_size] for i in range(0, len(case_ids), chunk_size)]
+    requests = [FetchRequest(i, url, _query_params(params), json=dict(data, case_ids=chunk))
+                for i, chunk in enumerate(chunks)]
+    frames = {}
+
+    def _collect(result: FetchResult):
+        if result.ok:
+            frames[result.key] = result.data
+
+    results = await fetch_all(session, requests, headers=headers, on_result=_collect, auth=auth, cache=cache,
+                              limiter=limiter)
+    failed_case_ids = [case_id for result in results if not result.ok for case_id in chunks[result.key]]
+    # keep the order of the original single request
+    df = pd.concat([frames[i] for i in sorted(frames)], ignore_index=True) if frames else pd.DataFrame()
+    if failed_case_ids:
+        print(Fore.RED + f'No data for {len(failed_case_ids)} case(s) after retries: {failed_case_ids}', flush=True)
+    df.attrs['failed_case_ids'] = failed_case_ids
+    return df
+
+
+def get_data(case_ids, access_token, url, params, event, overall_type, chunk_size: Optional[int] = None,
+             auth: Optional[TokenManager] = None, cache: Optional[ResponseCache] = None) -> pd.DataFrame:
     """
    Retrieves data from the API for a list of case IDs. Makes distinction between specific event and
-   overall catagory type.
+   overall catagory type. Case IDs are posted in concurrent chunks over the ApiSession's pooled session, see
+   get_data_async. Called inside a running event loop, e.g. in Jupyter, the requests run on a worker thread and block
+   that loop until they are done; async code should await get_data_async instead.
 
    :param case_ids: list of case IDs
    :param access_token: API access token
@@ -63,15 +220,50 @@ def get_data(case_ids, access_token, url, params, event, overall_type) -> pd.Dat
    :param params: API parameters
    :param event: event type e.g. ['cmp','cmp'] for a complaint
    :param overall_type: overall type e.g. 'motion' for all motions regardless of type
+   :param chunk_size: number of case IDs per request, defaults to Config.get_data_chunk_size
+   :param auth: TokenManager used instead of access_token
+   :param cache: optional ResponseCache so that repeated runs reuse earlier responses
    :return: dataframe of data
 
     """
-    headers = {'Authorization': f'Bearer {access_token}', 'Content-Type': 'application/json'}
-    if event:
-        data = {'case_ids': case_ids, 'subtype': event}
-    if overall_type:
-        data = {'case_ids': case_ids, 'overall_type': overall_type}
-    r = httpx.post(url, params=params, headers=headers, json=data, verify=False, timeout=None)
-    df = pd.DataFrame(r.json()['data'])
 
-    return df
+    async def _get_data():
+        async with ApiSession.instance().session() as session:
+            return await get_data_async(session, case_ids, access_token, url, params, event, overall_type,
+                                        chunk_size=chunk_size, auth=auth, cache=cache)
+
+    return _run(_get_data())
+
+
+def get_data_concurrently(case_ids, params, queries: Dict[str, Tuple[str, Optional[list], Optional[str]]],
+                          auth: TokenManager, chunk_size: Optional[int] = None,
+                          cache: Optional[ResponseCache] = None) -> Dict[str, pd.DataFrame]:
+    """
+    Runs several get_data queries over the same case IDs at once. All queries share one connection pool and one
+    AdaptiveLimiter, so together they keep as many requests in flight as the server sustains and the run takes about as
+    long as the slowest query. Like get_data it blocks a running event loop it is called from.
+
+    Usage:
+    queries = {'complaints': (url_by_type, None, 'cmp'),
+               'habeas': (url_by_subtype, create_event(('motion', 'pwrithc')), None)}
+    frames = get_data_concurrently(case_ids, params, queries, api.tokens)
+
+    :param case_ids: list of case IDs
+    :param params: API parameters sent with every query
+    :param queries: query name -> (API endpoint, event, overall type), see get_data
+    :param auth: TokenManager that supplies the Authorization header
+    :param chunk_size: number of case IDs per request, defaults to Config.get_data_chunk_size
+    :param cache: optional ResponseCache so that repeated runs reuse earlier responses
+    :return: query name -> dataframe of data
+    """
+
+    async def _get_all():
+        limiter = AdaptiveLimiter()
+        async with ApiSession.instance().session() as session:
+            frames = await asyncio.gather(*[
+                get_data_async(session, case_ids, None, url, params, event, overall_type, chunk_size=chunk_size,
+                               auth=auth, cache=cache, limiter=limiter)
+                for url, event, overall_type in queries.values()])
+        return dict(zip(queries, frames))
+
+    return _run(_get_all())
@@ -0,0 +1,190 @@
+"""
+Module that keeps API responses on disk so that re-running a script does not download the whole district again.
+Responses are keyed by method, URL, query parameters and JSON body. Bodies are stored zlib-compressed under the hash of
+their content, so identical responses share one file, and a small JSON index entry per key records when the response
+was stored and the validators the server sent with it.
+
+An entry younger than the TTL is served without contacting the server. An older entry is revalidated with
+If-None-Match/If-Modified-Since when the server sent an ETag or Last-Modified header, and treated as a miss otherwise.
+When the cache grows beyond its size limit the least recently used entries are evicted.
+
+"""
+import hashlib
+import json
+import os
+import time
+import zlib
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from configuration.config import Config
+
+COMPRESSION_LEVEL = 3
+
+
+@dataclass
+class CacheEntry:
+    key: str
+    blob: str
+    size: int
+    stored: float
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+class ResponseCache:
+    """
+    Content-addressed, compressed on-disk cache of response bodies
+    """
+
+    def __init__(self, root: Optional[str] = None, ttl: Optional[float] = None, max_bytes: Optional[int] = None):
+        config = Config()
+        self.root = Path(root or config.response_cache_dir)
+        self.ttl = config.response_cache_ttl if ttl is None else ttl
+        self.max_bytes = config.response_cache_max_bytes if max_bytes is None else max_bytes
+        self.index_dir = self.root / 'index'
+        self.blob_dir = self.root / 'blobs'
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self._size: Optional[int] = None
+
+    @staticmethod
+    def key(method: str, url: str, params: Optional[Dict] = None, body: Any = None) -> str:
+        """
+        Hashes a request. Query parameters are sorted so that the same query always maps to the same key; headers are
+        left out so that a refreshed token does not invalidate the cache.
+        """
+        request = [method.upper(), url, sorted((str(k), str(v)) for k, v in (params or {}).items()), body]
+        return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _index_path(self, key: str) -> Path:
+        return self.index_dir / f'{key}.json'
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.blob_dir / f'{digest}.zz'
+
+    def lookup(self, key: str) -> Optional[CacheEntry]:
+        """
+        Finds a usable entry: one that is still fresh or that can be revalidated with the server
+
+        :param key: request key from ResponseCache.key
+        :return: CacheEntry or None on a miss
+        """
+        path = self._index_path(key)
+        try:
+            with open(path) as f:
+                entry = CacheEntry(**json.load(f))
+        except (FileNotFoundError, json.JSONDecodeError, TypeError):
+            return None
+        if not self._blob_path(entry.blob).exists():
+            return None
+        if not self.is_fresh(entry) and not (entry.etag or entry.last_modified):
+            return None
+        # the index file's mtime is the last access time used for eviction
+        os.utime(path)
+        return entry
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        return time.time() - entry.stored < self.ttl
+
+    @staticmethod
+    def conditional_headers(entry: CacheEntry) -> Dict[str, str]:
+        headers = {}
+        if entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+        return headers
+
+    def read(self, entry: CacheEntry) -> bytes:
+        with open(self._blob_path(entry.blob), 'rb') as f:
+            return zlib.decompress(f.read())
+
+    def put(self, key: str, body: bytes, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        """
+        Stores a response body under its request key
+
+        :param key: request key from ResponseCache.key
+        :param body: raw response body
+        :param etag: ETag header of the response
+        :param last_modified: Last-Modified header of the response
+        """
+        digest = hashlib.sha256(body).hexdigest()
+        blob_path = self._blob_path(digest)
+        if not blob_path.exists():
+            self._write(blob_path, zlib.compress(body, COMPRESSION_LEVEL))
+            if self._size is not None:
+                self._size += blob_path.stat().st_size
+        entry = CacheEntry(key=key, blob=digest, size=blob_path.stat().st_size, stored=time.time(), etag=etag,
+                           last_modified=last_modified)
+        self._write(self._index_path(key), json.dumps(asdict(entry)).encode())
+        if self.size() > self.max_bytes:
+            self.evict()
+
+    def revalidated(self, entry: CacheEntry):
+        """
+        Restarts the TTL of an entry the server confirmed as unchanged (304)
+        """
+        entry.stored = time.time()
+        self._write(self._index_path(entry.key), json.dumps(asdict(entry)).encode())
+
+    def size(self) -> int:
+        """
+        Bytes used by the stored bodies
+        """
+        if self._size is None:
+            self._size = sum(path.stat().st_size for path in self.blob_dir.glob('*.zz'))
+        return self._size
+
+    def evict(self, max_bytes: Optional[int] = None):
+        """
+        Drops least recently used entries until the stored bodies fit in max_bytes. Bodies are removed once no entry
+        refers to them.
+
+        :param max_bytes: size limit, defaults to the cache's max_bytes
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = []
+        for path in self.index_dir.glob('*.json'):
+            try:
+                with open(path) as f:
+                    entries.append((path.stat().st_mtime, path, json.load(f)['blob']))
+            except (FileNotFoundError, json.JSONDecodeError, KeyError):
+                path.unlink(missing_ok=True)
+        entries.sort()
+        references: Dict[str, int] = {}
+        for _, _, blob in entries:
+            references[blob] = references.get(blob, 0) + 1
+        size = self.size()
+        for _, path, blob in entries:
+            if size <= max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            references[blob] -= 1
+            if not references[blob]:
+                size -= self._remove(self._blob_path(blob))
+        # bodies left behind by an interrupted put
+        for blob_path in self.blob_dir.glob('*.zz'):
+            if blob_path.stem not in references:
+                size -= self._remove(blob_path)
+        self._size = size
+
+    def clear(self):
+        self.evict(max_bytes=0)
+
+    @staticmethod
+    def _remove(path: Path) -> int:
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except FileNotFoundError:
+            return 0
+        return size
+
+    @staticmethod
+    def _write(path: Path, data: bytes):
+        tmp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
@@ -0,0 +1,81 @@
+"""
+Module that records the progress of a long fetch run so that it can be resumed after a crash. The manifest is an
+append-only JSON lines file with one line per finished case; when a case appears more than once the latest line wins.
+Appending keeps every write small and a crash can at worst lose the line being written.
+
+"""
+import datetime
+import json
+from pathlib import Path
+from typing import Dict, Hashable, Iterable, List, Optional
+
+COMPLETED = 'completed'
+FAILED = 'failed'
+TIMEOUT = 'timeout'
+
+
+class Checkpoint:
+    """
+    Manifest of which case IDs completed, failed or timed out
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.statuses: Dict[Hashable, Dict] = self._load()
+
+    def _load(self) -> Dict[Hashable, Dict]:
+        statuses = {}
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # a line cut short by a crash
+                        continue
+                    statuses[entry['caseid']] = entry
+        except FileNotFoundError:
+            pass
+        return statuses
+
+    def reset(self):
+        """
+        Starts a new run by discarding the manifest
+        """
+        self.path.unlink(missing_ok=True)
+        self.statuses = {}
+
+    def record(self, caseid: Hashable, ok: bool, error: Optional[str] = None, attempts: int = 0,
+               timed_out: bool = False):
+        status = COMPLETED if ok else TIMEOUT if timed_out else FAILED
+        entry = {'caseid': caseid, 'status': status, 'error': error, 'attempts': attempts,
+                 'recorded': datetime.datetime.now().isoformat(timespec='seconds')}
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+        self.statuses[caseid] = entry
+
+    def with_status(self, *statuses: str) -> List[Hashable]:
+        return [caseid for caseid, entry in self.statuses.items() if entry['status'] in statuses]
+
+    def failure_queue(self) -> List[Hashable]:
+        """
+        Cases that failed or timed out on their last attempt
+        """
+        return self.with_status(FAILED, TIMEOUT)
+
+    def pending(self, caseids: Iterable[Hashable]) -> List[Hashable]:
+        """
+        Filters caseids down to those that still need fetching: never attempted, failed or timed out
+
+        :param caseids: every case in the run
+        :return: case IDs that have not completed, in the order given
+        """
+        return [caseid for caseid in caseids
+                if self.statuses.get(caseid, {}).get('status') != COMPLETED]
+
+    def summary(self) -> Dict[str, int]:
+        counts = {COMPLETED: 0, FAILED: 0, TIMEOUT: 0}
+        for entry in self.statuses.values():
+            counts[entry['status']] += 1
+        return counts
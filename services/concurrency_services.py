@@ -0,0 +1,193 @@
+"""
+Module that decides how many requests may be in flight against the ECF API. The limit follows additive-increase /
+multiplicative-decrease (AIMD): every window of successful responses raises it by one, and a sign of overload (429,
+502, 503, 504, a timeout, or latency well above the best seen so far) cuts it by a factor, at most once per window.
+A Retry-After header pauses all new requests until the time the server asked for.
+
+"""
+import asyncio
+import datetime
+import email.utils
+import time
+from collections import deque
+from typing import Deque, Optional
+
+import aiohttp
+from colorama import Fore
+
+from configuration.config import Config
+
+OVERLOAD_STATUSES = {429, 502, 503, 504}
+
+
+def is_overload(error: BaseException) -> bool:
+    """
+    Decides whether a failed request means the server is struggling, as opposed to a bad request or a missing case
+    """
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in OVERLOAD_STATUSES
+    return isinstance(error, (asyncio.TimeoutError, aiohttp.ServerDisconnectedError))
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """
+    Reads the Retry-After header of a failed response, given either in seconds or as an HTTP date
+
+    :param error: exception raised by the request
+    :return: seconds to wait, or None when the server did not say
+    """
+    headers = getattr(error, 'headers', None)
+    value = headers.get('Retry-After') if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit for API requests that adapts to how the server copes
+
+    Usage:
+    await limiter.acquire()
+    start = time.monotonic()
+    try:
+        ...
+    except Exception as e:
+        limiter.release(time.monotonic() - start, error=e)
+        raise
+    limiter.release(time.monotonic() - start)
+    """
+
+    def __init__(self, initial: Optional[int] = None, minimum: Optional[int] = None, maximum: Optional[int] = None,
+                 decrease_factor: Optional[float] = None, latency_tolerance: Optional[float] = None,
+                 retry_after_cap: Optional[float] = None):
+        """
+        :param initial: starting limit, defaults to Config.fetch_concurrency
+        :param minimum: lowest limit, defaults to Config.fetch_concurrency_min
+        :param maximum: highest limit, defaults to Config.fetch_concurrency_max
+        :param decrease_factor: factor the limit is multiplied by on overload, defaults to Config.fetch_decrease_factor
+        :param latency_tolerance: smoothed latency above this multiple of the best latency counts as overload,
+            defaults to Config.fetch_latency_tolerance; 0 disables the latency signal
+        :param retry_after_cap: longest Retry-After honored in seconds, defaults to Config.fetch_retry_after_cap
+        """
+        config = Config()
+        self.minimum = max(1, config.fetch_concurrency_min if minimum is None else minimum)
+        self.maximum = max(self.minimum, config.fetch_concurrency_max if maximum is None else maximum)
+        initial = config.fetch_concurrency if initial is None else initial
+        self.limit = float(min(self.maximum, max(self.minimum, initial)))
+        self.decrease_factor = config.fetch_decrease_factor if decrease_factor is None else decrease_factor
+        self.latency_tolerance = config.fetch_latency_tolerance if latency_tolerance is None else latency_tolerance
+        self.retry_after_cap = config.fetch_retry_after_cap if retry_after_cap is None else retry_after_cap
+        self.in_flight = 0
+        self.latency: Optional[float] = None
+        self.best_latency: Optional[float] = None
+        self._last_decrease = 0.0
+        self._resume_at = 0.0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @classmethod
+    def fixed(cls, limit: int) -> 'AdaptiveLimiter':
+        """
+        A limiter that never changes its limit but still honors Retry-After
+        """
+        return cls(initial=limit, minimum=limit, maximum=limit)
+
+    async def acquire(self):
+        """
+        Waits for a free slot. Waiting requests are served in arrival order.
+        """
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    self._waiters.remove(future)
+                else:
+                    # the slot was granted just before the cancellation
+                    self.in_flight -= 1
+                    self._wake()
+                raise
+        # a Retry-After pause also holds back requests that already have a slot
+        while (wait := self._resume_at - time.monotonic()) > 0:
+            await asyncio.sleep(wait)
+
+    def release(self, latency: Optional[float], error: Optional[BaseException] = None):
+        """
+        Frees a slot and adjusts the limit from the outcome of the request
+
+        :param latency: seconds the request took; None when it never reached the server, e.g. a cached response,
+            which then leaves the limit as it is
+        :param error: exception raised by the request, None on success
+        """
+        window_full = self.in_flight >= int(self.limit)
+        self.in_flight -= 1
+        if error is not None:
+            if is_overload(error):
+                self._decrease(f'{error!r}')
+                self.pause(retry_after(error))
+        elif latency is not None:
+            self._observe_latency(latency)
+            if self.latency_tolerance and self.latency > self.best_latency * self.latency_tolerance:
+                self._decrease(f'latency {self.latency:.2f}s')
+            elif window_full:
+                # +1 per window of successes, and only while the limit is actually the bottleneck
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        self._wake()
+
+    def pause(self, seconds: Optional[float]):
+        """
+        Holds back new requests, e.g. for the duration of a Retry-After
+        """
+        if not seconds:
+            return
+        seconds = min(seconds, self.retry_after_cap)
+        resume_at = time.monotonic() + seconds
+        if resume_at > self._resume_at:
+            print(Fore.MAGENTA + f'Server asked to wait; pausing requests for {seconds:.1f} second(s)', flush=True)
+            self._resume_at = resume_at
+
+    def retry_delay(self) -> float:
+        """
+        Seconds left of the current pause
+        """
+        return max(0.0, self._resume_at - time.monotonic())
+
+    def _observe_latency(self, latency: float):
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        # let the best latency drift up slowly so that one lucky response does not pin it forever
+        self.best_latency = latency if self.best_latency is None else min(latency, self.best_latency * 1.01)
+
+    def _decrease(self, reason: str):
+        now = time.monotonic()
+        # one cut per window: the other failures of the same burst already happened at the old limit
+        if now - self._last_decrease < (self.latency or 0.0):
+            return
+        self._last_decrease = now
+        limit = max(self.minimum, self.limit * self.decrease_factor)
+        if int(limit) < int(self.limit):
+            print(Fore.MAGENTA + f'Reducing concurrency to {int(limit)} ({reason})', flush=True)
+        self.limit = limit
+        if self.latency is not None and self.best_latency is not None:
+            # restart latency smoothing from the best latency so that one slow window causes one cut
+            self.latency = self.best_latency
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            future = self._waiters.popleft()
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
@@ -1,10 +1,11 @@
 from datetime import datetime
-from typing import List, Dict
+from typing import List, Dict, Iterable, Tuple
 
 import pandas as pd
 from sqlalchemy import Table
 
 from services.db_services import nos_group_lookup
+from services.store_services import CaseStore
 
 
 def _format_columns(df) -> pd.DataFrame:
@@ -83,6 +84,26 @@ def create_merged_df(original_df, candidate_df) -> pd.DataFrame:
     return df
 
 
+def create_merged_df_from_candidates(original_df, candidate_dfs: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Merges several candidate dataframes in one keyed pass. Gives the same rows as merging each candidate with
+    create_merged_df, concatenating the results in order and keeping the first row per case: a case takes its row from
+    the first candidate that has one.
+
+    :param original_df: original dataframe
+    :param candidate_dfs: dataframes to be merged, in order of priority
+    :return: merged dataframe
+    """
+    ranked = [df.assign(candidate_rank=rank) for rank, df in enumerate(candidate_dfs) if not df.empty]
+    combined = pd.concat(ranked or candidate_dfs, ignore_index=True)
+    combined = combined.drop_duplicates(subset=['de_caseid'], keep='first')
+    df = create_merged_df(original_df, combined)
+    if 'candidate_rank' not in df.columns:
+        return df
+    # list the cases of each candidate in turn, as concatenating the separate merges did
+    return df.sort_values('candidate_rank', kind='mergesort').drop(columns='candidate_rank')
+
+
 def create_merged_ua_dates_or_deadlines(original_df, candidate_df) -> pd.DataFrame:
     df = pd.merge(original_df, candidate_df, left_on='Case ID', right_on='caseid', how='left')
     return df
@@ -143,24 +164,129 @@ def add_nos_grouping(df: pd.DataFrame, table_name: Table):
     return df
 
 
-def create_dataframe_docket_entries(dataframes_entries: List[Dict]) -> pd.DataFrame:
+# columns of the docket entries and deadlines endpoints, for the empty frames of runs without any case
+DOCKET_COLUMNS = ['de_caseid', 'de_seqno', 'dp_seqno', 'dp_dpseqno_ptr', 'dp_deseqno_ptr', 'dp_partno', 'de_type',
+                  'dp_type', 'dp_sub_type', 'de_document_num', 'de_date_filed', 'de_date_enter', 'de_who_entered',
+                  'initials', 'name', 'pr_type', 'pr_crttype', 'dp_dispositive', 'dp_action_type', 'dt_text']
+DEADLINE_COLUMNS = ['sd_caseid', 'sd_seqno', 'sd_class', 'sd_type', 'sd_dtset', 'sd_dtsatis', 'de_seqno']
+# docket entry columns that no stage reads; stores can skip them when loading
+UNUSED_DOCKET_COLUMNS = ['de_date_enter', 'de_who_entered', 'initials', 'name', 'pr_type', 'pr_crttype']
+# event codes; they share one dictionary so that they compare as integers and against each other
+DOCKET_CODE_COLUMNS = ['de_type', 'dp_type', 'dp_sub_type']
+# other short flags repeated on every row
+DOCKET_FLAG_COLUMNS = ['dp_dispositive', 'dp_action_type']
+DOCKET_INTEGER_COLUMNS = ['de_caseid', 'de_seqno', 'dp_seqno', 'dp_partno', 'de_document_num', 'dp_dpseqno_ptr',
+                          'dp_deseqno_ptr']
+
+
+def _concat_cases(frames: Iterable[pd.DataFrame], columns: List[str]) -> pd.DataFrame:
+    """
+    Concatenates per-case dataframes. An empty store or a run in which every case failed gives an empty frame with the
+    given columns rather than an error.
+    """
+    # reading an empty store gives a frame without columns
+    frames = [df for df in frames if len(df.columns)]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames)
+
+
+def optimize_docket_dtypes(df_entries: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converts the docket entry code columns to categoricals over one shared dictionary and downcasts the integer
+    columns, so that filters such as target['dp_sub_type'] == 'jgm' compare integer codes. Integer columns with
+    missing values become float32, which holds sequence and document numbers exactly.
+
+    :param df_entries: dataframe of docket entries with stripped codes
+    :return: the same dataframe with compact dtypes
     """
-    Concatenates list of dictionaries into a single dataframe with case docket entries with some formatting and cleanup.
+    codes = [column for column in DOCKET_CODE_COLUMNS if column in df_entries.columns]
+    categories = pd.unique(pd.concat([df_entries[column].dropna() for column in codes])) if codes else []
+    code_dtype = pd.CategoricalDtype(sorted(categories))
+    for column in codes:
+        df_entries[column] = df_entries[column].astype(code_dtype)
+    for column in DOCKET_FLAG_COLUMNS:
+        if column in df_entries.columns:
+            df_entries[column] = df_entries[column].astype('category')
+    for column in DOCKET_INTEGER_COLUMNS:
+        if column in df_entries.columns:
+            values = pd.to_numeric(df_entries[column])
+            downcast = 'float' if values.isna().any() else 'integer'
+            df_entries[column] = pd.to_numeric(values, downcast=downcast)
+    return df_entries
+
 
-    :param dataframes_entries: list of dictionaries
+def memory_by_column(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Reports the memory used by each column, counting the strings held by object columns
+
+    :param df: dataframe
+    :return: dataframe with dtype, MB and share of the total per column, largest first
+    """
+    usage = df.memory_usage(index=False, deep=True)
+    report = pd.DataFrame({'dtype': df.dtypes.astype(str), 'MB': usage / 1024 ** 2,
+                           'share': usage / usage.sum()})
+    return report.sort_values('MB', ascending=False).round(3)
+
+
+def create_dataframe_docket_entries(dataframes_entries: Iterable[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatenates per-case dataframes into a single dataframe with case docket entries with some formatting and cleanup.
+    Accepts any iterable, e.g. CaseStore.iter_frames() or [CaseStore.read(...)], so cases can be read from disk lazily.
+
+    :param dataframes_entries: iterable of per-case dataframes
     :return: dataframe
     """
-    df_entries = pd.concat(dataframes_entries)
+    df_entries = _concat_cases(dataframes_entries, DOCKET_COLUMNS)
     # cleanup to assist with string matching and to eliminate unnecessary columns
-    df_entries = df_entries.drop(['de_date_enter', 'de_who_entered', 'initials', 'name', 'pr_type', 'pr_crttype'],
-                                 axis=1)
+    df_entries = df_entries.drop(UNUSED_DOCKET_COLUMNS, axis=1, errors='ignore')
     df_entries['de_type'] = df_entries['de_type'].str.strip()
     df_entries['dp_type'] = df_entries['dp_type'].str.strip()
     df_entries['dp_sub_type'] = df_entries['dp_sub_type'].str.strip()
+    df_entries = optimize_docket_dtypes(df_entries)
     del dataframes_entries
     return df_entries
 
 
+def combine_docket_text(df_entries: pd.DataFrame) -> pd.DataFrame:
+    """
+    Collapses multi-part docket entries into one row per entry for the whole table at once: the row of the first part,
+    with the text of all parts joined by spaces. Per case this is what combine_docket_text_into_one_row in the milestone
+    scripts does, so entries combined here are passed through there untouched.
+
+    :param df_entries: dataframe of docket entries, with dt_text
+    :return: dataframe with one row per de_caseid and de_seqno, in the order of the first parts
+    """
+    keys = ['de_caseid', 'de_seqno']
+    multi_part = df_entries.duplicated(subset=keys, keep=False)
+    if not multi_part.any():
+        return df_entries
+    text = df_entries.loc[multi_part].groupby(keys, sort=False)['dt_text'].agg(' '.join)
+    first_parts = ~df_entries.duplicated(subset=keys, keep='first')
+    combined = df_entries.loc[first_parts].copy()
+    joined = multi_part.loc[first_parts].to_numpy()
+    combined.loc[joined, 'dt_text'] = text.reindex(pd.MultiIndex.from_frame(combined.loc[joined, keys])).to_numpy()
+    return combined
+
+
+def load_combined_docket_entries(path: str, caseids: List[int]) -> pd.DataFrame:
+    """
+    Reads the docket entries of the given cases from a CaseStore, formats them and combines multi-part entries. Run
+    through the stage cache, so that later runs read the combined table instead of building it again.
+
+    Usage:
+    df_entries = StageCache().run('combined_docket_entries', load_combined_docket_entries, inputs=[path],
+                                  params={'path': path, 'caseids': caseids})
+
+    :param path: CaseStore directory, e.g. 'data_files/docket_entries'
+    :param caseids: cases to read
+    :return: dataframe with one row per docket entry
+    """
+    df_entries = create_dataframe_docket_entries([CaseStore(path).read(exclude=UNUSED_DOCKET_COLUMNS,
+                                                                       caseids=caseids)])
+    return combine_docket_text(df_entries)
+
+
 def create_dataframe_deadlines(dataframes_deadlines):
     """
         Concatenates list of dictionaries into a single dataframe of case deadlines with some formatting and cleanup.
@@ -168,7 +294,7 @@ def create_dataframe_deadlines(dataframes_deadlines):
         :param dataframes_deadlines: list of dictionaries
         :return: dataframe
         """
-    df_deadlines = pd.concat(dataframes_deadlines)
+    df_deadlines = _concat_cases(dataframes_deadlines, DEADLINE_COLUMNS)
     # change column string to datetime
     df_deadlines['sd_dtset'] = pd.to_datetime(df_deadlines['sd_dtset'], dayfirst=False, yearfirst=True, errors='coerce')
     df_deadlines['sd_dtsatis'] = pd.to_datetime(df_deadlines['sd_dtsatis'], dayfirst=False, yearfirst=True,
@@ -181,6 +307,21 @@ def create_dataframe_deadlines(dataframes_deadlines):
     return df_deadlines
 
 
+def split_deadlines_and_hearings(df_deadlines: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Splits an unfiltered response from the case deadlines endpoint into the deadline and hearing frames that used to be
+    fetched separately. The deadline frame is the unfiltered response; the hearing frame holds the rows whose
+    deadline class is 'hrg', which is what the endpoint returns for deadline_class=hrg.
+
+    :param df_deadlines: dataframe of all deadlines for a case
+    :return: tuple of (deadlines, hearings); without a deadline class column there are no hearings
+    """
+    if 'sd_class' not in df_deadlines.columns:
+        return df_deadlines, df_deadlines.iloc[0:0].copy()
+    mask = df_deadlines['sd_class'].str.strip() == 'hrg'
+    return df_deadlines, df_deadlines.loc[mask].copy()
+
+
 def create_dataframe_hearings(dataframes_hearings):
     """
             Concatenates list of dictionaries into a single dataframe of case hearings with some formatting and cleanup.
@@ -188,7 +329,7 @@ def create_dataframe_hearings(dataframes_hearings):
             :param dataframes_hearings: list of dictionaries
             :return: dataframe
             """
-    df_hearings = pd.concat(dataframes_hearings)
+    df_hearings = _concat_cases(dataframes_hearings, DEADLINE_COLUMNS)
     # change column string to datetime
     df_hearings['sd_dtset'] = pd.to_datetime(df_hearings['sd_dtset'], dayfirst=False, yearfirst=True, errors='coerce')
     df_hearings['sd_dtsatis'] = pd.to_datetime(df_hearings['sd_dtsatis'], dayfirst=False, yearfirst=True,
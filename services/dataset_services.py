@@ -0,0 +1,251 @@
+"""
+Module that stores intermediate dataframes as partitioned Parquet datasets instead of whole-object pickles. A dataset
+is a directory of Parquet files split by a partition column (hive layout, e.g. case_bucket=41/part-0.parquet), so a
+stage can read only the columns and cases it needs, and files are memory-mapped rather than copied into memory.
+
+Columns that Arrow cannot store as they are, such as lists of dicts collected by the milestone code, are stored as JSON
+text and decoded again when read. The names of those columns and the case ID column are kept in the schema metadata.
+
+Usage:
+write_dataset(df, 'data_files/case_metrics', partition_by=FILING_YEAR, date_column='Date Filed')
+df = read_dataset('data_files/case_metrics', columns=['Case ID', 'Total Time Elapsed'], caseids=[41091])
+
+"""
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+import dill
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from pyarrow import fs
+
+from configuration.config import Config
+
+CASE_BUCKET = 'case_bucket'
+FILING_YEAR = 'filing_year'
+METADATA_KEY = b'cpi_program'
+
+# memory-mapped local files: pages are read on demand and shared with the OS page cache
+_filesystem = fs.LocalFileSystem(use_mmap=True)
+
+
+def _is_nested(value) -> bool:
+    return isinstance(value, (list, tuple, set, dict))
+
+
+def _to_json(value):
+    if value is None or (np.isscalar(value) and pd.isna(value)):
+        return None
+    if isinstance(value, set):
+        value = sorted(value, key=str)
+    return json.dumps(value, default=str)
+
+
+def _arrow_column(values: pd.Series) -> Optional[pa.Array]:
+    try:
+        return pa.array(values, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        return None
+
+
+def to_table(df: pd.DataFrame, case_column: Optional[str] = None) -> pa.Table:
+    """
+    Converts a dataframe to an Arrow table. Nested values become JSON text; a column mixing dates and date strings is
+    read as dates, any other mix of types is stored as JSON text.
+
+    :param df: dataframe
+    :param case_column: column holding the case ID, recorded so that readers can filter on case IDs
+    :return: table without the pandas index
+    """
+    df = df.reset_index(drop=True)
+    encoded = []
+    for column in df.columns[df.dtypes == object]:
+        values = df[column]
+        first = values.dropna().head(1)
+        if not first.empty and _is_nested(first.iloc[0]):
+            df[column] = values.map(_to_json)
+            encoded.append(column)
+        elif _arrow_column(values) is None:
+            try:
+                df[column] = pd.to_datetime(values, errors='raise')
+            except (TypeError, ValueError):
+                df[column] = values.map(_to_json)
+                encoded.append(column)
+    return with_metadata(pa.Table.from_pandas(df, preserve_index=False), encoded, case_column)
+
+
+def with_metadata(table: pa.Table, json_columns: List[str], case_column: Optional[str]) -> pa.Table:
+    """
+    Records the JSON text columns and the case ID column of a table in its schema metadata
+    """
+    metadata = dict(table.schema.metadata or {})
+    metadata[METADATA_KEY] = json.dumps({'json_columns': json_columns, 'case_column': case_column}).encode()
+    return table.replace_schema_metadata(metadata)
+
+
+def table_metadata(schema: pa.Schema) -> Dict:
+    raw = (schema.metadata or {}).get(METADATA_KEY)
+    return json.loads(raw) if raw else {'json_columns': [], 'case_column': None}
+
+
+def to_dataframe(table: pa.Table, metadata: Optional[Dict] = None) -> pd.DataFrame:
+    """
+    Converts an Arrow table written by to_table back to a dataframe, decoding the JSON text columns
+
+    :param table: table
+    :param metadata: metadata of the dataset the table was read from, defaults to the table's own
+    """
+    metadata = metadata or table_metadata(table.schema)
+    df = table.to_pandas()
+    for column in metadata['json_columns']:
+        if column in df.columns:
+            df[column] = df[column].map(lambda value: None if value is None else json.loads(value))
+    return df
+
+
+def case_bucket(caseid: int) -> int:
+    return int(caseid) // Config.dataset_case_bucket_size
+
+
+def case_buckets(caseids: Iterable[int]) -> List[int]:
+    return sorted({case_bucket(caseid) for caseid in caseids})
+
+
+def _add_partition(df: pd.DataFrame, partition_by: str, case_column: Optional[str],
+                   date_column: Optional[str]) -> pd.DataFrame:
+    if partition_by == CASE_BUCKET:
+        if case_column is None:
+            raise ValueError('partitioning by case_bucket needs case_column')
+        return df.assign(**{CASE_BUCKET: df[case_column].astype('int64') // Config.dataset_case_bucket_size})
+    if partition_by == FILING_YEAR:
+        if date_column is None:
+            raise ValueError('partitioning by filing_year needs date_column')
+        # cases without a filing date land in year 0 rather than being dropped
+        years = pd.to_datetime(df[date_column], errors='coerce').dt.year
+        return df.assign(**{FILING_YEAR: years.fillna(0).astype('int64')})
+    return df
+
+
+def write_dataset(df: Union[pd.DataFrame, pa.Table], path: str, partition_by: Optional[str] = CASE_BUCKET,
+                  case_column: Optional[str] = None, date_column: Optional[str] = None):
+    """
+    Writes a dataframe as a partitioned Parquet dataset, replacing any dataset at the path. The dataset is written to a
+    temporary directory first so that readers never see a half-written one.
+
+    :param df: dataframe, or a table made by to_table, which can be partitioned by CASE_BUCKET or an existing column
+    :param path: dataset directory
+    :param partition_by: CASE_BUCKET, FILING_YEAR, an existing column, or None for a single file
+    :param case_column: column holding the case ID, needed for CASE_BUCKET and for reading by case ID
+    :param date_column: filing date column, needed for FILING_YEAR
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f'{path.name}.tmp-{os.getpid()}')
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    if isinstance(df, pa.Table):
+        table = df
+        if partition_by == CASE_BUCKET:
+            buckets = pc.divide(table[case_column].cast(pa.int64()), Config.dataset_case_bucket_size)
+            table = table.append_column(CASE_BUCKET, buckets)
+        elif partition_by not in (None, *table.column_names):
+            raise ValueError(f'tables can only be partitioned by {CASE_BUCKET} or an existing column')
+    else:
+        if partition_by is not None:
+            df = _add_partition(df, partition_by, case_column, date_column)
+        table = to_table(df, case_column)
+    ds.write_dataset(table, tmp_path, format='parquet', basename_template='part-{i}.parquet',
+                     partitioning=[partition_by] if partition_by else None, partitioning_flavor='hive',
+                     existing_data_behavior='overwrite_or_ignore')
+    if path.exists():
+        old_path = path.with_name(f'{path.name}.old-{os.getpid()}')
+        os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path)
+    else:
+        os.replace(tmp_path, path)
+
+
+def open_dataset(source: Union[str, List[str]], schema: Optional[pa.Schema] = None) -> ds.Dataset:
+    """
+    Opens a dataset directory, or a list of Parquet files, for memory-mapped reads
+
+    :param source: dataset directory or list of files
+    :param schema: schema to read the files as, e.g. when the files were written separately and differ in types
+    """
+    partitioning = 'hive' if isinstance(source, str) else None
+    return ds.dataset(source, schema=schema, format='parquet', partitioning=partitioning, filesystem=_filesystem)
+
+
+def _predicate(filters: Optional[Dict], caseids: Optional[Iterable[int]], metadata: Dict,
+               names: List[str]) -> Optional[pc.Expression]:
+    predicate = None
+    conditions = dict(filters or {})
+    if caseids is not None:
+        case_column = metadata.get('case_column')
+        if case_column is None:
+            raise ValueError('dataset has no case column to filter on')
+        caseids = [int(caseid) for caseid in caseids]
+        conditions[case_column] = caseids
+        if CASE_BUCKET in names:
+            # lets the scanner skip whole partitions
+            conditions[CASE_BUCKET] = case_buckets(caseids)
+    for column, value in conditions.items():
+        if isinstance(value, pc.Expression):
+            condition = value
+        elif isinstance(value, (list, tuple, set, np.ndarray, pd.Series)):
+            condition = ds.field(column).isin(list(value))
+        else:
+            condition = ds.field(column) == value
+        predicate = condition if predicate is None else predicate & condition
+    return predicate
+
+
+def read_dataset(path: Union[str, ds.Dataset], columns: Optional[List[str]] = None,
+                 exclude: Optional[List[str]] = None, caseids: Optional[Iterable[int]] = None,
+                 filters: Optional[Dict] = None) -> pd.DataFrame:
+    """
+    Reads a dataset written by write_dataset, or any dataset opened with open_dataset
+
+    :param path: dataset directory or dataset
+    :param columns: columns to read, defaults to every column except the partition column
+    :param exclude: columns not to read
+    :param caseids: read only these cases
+    :param filters: other conditions keyed by column: a value, a list of values, or a pyarrow expression,
+        e.g. {'dp_type': 'order', 'de_date_filed': ds.field('de_date_filed') >= '2020-01-01'}
+    :return: dataframe
+    """
+    dataset = path if isinstance(path, ds.Dataset) else open_dataset(str(path))
+    names = dataset.schema.names
+    metadata = table_metadata(dataset.schema)
+    if columns is None:
+        columns = [name for name in names if name not in (CASE_BUCKET, FILING_YEAR)]
+    if exclude:
+        columns = [name for name in columns if name not in exclude]
+    table = dataset.to_table(columns=columns, filter=_predicate(filters, caseids, metadata, names))
+    return to_dataframe(table, metadata)
+
+
+def import_pickle(pickle_path: str, path: str, partition_by: Optional[str] = CASE_BUCKET,
+                  case_column: Optional[str] = None, date_column: Optional[str] = None) -> int:
+    """
+    Converts an intermediate saved by earlier versions with dill, e.g. case_metrics.pkl or ua_dates.pkl, to a dataset
+
+    Usage:
+    import_pickle('data_files/case_metrics.pkl', 'data_files/case_metrics', partition_by=FILING_YEAR,
+                  case_column='Case ID', date_column='Date Filed')
+    import_pickle('data_files/ua_dates.pkl', 'data_files/ua_dates', case_column='caseid')
+
+    :param pickle_path: pickle holding a dataframe or a list of dicts
+    :param path: dataset directory
+    :return: number of rows written
+    """
+    with open(pickle_path, 'rb') as f:
+        data = dill.load(f)
+    df = data if isinstance(data, pd.DataFrame) else pd.DataFrame([row for row in data if row is not None])
+    write_dataset(df, path, partition_by=partition_by, case_column=case_column, date_column=date_column)
+    return len(df)
@@ -0,0 +1,193 @@
+"""
+Module that keeps docket entries, deadlines and hearings in an indexed SQL database, so that the events of one case, or
+every case with a given event subtype, can be read without loading the rest. Postgres is loaded with COPY; other
+backends, such as a local SQLite file for tests and small installs, are loaded with batched inserts.
+
+Event codes are stored without the padding the API sends, as create_dataframe_docket_entries does, so that queries
+compare them directly. Dates are stored as dates and returned as the 'YYYY-MM-DD' strings the API sends.
+
+Usage:
+db = DocketDatabase.from_config()
+db.load(DocketEntry, CaseStore('data_files/docket_entries'))
+events = db.case_events(41091)
+judgments = db.cases_with_subtype('jgm', columns=['de_caseid', 'de_seqno', 'de_date_filed'])
+
+"""
+import io
+from typing import Iterable, List, Optional, Type, Union
+
+import pandas as pd
+from colorama import Fore
+from sqlalchemy import Date, Integer, create_engine, delete, select
+from sqlalchemy.engine import Engine
+
+from configuration.config import Config
+from db.dbsession import DbSession, get_postgres_db_session
+from db.modelbase import Base
+from models.docket import DocketDeadline, DocketEntry, DocketHearing
+from services.store_services import CaseStore
+
+MODELS = (DocketEntry, DocketDeadline, DocketHearing)
+CODE_COLUMNS = {'de_type', 'dp_type', 'dp_sub_type', 'dp_dispositive', 'dp_action_type', 'sd_class', 'sd_type'}
+# cases deleted per statement when a load replaces cases
+DELETE_BATCH = 1000
+
+
+def _case_column(model: Type[Base]) -> str:
+    return 'de_caseid' if model is DocketEntry else 'sd_caseid'
+
+
+class DocketDatabase:
+    """
+    Docket entries, deadlines and hearings of many cases in one database
+    """
+
+    def __init__(self, engine: Engine):
+        """
+        :param engine: SQLAlchemy engine; the docket tables are created if they do not exist
+        """
+        self.engine = engine
+        Base.metadata.create_all(engine, tables=[model.__table__ for model in MODELS])
+
+    @classmethod
+    def from_config(cls) -> 'DocketDatabase':
+        """
+        Opens the database named by DOCKET_DATABASE_URI, e.g. sqlite:///data_files/dockets.db, or the Postgres
+        database of DbSession when it is not set
+        """
+        uri = Config().docket_database_uri
+        if uri:
+            return cls(create_engine(uri, future=True))
+        get_postgres_db_session()
+        return cls(DbSession.engine)
+
+    @staticmethod
+    def _prepare(model: Type[Base], df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Puts an API frame in the shape of a table: its columns in table order, codes stripped, integers and dates typed.
+        Columns the table does not have are left out.
+        """
+        columns = [column for column in model.__table__.columns if column.name != 'id']
+        prepared = pd.DataFrame(index=df.index)
+        for column in columns:
+            values = df[column.name] if column.name in df.columns else pd.Series(None, index=df.index, dtype=object)
+            if isinstance(column.type, Integer):
+                values = pd.to_numeric(values, errors='coerce').astype('Int64')
+            elif isinstance(column.type, Date):
+                values = pd.to_datetime(values, errors='coerce').dt.date
+            elif column.name in CODE_COLUMNS:
+                values = values.astype(object).str.strip()
+            prepared[column.name] = values
+        return prepared.reset_index(drop=True)
+
+    @staticmethod
+    def _copy(connection, table_name: str, df: pd.DataFrame):
+        buffer = io.StringIO()
+        df.to_csv(buffer, index=False, header=False, na_rep='\\N')
+        buffer.seek(0)
+        cursor = connection.connection.cursor()
+        try:
+            cursor.copy_expert(f"COPY {table_name} ({', '.join(df.columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+                               buffer)
+        finally:
+            cursor.close()
+
+    def load_frame(self, model: Type[Base], df: pd.DataFrame) -> int:
+        """
+        Replaces the rows of every case in the frame with the rows of the frame, in one transaction
+
+        :param model: DocketEntry, DocketDeadline or DocketHearing
+        :param df: frame as returned by the API, e.g. from a CaseStore
+        :return: number of rows loaded
+        """
+        if df.empty:
+            return 0
+        table = model.__table__
+        df = self._prepare(model, df)
+        case_column = table.c[_case_column(model)]
+        caseids = sorted(int(caseid) for caseid in df[case_column.name].dropna().unique())
+        with self.engine.begin() as connection:
+            for start in range(0, len(caseids), DELETE_BATCH):
+                connection.execute(delete(table).where(case_column.in_(caseids[start:start + DELETE_BATCH])))
+            if connection.dialect.name == 'postgresql':
+                self._copy(connection, table.name, df)
+            else:
+                records = df.astype(object).where(df.notna(), None).to_dict('records')
+                connection.execute(table.insert(), records)
+        return len(df)
+
+    def load(self, model: Type[Base], store: CaseStore, caseids: Optional[Iterable[int]] = None,
+             batch_size: int = 500) -> int:
+        """
+        Loads the cases of a CaseStore, a batch of cases at a time
+
+        :param model: DocketEntry, DocketDeadline or DocketHearing
+        :param store: store of the matching frames
+        :param caseids: cases to load, defaults to every stored case
+        :param batch_size: cases read and loaded per transaction
+        :return: number of rows loaded
+        """
+        caseids = store.caseids() if caseids is None else list(caseids)
+        rows = 0
+        for start in range(0, len(caseids), batch_size):
+            rows += self.load_frame(model, store.read(caseids=caseids[start:start + batch_size]))
+            print(Fore.WHITE + f'Loaded {min(start + batch_size, len(caseids))} of {len(caseids)} case(s) into '
+                               f'{model.__tablename__}', flush=True)
+        return rows
+
+    def _select(self, model: Type[Base], columns: Optional[List[str]], conditions: list,
+                order_by: List[str]) -> pd.DataFrame:
+        table = model.__table__
+        selected = [table.c[name] for name in columns] if columns else \
+            [column for column in table.columns if column.name != 'id']
+        query = select(*selected).where(*conditions).order_by(*[table.c[name] for name in order_by], table.c.id)
+        with self.engine.connect() as connection:
+            df = pd.read_sql(query, connection)
+        for column in df.columns:
+            if isinstance(table.c[column].type, Date):
+                dates = pd.to_datetime(df[column])
+                df[column] = dates.dt.strftime('%Y-%m-%d').where(dates.notna(), None)
+        return df
+
+    def case_events(self, caseid: int, sub_types: Optional[Union[str, List[str]]] = None,
+                    columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Docket entries of one case in docket order
+
+        :param caseid: case ID
+        :param sub_types: only entries of these subtypes, e.g. 'jgm' or ['ifp', 'madv']
+        :param columns: columns to return, defaults to all
+        """
+        table = DocketEntry.__table__
+        conditions = [table.c.de_caseid == int(caseid)]
+        if sub_types is not None:
+            conditions.append(table.c.dp_sub_type.in_([sub_types] if isinstance(sub_types, str) else sub_types))
+        return self._select(DocketEntry, columns, conditions, ['de_seqno', 'dp_partno'])
+
+    def cases_with_subtype(self, sub_types: Union[str, List[str]], columns: Optional[List[str]] = None,
+                           caseids: Optional[Iterable[int]] = None) -> pd.DataFrame:
+        """
+        Docket entries of a subtype across all cases, e.g. every judgment
+
+        :param sub_types: subtype or subtypes
+        :param columns: columns to return, defaults to all
+        :param caseids: only these cases
+        """
+        table = DocketEntry.__table__
+        conditions = [table.c.dp_sub_type.in_([sub_types] if isinstance(sub_types, str) else sub_types)]
+        if caseids is not None:
+            conditions.append(table.c.de_caseid.in_([int(caseid) for caseid in caseids]))
+        return self._select(DocketEntry, columns, conditions, ['de_caseid', 'de_seqno', 'dp_partno'])
+
+    def case_deadlines(self, caseid: int, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        table = DocketDeadline.__table__
+        return self._select(DocketDeadline, columns, [table.c.sd_caseid == int(caseid)], ['sd_seqno'])
+
+    def case_hearings(self, caseid: int, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        table = DocketHearing.__table__
+        return self._select(DocketHearing, columns, [table.c.sd_caseid == int(caseid)], ['sd_seqno'])
+
+    def caseids(self, model: Type[Base] = DocketEntry) -> List[int]:
+        column = model.__table__.c[_case_column(model)]
+        with self.engine.connect() as connection:
+            return [row[0] for row in connection.execute(select(column).distinct().order_by(column))]
@@ -0,0 +1,422 @@
+"""
+Module that schedules many requests against the ECF API at once. The number of requests in flight is set by an
+AdaptiveLimiter that follows what the server can sustain, transient failures (connection errors, timeouts, 429 and
+5xx responses) are retried with jittered exponential backoff and every request is reported back as a FetchResult so
+that one failed case no longer aborts a whole run.
+
+"""
+import asyncio
+import random
+import time
+import zlib
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Hashable, Iterable, List, Optional
+
+import aiohttp
+import pandas as pd
+from aiohttp import ClientSession
+from colorama import Fore
+
+from configuration.config import Config
+from services.api_connection import TokenManager
+from services.cache_services import ResponseCache
+from services.checkpoint_services import Checkpoint
+from services.concurrency_services import AdaptiveLimiter
+from services.dataframe_services import split_deadlines_and_hearings
+from services.store_services import CaseStore
+from util import get, post, read_cached
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+@dataclass
+class FetchRequest:
+    key: Hashable
+    url: str
+    params: Optional[Dict] = None
+    json: Optional[Dict] = None
+
+
+@dataclass
+class FetchResult:
+    key: Hashable
+    data: Optional[pd.DataFrame] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    timed_out: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class CaseBundle:
+    caseid: int
+    entries: Optional[pd.DataFrame] = None
+    deadlines: Optional[pd.DataFrame] = None
+    hearings: Optional[pd.DataFrame] = None
+    errors: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+
+def _is_transient(error: BaseException) -> bool:
+    """
+    Decides whether a failed request is worth retrying
+
+    :param error: exception raised by the request
+    :return: True for connection errors, timeouts and retryable HTTP statuses
+    """
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in RETRY_STATUSES
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+def _backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """
+    Exponential backoff with full jitter so that retries from many cases do not arrive at the server in lockstep
+    """
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+async def _fetch_one(session: ClientSession, limiter: AdaptiveLimiter, request: FetchRequest,
+                     headers: Optional[Dict], retries: int, backoff_base: float, backoff_cap: float,
+                     auth: Optional[TokenManager] = None, cache: Optional[ResponseCache] = None) -> FetchResult:
+    cached = read_cached(cache, 'GET' if request.json is None else 'POST', request.url, request.params, request.json)
+    if cached is not None:
+        # served from disk: it takes no slot, and its latency says nothing about the server
+        return FetchResult(key=request.key, data=cached, attempts=1)
+    attempt = 0
+    reauthenticated = False
+    while True:
+        attempt += 1
+        token = None
+        request_headers = headers
+        if auth is not None:
+            # refreshed transparently shortly before it expires, without blocking the other requests
+            token = await auth.get_token_async()
+            request_headers = dict(headers or {}, Authorization=f'Bearer {token}')
+        try:
+            await limiter.acquire()
+            start = time.monotonic()
+            try:
+                if request.json is None:
+                    df, from_network = await get(session, request.url, params=request.params,
+                                                 headers=request_headers, cache=cache)
+                else:
+                    df, from_network = await post(session, request.url, request.json, params=request.params,
+                                                  headers=request_headers, cache=cache)
+            except Exception as e:
+                # 429/5xx and timeouts lower the limit; a Retry-After holds back every request until it has passed
+                limiter.release(time.monotonic() - start, error=e)
+                raise
+            # a body that turned fresh in the meantime, e.g. stored by a duplicate request, frees its slot only
+            limiter.release(time.monotonic() - start if from_network else None)
+            return FetchResult(key=request.key, data=df, attempts=attempt)
+        except Exception as e:
+            if auth is not None and isinstance(e, aiohttp.ClientResponseError) and e.status == 401 \
+                    and not reauthenticated:
+                # token revoked or expired early: log in again once and retry right away
+                print(Fore.MAGENTA + f'Re-authenticating for {request.key}', flush=True)
+                auth.invalidate(token)
+                reauthenticated = True
+                continue
+            if attempt > retries or not _is_transient(e):
+                print(Fore.RED + f'Giving up on {request.key} after {attempt} attempt(s): {e!r}', flush=True)
+                return FetchResult(key=request.key, error=repr(e), attempts=attempt,
+                                   timed_out=isinstance(e, asyncio.TimeoutError))
+            delay = _backoff_delay(attempt, backoff_base, backoff_cap)
+            print(Fore.MAGENTA + f'Retrying {request.key} in {delay:.1f} second(s): {e!r}', flush=True)
+            await asyncio.sleep(delay)
+
+
+async def _fetch_and_hand_off(on_result: Optional[Callable[[FetchResult], None]], *args) -> FetchResult:
+    result = await _fetch_one(*args)
+    if on_result is not None:
+        on_result(result)
+        # the callback owns the payload now; drop it so finished cases do not pile up in memory
+        result.data = None
+    return result
+
+
+async def fetch_all(session: ClientSession, requests: Iterable[FetchRequest], headers: Optional[Dict] = None,
+                    concurrency: Optional[int] = None, retries: Optional[int] = None,
+                    backoff_base: Optional[float] = None, backoff_cap: Optional[float] = None,
+                    on_result: Optional[Callable[[FetchResult], None]] = None,
+                    auth: Optional[TokenManager] = None, cache: Optional[ResponseCache] = None,
+                    limiter: Optional[AdaptiveLimiter] = None) -> List[FetchResult]:
+    """
+    Fetches every request with the number of requests in flight adapting to the server's latency and errors.
+    Results are returned in request order.
+    When `on_result` is given every result is handed to it as soon as it completes and the returned results carry no
+    data, which keeps memory bounded for large runs.
+
+    :param session: aiohttp session shared by all requests
+    :param requests: requests to fetch
+    :param headers: headers sent with every request
+    :param concurrency: initial number of requests in flight, defaults to Config.fetch_concurrency
+    :param retries: number of retries for transient failures, defaults to Config.fetch_retries
+    :param backoff_base: first backoff window in seconds, defaults to Config.fetch_backoff_base
+    :param backoff_cap: largest backoff window in seconds, defaults to Config.fetch_backoff_cap
+    :param on_result: callback that receives each FetchResult as it completes, e.g. to write it to disk
+    :param auth: TokenManager that supplies the Authorization header; a 401 triggers one re-login and retry
+    :param cache: optional ResponseCache; fresh responses are served from disk and stale ones are revalidated
+    :param limiter: AdaptiveLimiter to share with other fetches, e.g. several queries run at once; when given,
+        concurrency is ignored
+    :return: list of FetchResult, one per request
+    """
+    config = Config()
+    retries = config.fetch_retries if retries is None else retries
+    backoff_base = config.fetch_backoff_base if backoff_base is None else backoff_base
+    backoff_cap = config.fetch_backoff_cap if backoff_cap is None else backoff_cap
+
+    limiter = limiter or AdaptiveLimiter(initial=concurrency)
+    tasks = [_fetch_and_hand_off(on_result, session, limiter, request, headers, retries, backoff_base, backoff_cap,
+                                 auth, cache)
+             for request in requests]
+    return await asyncio.gather(*tasks)
+
+
+def report_failures(results: List[FetchResult]) -> List[Hashable]:
+    """
+    Prints a summary of a fetch run
+
+    :param results: results returned by fetch_all
+    :return: keys of the requests that failed
+    """
+    failed = [result.key for result in results if not result.ok]
+    print(Fore.WHITE + f'Fetched {len(results) - len(failed)} of {len(results)} request(s)', flush=True)
+    if failed:
+        print(Fore.RED + f'Failed: {failed}', flush=True)
+    return failed
+
+
+def write_to_store(store: CaseStore, checkpoint: Optional[Checkpoint] = None) -> Callable[[FetchResult], None]:
+    """
+    Creates an on_result callback for fetch_all that writes each successful case to a CaseStore as soon as it arrives
+
+    :param store: CaseStore keyed by the request key (case ID)
+    :param checkpoint: optional Checkpoint that records the outcome of every case once it is safely on disk
+    """
+
+    def _write(result: FetchResult):
+        if result.ok:
+            store.put(result.key, result.data)
+        if checkpoint is not None:
+            checkpoint.record(result.key, result.ok, error=result.error, attempts=result.attempts,
+                              timed_out=result.timed_out)
+
+    return _write
+
+
+def create_connector(concurrency: Optional[int] = None) -> aiohttp.TCPConnector:
+    """
+    Creates a keep-alive connection pool sized to the highest fetch concurrency so that requests reuse warm connections
+    and the pool never caps the adaptive limit
+    """
+    config = Config()
+    return aiohttp.TCPConnector(limit=concurrency or config.fetch_concurrency_max, ssl=False)
+
+
+async def fetch_case_bundles(session: ClientSession, caseids: Iterable[int], headers: Optional[Dict] = None,
+                             concurrency: Optional[int] = None,
+                             stores: Optional[Dict[str, CaseStore]] = None,
+                             auth: Optional[TokenManager] = None,
+                             cache: Optional[ResponseCache] = None) -> List[CaseBundle]:
+    """
+    Fetches everything a case needs (docket entries, deadlines and hearings) in one scheduling pass. Deadlines are
+    fetched once without a deadline class filter and split locally into deadlines and hearings.
+
+    :param session: aiohttp session shared by all requests
+    :param caseids: case IDs to fetch
+    :param headers: headers sent with every request
+    :param concurrency: initial number of requests in flight
+    :param stores: optional CaseStores keyed 'entries', 'deadlines' and 'hearings'. When given, every frame is written
+        to its store as soon as it arrives and the returned bundles only carry errors.
+    :param auth: TokenManager that supplies the Authorization header
+    :param cache: optional ResponseCache for the entries and deadlines responses
+    :return: list of CaseBundle in case ID order
+    """
+    config = Config()
+    api_base_url = config.base_api_url
+    # the parameters case_docket_entries.py and case_deadlines.py send; hearings came without them
+    params = {'documents': 'false', 'docket_text': 'true'}
+    caseids = list(caseids)
+    requests = []
+    for caseid in caseids:
+        requests.append(FetchRequest((caseid, 'entries'), f'{api_base_url}/cases/entries/{caseid}', params))
+        requests.append(FetchRequest((caseid, 'deadlines'), f'{api_base_url}/cases/deadlines/{caseid}', params))
+    bundles = {caseid: CaseBundle(caseid=caseid) for caseid in caseids}
+
+    def _collect(result: FetchResult):
+        caseid, kind = result.key
+        bundle = bundles[caseid]
+        if not result.ok:
+            bundle.errors[kind] = result.error
+            return
+        if kind == 'entries':
+            frames = {'entries': result.data}
+        else:
+            deadlines, hearings = split_deadlines_and_hearings(result.data)
+            frames = {'deadlines': deadlines, 'hearings': hearings}
+        for name, frame in frames.items():
+            if stores:
+                stores[name].put(caseid, frame)
+            else:
+                setattr(bundle, name, frame)
+
+    await fetch_all(session, requests, headers=headers, concurrency=concurrency, on_result=_collect, auth=auth,
+                    cache=cache)
+    return [bundles[caseid] for caseid in caseids]
+
+
+class ChunkSizer:
+    """
+    Picks the number of cases per multi-case request. The size grows while responses come back quickly and small and
+    shrinks when they are slow, large or failing, so that per-request overhead is amortized without producing
+    responses the server struggles to build.
+    """
+
+    def __init__(self, initial: int, maximum: int, target_latency: float, max_rows: int):
+        self.size = max(1, initial)
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.max_rows = max_rows
+
+    def observe(self, chunk_len: int, latency: float, rows: int):
+        # scale towards the chunk that would take target_latency and stay under max_rows, at most 2x per step
+        scale = self.target_latency / max(latency, 1e-3)
+        if rows:
+            scale = min(scale, self.max_rows / rows)
+        scale = min(2.0, max(0.5, scale))
+        self.size = int(min(self.maximum, max(1, round(chunk_len * scale))))
+
+    def shrink(self):
+        self.size = max(1, self.size // 2)
+
+
+def cache_blocks(caseids: Iterable[int], size: int) -> List[List[int]]:
+    """
+    Splits case IDs into chunks that do not depend on timing, so that the same cases are always posted together. The
+    IDs are sorted and a chunk ends after every ID whose hash falls on a multiple of size, which makes chunks about size
+    cases long, and where it reaches twice that. The boundaries are taken from the IDs themselves, so a run with cases
+    added or removed changes only the chunks those cases fall in and the rest are still answered from the cache.
+
+    :param caseids: case IDs to split
+    :param size: average number of cases per chunk
+    :return: chunks of sorted case IDs
+    """
+    blocks: List[List[int]] = [[]]
+    for caseid in sorted(set(caseids)):
+        blocks[-1].append(caseid)
+        # hashed rather than the ID itself, which would cut consecutive IDs at a fixed stride
+        if zlib.crc32(str(caseid).encode()) % size == 0 or len(blocks[-1]) >= 2 * size:
+            blocks.append([])
+    return [block for block in blocks if block]
+
+
+async def fetch_batched(session: ClientSession, caseids: Iterable[int], headers: Optional[Dict] = None,
+                        params: Optional[Dict] = None,
+                        chunk_size: Optional[int] = None, concurrency: Optional[int] = None,
+                        on_result: Optional[Callable[[FetchResult], None]] = None,
+                        auth: Optional[TokenManager] = None,
+                        cache: Optional[ResponseCache] = None) -> List[FetchResult]:
+    """
+    Fetches docket entries for many cases through the multi-case endpoint. Case IDs are sent in chunks whose size adapts
+    to response latency and size, several chunks are in flight at once, and each response is split back into one
+    FetchResult per case. A failed chunk is split in half and retried until single cases are reached.
+
+    Adaptive chunks depend on timing and would differ from run to run, so with a cache the chunks are fixed instead,
+    see cache_blocks: a later run over the same cases posts the same bodies and is answered from the cache.
+
+    :param session: aiohttp session shared by all requests
+    :param caseids: case IDs to fetch
+    :param headers: headers sent with every request
+    :param params: query parameters sent with every request
+    :param chunk_size: initial number of cases per request, defaults to Config.fetch_chunk_size
+    :param concurrency: initial number of chunks in flight, defaults to Config.fetch_concurrency
+    :param on_result: callback that receives each per-case FetchResult as it completes
+    :param auth: TokenManager that supplies the Authorization header
+    :param cache: optional ResponseCache; chunks are then cut by cache_blocks and do not adapt
+    :return: list of FetchResult in case ID order
+    """
+    config = Config()
+    url = f'{config.base_api_url}{config.docket_entries_multi_case_endpoint}'
+    caseids = list(caseids)
+    size = chunk_size or config.fetch_chunk_size
+    # blocks of cases still to send; without a cache one block that chunks are cut from as the sizer decides
+    blocks = cache_blocks(caseids, min(size, config.fetch_chunk_max)) if cache is not None else [caseids]
+    pending = deque(block for block in blocks if block)
+    sizer = ChunkSizer(size, config.fetch_chunk_max, config.fetch_chunk_target_latency, config.fetch_chunk_max_rows)
+    results: Dict[int, FetchResult] = {}
+    # response time grows with the chunk size, which the sizer already steers, so only errors move the limit
+    limiter = AdaptiveLimiter(initial=concurrency, latency_tolerance=0)
+
+    def _finish(result: FetchResult):
+        if on_result is not None:
+            on_result(result)
+            result.data = None
+        results[result.key] = result
+
+    def _next_chunk() -> List[int]:
+        block = pending.popleft()
+        if cache is not None or len(block) <= sizer.size:
+            return block
+        pending.appendleft(block[sizer.size:])
+        return block[:sizer.size]
+
+    tasks: List[asyncio.Task] = []
+    workers = 0
+
+    def _staff():
+        # one worker per chunk the limit lets through, so that chunks are cut only as they can be sent and later ones
+        # get the size the sizer learned from the first responses
+        nonlocal workers
+        while pending and workers < int(limiter.limit):
+            workers += 1
+            tasks.append(asyncio.ensure_future(_worker()))
+
+    async def _worker():
+        nonlocal workers
+        try:
+            # a worker stops when the limit has dropped below the number of workers
+            while pending and workers <= int(limiter.limit):
+                await _fetch_chunk(_next_chunk())
+                _staff()
+        finally:
+            workers -= 1
+
+    async def _fetch_chunk(chunk: List[int]):
+        start = time.perf_counter()
+        result, = await fetch_all(session, [FetchRequest(tuple(chunk), url, params, json={'case_ids': chunk})],
+                                  headers=headers, auth=auth, cache=cache, limiter=limiter)
+        if not result.ok:
+            if len(chunk) > 1:
+                # bisect: retry the halves so one bad case cannot sink the whole chunk
+                sizer.shrink()
+                half = len(chunk) // 2
+                pending.appendleft(chunk[half:])
+                pending.appendleft(chunk[:half])
+            else:
+                _finish(FetchResult(key=chunk[0], error=result.error, attempts=result.attempts,
+                                    timed_out=result.timed_out))
+            return
+        df = result.data
+        sizer.observe(len(chunk), time.perf_counter() - start, df.shape[0])
+        frames = dict(iter(df.groupby('de_caseid', sort=False))) if not df.empty else {}
+        for caseid in chunk:
+            # cases without entries come back as an empty frame with the same columns
+            frame = frames.get(caseid, df.iloc[0:0]).reset_index(drop=True)
+            _finish(FetchResult(key=caseid, data=frame, attempts=result.attempts))
+
+    _staff()
+    while tasks:
+        # workers started meanwhile are awaited in the next round
+        running = tasks[:]
+        tasks.clear()
+        await asyncio.gather(*running)
+    return [results[caseid] for caseid in caseids]
@@ -0,0 +1,89 @@
+"""
+Module that indexes the rows of a frame by case ID. The milestone scripts take the rows of one case at a time; a mask
+such as df.loc[df['de_caseid'] == caseid] scans the whole frame for every case, which makes the loop over cases
+quadratic. CaseIndex sorts the frame by case once and keeps where each case's rows start and end, so the rows of a case
+are one positional slice.
+
+The sort is stable, so a case's rows keep their order and index labels, and a slice holds the same rows in the same
+order as the mask it replaces.
+
+Usage:
+entries = CaseIndex(df_entries, 'de_caseid')
+target = entries.get(41091)
+
+"""
+from typing import Dict, Iterable, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+
+class CaseIndex:
+    """
+    Rows of a frame grouped by case ID
+    """
+
+    def __init__(self, df: pd.DataFrame, case_column: str):
+        """
+        :param df: frame with one or more rows per case
+        :param case_column: column holding the case ID, e.g. 'de_caseid', 'sd_caseid' or 'Case ID'
+        """
+        self.case_column = case_column
+        caseids = df[case_column].to_numpy()
+        order = np.argsort(caseids, kind='stable')
+        self.frame = df.iloc[order]
+        sorted_caseids = caseids[order]
+        unique, starts = np.unique(sorted_caseids, return_index=True)
+        ends = np.append(starts[1:], len(sorted_caseids))
+        self._offsets: Dict[int, Tuple[int, int]] = {int(caseid): (int(start), int(end)) for caseid, start, end in
+                                                      zip(unique, starts, ends) if not pd.isna(caseid)}
+
+    @classmethod
+    def of(cls, df: Union[pd.DataFrame, 'CaseIndex'], case_column: str) -> 'CaseIndex':
+        """
+        An index over a frame, or the index itself when one is given, so that it is not sorted and copied again
+        """
+        return df if isinstance(df, CaseIndex) else cls(df, case_column)
+
+    def get(self, caseid: int) -> pd.DataFrame:
+        """
+        The rows of one case, as a new frame that can be changed without touching the index
+
+        :param caseid: case ID
+        :return: dataframe, empty when the case has no rows
+        """
+        start, end = self._offsets.get(int(caseid), (0, 0))
+        return self.frame.iloc[start:end].copy()
+
+    def take(self, caseids: Iterable[int]) -> pd.DataFrame:
+        """
+        The rows of several cases as one frame, e.g. to hand a batch of cases to a worker process
+
+        :param caseids: case IDs; cases without rows are skipped
+        :return: dataframe with the cases' rows in the order the case IDs are given
+        """
+        ranges = [self._offsets[int(caseid)] for caseid in caseids if int(caseid) in self._offsets]
+        positions = np.concatenate([np.arange(start, end) for start, end in ranges]) if ranges else []
+        return self.frame.iloc[positions]
+
+    def rows(self, caseid: int) -> int:
+        start, end = self._offsets.get(int(caseid), (0, 0))
+        return end - start
+
+    def first(self, caseid: int, column: str):
+        """
+        The value of a column in the first row of a case
+
+        :raises KeyError: when the case has no rows
+        """
+        start, _ = self._offsets[int(caseid)]
+        return self.frame[column].iat[start]
+
+    def caseids(self) -> List[int]:
+        return list(self._offsets)
+
+    def __contains__(self, caseid: int) -> bool:
+        return int(caseid) in self._offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets)
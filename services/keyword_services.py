@@ -0,0 +1,136 @@
+"""
+Module that matches docket text against keyword rules. A rule is compiled once per run: its keywords are merged into
+one trie and the trie into a single pattern, so a text is scanned once for all keywords together, as an Aho-Corasick
+automaton does, and the scan runs in the regex engine instead of in a Python loop per row and keyword. At every
+position the pattern takes the longest keyword, and the keywords that are prefixes of it are found with it, so each
+keyword is found wherever it occurs, overlapping or not.
+
+A rule matches when any of its keywords occurs in a text, or with require_all when every one of them does. It is
+applied to a whole text column at once and gives a mask.
+
+Usage:
+UA_RULE = KeywordRule(['screening', 'complaint', 'pauperis'])
+ua = target.loc[UA_RULE.mask(target['dt_text'])]
+UA_RULE.search('order screening complaint')
+
+"""
+import re
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+# characters that continue a word, as flashtext counts them
+WORD_CHARACTERS = '0-9A-Za-z_'
+
+
+def _trie(keywords: Iterable[str]) -> Dict:
+    trie: Dict = {}
+    for keyword in keywords:
+        node = trie
+        for character in keyword:
+            node = node.setdefault(character, {})
+        node[''] = {}
+    return trie
+
+
+def _trie_pattern(node: Dict) -> str:
+    """
+    Pattern of a trie node: one branch per next character, and the branches made optional where a keyword ends, so
+    that the longest keyword at a position is tried first
+    """
+    branches = [re.escape(character) + _trie_pattern(child) for character, child in sorted(node.items()) if character]
+    if not branches:
+        return ''
+    pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    if '' in node:
+        return f'(?:{pattern})?' if len(branches) > 1 or len(pattern) > 1 else f'{pattern}?'
+    return pattern
+
+
+class KeywordRule:
+    """
+    A set of keywords compiled into one pattern
+    """
+    _word_character = re.compile(f'[{WORD_CHARACTERS}]')
+
+    def __init__(self, keywords: Iterable[str], require_all: bool = False, whole_words: bool = False,
+                 ignore_case: bool = False):
+        """
+        :param keywords: keywords to look for; empty keywords are ignored
+        :param require_all: match only texts holding every keyword instead of any of them
+        :param whole_words: match a keyword only where it is not part of a longer word, as flashtext does
+        :param ignore_case: match regardless of case; docket text is already lowercased when it is loaded
+        """
+        self.keywords: Tuple[str, ...] = tuple(dict.fromkeys(keyword for keyword in keywords if keyword))
+        self.require_all = require_all
+        self.whole_words = whole_words
+        flags = re.IGNORECASE if ignore_case else 0
+        body = _trie_pattern(_trie(self.keywords)) if self.keywords else '(?!)'
+        if whole_words:
+            body = f'(?<![{WORD_CHARACTERS}])(?:{body})(?![{WORD_CHARACTERS}])'
+        self._pattern = re.compile(body, flags)
+        # a lookahead matches at every position, so that keywords inside a longer match are found as well
+        self._all_pattern = re.compile(f'(?=({body}))', flags)
+        self.ignore_case = ignore_case
+        self._found_with: Dict[str, FrozenSet[str]] = {}
+
+    def _with_prefixes(self, match: str) -> FrozenSet[str]:
+        """
+        The keywords found where match is the longest keyword: the match and the keywords it starts with, unless a
+        word goes on after them
+        """
+        found = self._found_with.get(match)
+        if found is None:
+            fold = str.lower if self.ignore_case else str
+            found = frozenset(keyword for keyword in self.keywords if fold(match).startswith(fold(keyword)) and
+                              (not self.whole_words or len(keyword) == len(match) or
+                               self._word_character.match(match, len(keyword)) is None))
+            self._found_with[match] = found
+        return found
+
+    def found(self, text: Optional[str]) -> Set[str]:
+        """
+        The keywords that occur in a text
+
+        :param text: text to scan; None holds no keywords
+        """
+        if not isinstance(text, str):
+            return set()
+        found: Set[str] = set()
+        for match in self._all_pattern.findall(text):
+            found |= self._with_prefixes(match)
+        return found
+
+    def search(self, text: Optional[str]) -> bool:
+        """
+        Whether a text matches the rule
+
+        :param text: text to scan; None never matches
+        """
+        if not isinstance(text, str):
+            return False
+        if not self.require_all:
+            return self._pattern.search(text) is not None
+        return len(self.found(text)) == len(self.keywords) > 0
+
+    def mask(self, texts: pd.Series) -> pd.Series:
+        """
+        Matches every text of a column
+
+        :param texts: column of text, e.g. dt_text of a case's entries
+        :return: boolean series with the index of texts
+        """
+        return pd.Series(np.fromiter(map(self.search, texts), dtype=bool, count=len(texts)), index=texts.index,
+                         dtype=bool)
+
+
+@lru_cache(maxsize=1024)
+def keyword_rule(keywords: Tuple[str, ...], require_all: bool = False, whole_words: bool = False,
+                 ignore_case: bool = False) -> KeywordRule:
+    """
+    A compiled rule, built once per process for each set of keywords; for rules whose keywords depend on the case,
+    e.g. an amended complaint's document number
+    """
+    return KeywordRule(keywords, require_all=require_all, whole_words=whole_words, ignore_case=ignore_case)
@@ -0,0 +1,83 @@
+"""
+Module that spreads per-case extraction over worker processes. Case IDs are split into balanced chunks, each chunk is
+handed to a worker together with only the rows of its own cases, and the per-case results are put back in case order,
+so a parallel run returns exactly what a serial run does.
+
+Chunks are balanced by weight, e.g. the number of docket entries of each case, as the extraction time of a case grows
+with its docket. There are several chunks per worker so that a worker that finishes early picks up another chunk.
+
+Usage:
+chunks = balanced_chunks(caseids, weights, jobs)
+results = run_chunks(_extract_cases, [make_payload(chunk) for chunk in chunks], jobs)
+
+"""
+import heapq
+import itertools
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from colorama import Fore
+
+# chunks per worker process; more chunks balance better, fewer pickle less
+CHUNKS_PER_JOB = 4
+# chunks per worker process submitted ahead; the payloads of later chunks are not built until these finish
+CHUNKS_IN_FLIGHT_PER_JOB = 2
+
+
+def resolve_jobs(jobs: Optional[int]) -> int:
+    """
+    :param jobs: number of worker processes; 0 or None for one per CPU core this process may run on
+    """
+    if jobs and jobs > 0:
+        return jobs
+    return len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+
+
+def balanced_chunks(caseids: Iterable[int], weights: Dict[int, float], jobs: int) -> List[List[int]]:
+    """
+    Splits case IDs into chunks of about equal total weight: the heaviest cases are placed first, each in the lightest
+    chunk so far
+
+    :param caseids: case IDs; duplicates are placed once
+    :param weights: weight of each case; cases without a weight count as 1
+    :param jobs: number of worker processes
+    :return: non-empty chunks, each in case ID order; a single chunk when jobs is 1
+    """
+    caseids = sorted(set(int(caseid) for caseid in caseids))
+    count = min(len(caseids), 1 if jobs <= 1 else jobs * CHUNKS_PER_JOB)
+    chunks: List[List[int]] = [[] for _ in range(count)]
+    loads = [(0.0, i) for i in range(count)]
+    for caseid in sorted(caseids, key=lambda caseid: -max(weights.get(caseid, 1), 1)):
+        load, i = heapq.heappop(loads)
+        chunks[i].append(caseid)
+        heapq.heappush(loads, (load + max(weights.get(caseid, 1), 1), i))
+    return [sorted(chunk) for chunk in chunks if chunk]
+
+
+def run_chunks(func: Callable[..., Any], payloads: Iterable[tuple], jobs: int) -> List[Any]:
+    """
+    Calls func once per payload, in worker processes when jobs > 1. Payloads are taken from the iterable one at a time
+    and at most CHUNKS_IN_FLIGHT_PER_JOB per worker are submitted ahead, so a generator of payloads never has the rows
+    of every chunk in memory at once.
+
+    :param func: module-level function, so that it can be sent to the workers
+    :param payloads: argument tuples, one per chunk, best given as a generator
+    :param jobs: number of worker processes; 1 runs the chunks in this process
+    :return: the results, in the order of the payloads
+    """
+    payloads = iter(payloads)
+    first = list(itertools.islice(payloads, 2))
+    if jobs <= 1 or len(first) <= 1:
+        return [func(*payload) for payload in itertools.chain(first, payloads)]
+    print(Fore.WHITE + f'Extracting chunks on {jobs} worker process(es)', flush=True)
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = deque()
+        for payload in itertools.chain(first, payloads):
+            if len(futures) >= jobs * CHUNKS_IN_FLIGHT_PER_JOB:
+                results.append(futures.popleft().result())
+            futures.append(pool.submit(func, *payload))
+        results.extend(future.result() for future in futures)
+    return results
@@ -0,0 +1,284 @@
+"""
+Module that caches the output frames of pipeline stages, so that a stage whose inputs, parameters and code have not
+changed since the last run is served from disk instead of being computed again. This lets the reports at the end of
+the pipeline be reworked without re-running the extraction in front of them.
+
+A stage is keyed by a fingerprint of:
+- the content of its input files and directories; file digests are remembered by path, size and mtime, so unchanged
+  inputs are not hashed again, and an input rewritten with the same content still matches
+- its parameters, as JSON
+- the source of its code and of the project modules that code imports, and the pandas and pyarrow versions
+
+Outputs are stored as Parquet files under the fingerprint, index included. When the cache grows beyond its size limit
+the least recently used entries are evicted.
+
+Usage:
+cache = StageCache()
+outputs = cache.run('case_metrics', extract_case_metrics, inputs=['data_files/civil_cases_2020-2023.csv'],
+                    params={'start': '2020-01-01'}, code=[case_metrics])
+
+"""
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from colorama import Fore
+
+from configuration.config import Config
+from services.dataset_services import to_dataframe, to_table
+from services.store_services import STATE_FILE
+
+# bump to drop every entry written by an older layout
+CACHE_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+DIGESTS_FILE = 'digests.json'
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+IGNORED_FILES = {STATE_FILE}
+# outputs of a stage that returns a single frame
+DEFAULT_OUTPUT = 'output'
+
+Outputs = Union[pd.DataFrame, Dict[str, pd.DataFrame]]
+
+
+def _project_module(value: Any) -> Optional[ModuleType]:
+    """
+    The module of this project a global refers to: a module itself or the module a function or class is defined in
+    """
+    module = value if isinstance(value, ModuleType) else sys.modules.get(getattr(value, '__module__', None) or '')
+    path = getattr(module, '__file__', None)
+    if not path or 'site-packages' in Path(path).parts or not Path(path).resolve().is_relative_to(PROJECT_ROOT):
+        return None
+    return module
+
+
+class StageCache:
+    """
+    On-disk cache of stage outputs keyed by a fingerprint of their inputs, parameters and code
+    """
+
+    def __init__(self, root: Optional[str] = None, max_bytes: Optional[int] = None, enabled: Optional[bool] = None):
+        config = Config()
+        self.root = Path(root or config.stage_cache_dir)
+        self.max_bytes = config.stage_cache_max_bytes if max_bytes is None else max_bytes
+        self.enabled = config.stage_cache_enabled if enabled is None else enabled
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._digests: Optional[Dict[str, list]] = None
+
+    # fingerprints
+
+    def _load_digests(self) -> Dict[str, list]:
+        if self._digests is None:
+            try:
+                with open(self.root / DIGESTS_FILE) as f:
+                    self._digests = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self._digests = {}
+        return self._digests
+
+    def _save_digests(self):
+        tmp_path = self.root / f'{DIGESTS_FILE}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._digests, f)
+        os.replace(tmp_path, self.root / DIGESTS_FILE)
+
+    def file_digest(self, path: Path) -> str:
+        """
+        Content hash of a file, remembered until the file's size or mtime changes
+        """
+        stat = path.stat()
+        digests = self._load_digests()
+        key = str(path.resolve())
+        known = digests.get(key)
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            return known[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 ** 2), b''):
+                digest.update(block)
+        digests[key] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digests[key][2]
+
+    @staticmethod
+    def _input_files(path: Path) -> Iterator[Path]:
+        if path.is_file():
+            yield path
+        elif path.is_dir():
+            for file in sorted(path.rglob('*')):
+                parts = file.relative_to(path).parts
+                # temporary files come and go while a directory is written; sync bookkeeping is not data
+                if file.is_file() and file.name not in IGNORED_FILES and not any(
+                        part.startswith('.') or '.tmp' in part or '.old-' in part for part in parts):
+                    yield file
+
+    def inputs_digest(self, inputs: Iterable[str]) -> List:
+        fingerprint = []
+        for name in inputs:
+            path = Path(name)
+            files = [[str(file.relative_to(path)) if file != path else '', self.file_digest(file)]
+                     for file in self._input_files(path)]
+            fingerprint.append([str(name), files if path.exists() else None])
+        if self._digests is not None:
+            self._save_digests()
+        return fingerprint
+
+    @staticmethod
+    def code_digest(code: Iterable[Any]) -> str:
+        """
+        Hashes the source of the given modules, functions and classes, and of every module of this project they
+        import. A function or class is hashed by its own source, so that editing the rest of a script, e.g. the report
+        written from a stage's outputs, does not invalidate the stage.
+        """
+        digest = hashlib.sha256()
+        modules: Dict[str, ModuleType] = {}
+        pending = []
+        for item in code:
+            if isinstance(item, ModuleType):
+                pending.append(item)
+            else:
+                digest.update(inspect.getsource(item).encode())
+                pending.extend(module for module in map(_project_module, vars(inspect.getmodule(item)).values())
+                               if module is not None and module is not inspect.getmodule(item))
+        while pending:
+            module = pending.pop()
+            if module.__file__ in modules:
+                continue
+            modules[module.__file__] = module
+            pending.extend(filter(None, map(_project_module, vars(module).values())))
+        for path in sorted(modules):
+            digest.update(Path(path).read_bytes())
+        return digest.hexdigest()
+
+    def fingerprint(self, stage: str, inputs: Iterable[str] = (), params: Optional[Dict] = None,
+                    code: Iterable[Any] = ()) -> str:
+        """
+        Hashes everything a stage's outputs depend on
+
+        :param stage: stage name
+        :param inputs: input files or directories
+        :param params: parameters of the stage, as JSON serializable values
+        :param code: modules, functions or classes that compute the stage
+        :return: hex digest
+        """
+        fingerprint = [CACHE_VERSION, stage, self.inputs_digest(inputs), params or {}, self.code_digest(code),
+                       pd.__version__, pa.__version__]
+        return hashlib.sha256(json.dumps(fingerprint, sort_keys=True, default=str).encode()).hexdigest()
+
+    # entries
+
+    def _entry_path(self, stage: str, key: str) -> Path:
+        return self.root / stage / key
+
+    def get(self, stage: str, key: str) -> Optional[Dict[str, pd.DataFrame]]:
+        """
+        Reads the outputs stored under a fingerprint
+
+        :return: frames by output name, or None on a miss
+        """
+        path = self._entry_path(stage, key)
+        try:
+            with open(path / MANIFEST_FILE) as f:
+                manifest = json.load(f)
+            outputs = {}
+            for name, index_names in manifest['outputs'].items():
+                df = to_dataframe(pq.read_table(path / f'{name}.parquet', memory_map=True))
+                levels = [f'__index_level_{i}__' for i in range(len(index_names))]
+                df = df.set_index(levels)
+                df.index.names = index_names
+                outputs[name] = df
+        except (FileNotFoundError, json.JSONDecodeError, KeyError, OSError):
+            return None
+        # the manifest's mtime is the last access time used for eviction
+        os.utime(path / MANIFEST_FILE)
+        return outputs
+
+    def put(self, stage: str, key: str, outputs: Dict[str, pd.DataFrame]):
+        """
+        Stores the outputs of a stage under a fingerprint. The entry is written to a temporary directory and renamed, so
+        a crash mid-write never leaves a partial entry behind.
+        """
+        path = self._entry_path(stage, key)
+        tmp_path = path.with_name(f'.tmp-{key}-{os.getpid()}')
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        tmp_path.mkdir(parents=True)
+        manifest = {'stage': stage, 'stored': time.time(), 'outputs': {}}
+        for name, df in outputs.items():
+            levels = [f'__index_level_{i}__' for i in range(df.index.nlevels)]
+            pq.write_table(to_table(df.reset_index(names=levels)), tmp_path / f'{name}.parquet')
+            manifest['outputs'][name] = list(df.index.names)
+        with open(tmp_path / MANIFEST_FILE, 'w') as f:
+            json.dump(manifest, f, default=str)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def run(self, stage: str, compute: Callable[..., Outputs], inputs: Iterable[str] = (),
+            params: Optional[Dict] = None, code: Iterable[Any] = (), refresh: bool = False) -> Outputs:
+        """
+        Returns the outputs of a stage from the cache, or computes and stores them
+
+        :param stage: stage name
+        :param compute: function computing the stage; called with params as keyword arguments and returning a frame or
+        a dict of frames
+        :param inputs: input files or directories the stage reads
+        :param params: parameters of the stage, as JSON serializable values
+        :param code: modules, functions or classes that compute the stage; defaults to compute
+        :param refresh: recompute even on a hit
+        :return: what compute returns
+        """
+        if not self.enabled:
+            return compute(**(params or {}))
+        inputs = list(inputs)
+        key = self.fingerprint(stage, inputs, params, list(code) or [compute])
+        outputs = None if refresh else self.get(stage, key)
+        if outputs is not None:
+            print(Fore.GREEN + f'{stage}: inputs and code unchanged, using cached outputs {key[:12]}', flush=True)
+            return outputs[DEFAULT_OUTPUT] if list(outputs) == [DEFAULT_OUTPUT] else outputs
+        started = time.perf_counter()
+        result = compute(**(params or {}))
+        self.put(stage, key, {DEFAULT_OUTPUT: result} if isinstance(result, pd.DataFrame) else result)
+        print(Fore.WHITE + f'{stage}: computed in {time.perf_counter() - started:.1f}s and cached as {key[:12]}',
+              flush=True)
+        return result
+
+    # eviction
+
+    def _entries(self) -> List[Path]:
+        return [manifest.parent for manifest in self.root.glob(f'*/*/{MANIFEST_FILE}')]
+
+    @staticmethod
+    def _entry_size(path: Path) -> int:
+        return sum(file.stat().st_size for file in path.iterdir() if file.is_file())
+
+    def size(self) -> int:
+        """
+        Bytes used by the stored entries
+        """
+        return sum(self._entry_size(path) for path in self._entries())
+
+    def evict(self, max_bytes: Optional[int] = None):
+        """
+        Drops least recently used entries until the stored entries fit in max_bytes
+
+        :param max_bytes: size limit, defaults to the cache's max_bytes
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = sorted(((path / MANIFEST_FILE).stat().st_mtime, path) for path in self._entries())
+        size = sum(self._entry_size(path) for _, path in entries)
+        for _, path in entries:
+            if size <= max_bytes:
+                break
+            size -= self._entry_size(path)
+            shutil.rmtree(path, ignore_errors=True)
+
+    def clear(self):
+        self.evict(max_bytes=0)
@@ -0,0 +1,276 @@
+"""
+Module that keeps fetched case data on disk, keyed by case ID. Fetch and sync write each case to its own Parquet file
+so that a single case can be replaced or merged without touching the rest of the corpus. compact() then folds the
+per-case files into one dataset partitioned by case ID bucket (see dataset_services), which later stages read with only
+the columns and cases they need instead of opening thousands of small files. A per-case file always takes precedence
+over the compacted copy of the same case, so a crash between writing and compacting loses nothing.
+
+Cases written by earlier versions as pickle files are still read, and are folded into the dataset by compact().
+Sync bookkeeping such as the per-case sync watermarks is kept next to the case files in a small JSON state file.
+
+"""
+import json
+import os
+import pickle
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from services.dataset_services import CASE_BUCKET, case_bucket, open_dataset, read_dataset, table_metadata, \
+    to_dataframe, to_table, with_metadata, write_dataset
+
+STATE_FILE = '_state.json'
+COMPACTED_DIR = '_compacted'
+# case ID column added to the compacted dataset, so that it does not depend on the column names of the stored frames
+STORE_KEY = '_caseid'
+
+
+class CaseStore:
+    """
+    Directory of per-case dataframes keyed by case ID
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._compacted_caseids: Optional[Set[int]] = None
+
+    def _path(self, caseid: int) -> Path:
+        return self.root / f'{int(caseid)}.parquet'
+
+    def _legacy_path(self, caseid: int) -> Path:
+        return self.root / f'{int(caseid)}.pkl'
+
+    def _compacted(self) -> Optional[ds.Dataset]:
+        path = self.root / COMPACTED_DIR
+        return open_dataset(str(path)) if path.is_dir() else None
+
+    def _compacted_ids(self) -> Set[int]:
+        if self._compacted_caseids is None:
+            dataset = self._compacted()
+            self._compacted_caseids = set() if dataset is None else \
+                set(pc.unique(dataset.to_table(columns=[STORE_KEY])[STORE_KEY]).to_pylist())
+        return self._compacted_caseids
+
+    def _loose_caseids(self) -> List[int]:
+        """
+        Cases stored in their own file, as Parquet or as a legacy pickle
+        """
+        return sorted({int(path.stem) for pattern in ('*.parquet', '*.pkl') for path in self.root.glob(pattern)
+                       if path.stem.isdigit()})
+
+    def _is_loose(self, caseid: int) -> bool:
+        return self._path(caseid).exists() or self._legacy_path(caseid).exists()
+
+    def __contains__(self, caseid: int) -> bool:
+        return self._is_loose(caseid) or int(caseid) in self._compacted_ids()
+
+    def caseids(self) -> List[int]:
+        return sorted(set(self._loose_caseids()) | self._compacted_ids())
+
+    def _read_loose(self, caseid: int, columns: Optional[List[str]] = None) -> pa.Table:
+        # reading the file directly skips the dataset machinery, which costs more than reading a small case
+        return pq.ParquetFile(self._path(caseid), memory_map=True).read(columns=columns, use_threads=False)
+
+    def _get_loose(self, caseid: int, columns: Optional[List[str]] = None) -> Optional[pd.DataFrame]:
+        try:
+            return to_dataframe(self._read_loose(caseid, columns))
+        except FileNotFoundError:
+            pass
+        try:
+            with open(self._legacy_path(caseid), 'rb') as f:
+                df = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        return df if columns is None else df[columns]
+
+    def _read_compacted(self, dataset: ds.Dataset, columns: Optional[List[str]], exclude: Optional[List[str]],
+                        caseids: Optional[Iterable[int]], filters: Optional[Dict],
+                        keep_key: bool = False) -> pd.DataFrame:
+        exclude = list(exclude or [])
+        if not keep_key:
+            exclude.append(STORE_KEY)
+        elif columns is not None and STORE_KEY not in columns:
+            columns = [*columns, STORE_KEY]
+        return read_dataset(dataset, columns=columns, exclude=exclude, caseids=caseids, filters=filters)
+
+    def get(self, caseid: int, columns: Optional[List[str]] = None) -> Optional[pd.DataFrame]:
+        """
+        Reads one case
+
+        :param caseid: case ID
+        :param columns: columns to read, defaults to all
+        :return: dataframe, or None when the case is not stored
+        """
+        df = self._get_loose(caseid, columns)
+        if df is not None or int(caseid) not in self._compacted_ids():
+            return df
+        return self._read_compacted(self._compacted(), columns, None, [caseid], None)
+
+    def put(self, caseid: int, df: pd.DataFrame):
+        """
+        Writes a case to disk. The file is written under a temporary name and renamed so that a crash mid-write never
+        leaves a truncated case behind.
+        """
+        path = self._path(caseid)
+        tmp_path = path.with_suffix('.tmp')
+        pq.write_table(to_table(df), tmp_path)
+        os.replace(tmp_path, path)
+        self._legacy_path(caseid).unlink(missing_ok=True)
+
+    def merge_entries(self, caseid: int, delta: pd.DataFrame):
+        """
+        Merges newly entered docket entries into a stored case. Every entry (de_seqno) present in the delta replaces the
+        stored rows for that entry so that re-syncing an overlapping window is idempotent.
+
+        :param caseid: case ID
+        :param delta: docket entry rows for the case entered since the last sync
+        """
+        existing = self.get(caseid)
+        if existing is not None and not existing.empty:
+            existing = existing.loc[~existing['de_seqno'].isin(delta['de_seqno'])]
+            delta = pd.concat([existing, delta], ignore_index=True)
+        delta = delta.sort_values(by=['de_seqno'], kind='mergesort').reset_index(drop=True)
+        self.put(caseid, delta)
+
+    def iter_frames(self, caseids: Optional[Iterable[int]] = None,
+                    columns: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+        """
+        Lazily yields stored cases one at a time. Compacted cases are read one case ID bucket at a time, so they are
+        yielded in bucket order after the cases stored in their own files.
+
+        :param caseids: cases to read, defaults to every stored case
+        :param columns: columns to read, defaults to all
+        """
+        caseids = self.caseids() if caseids is None else [int(caseid) for caseid in caseids]
+        buckets: Dict[int, List[int]] = {}
+        for caseid in caseids:
+            if self._is_loose(caseid):
+                df = self._get_loose(caseid, columns)
+                if df is not None:
+                    yield df
+            elif caseid in self._compacted_ids():
+                buckets.setdefault(case_bucket(caseid), []).append(caseid)
+        dataset = self._compacted() if buckets else None
+        for bucket in sorted(buckets):
+            df = self._read_compacted(dataset, columns, None, buckets[bucket], None, keep_key=True)
+            for _, frame in df.groupby(STORE_KEY, sort=False):
+                yield frame.drop(columns=STORE_KEY).reset_index(drop=True)
+
+    def read(self, columns: Optional[List[str]] = None, exclude: Optional[List[str]] = None,
+             caseids: Optional[Iterable[int]] = None, filters: Optional[Dict] = None) -> pd.DataFrame:
+        """
+        Reads the stored cases as one dataframe. Only the requested columns are read, and of the compacted dataset only
+        the buckets holding the requested cases, so a stage that needs a few columns of a subset of cases does not pay
+        for the rest.
+
+        :param columns: columns to read, defaults to all
+        :param exclude: columns not to read
+        :param caseids: cases to read, defaults to every stored case
+        :param filters: row conditions, see dataset_services.read_dataset
+        :return: dataframe; cases not yet compacted follow the others
+        """
+        loose = self._loose_caseids()
+        wanted = None if caseids is None else {int(caseid) for caseid in caseids}
+        frames = []
+        dataset = self._compacted()
+        if dataset is not None:
+            conditions = dict(filters or {})
+            if wanted is None and loose:
+                conditions[STORE_KEY] = ~ds.field(STORE_KEY).isin(loose)
+            frames.append(self._read_compacted(dataset, columns, exclude,
+                                               None if wanted is None else sorted(wanted - set(loose)), conditions))
+        if wanted is not None:
+            loose = [caseid for caseid in loose if caseid in wanted]
+        paths = [str(self._path(caseid)) for caseid in loose if self._path(caseid).exists()]
+        if paths:
+            # cases are written one at a time, so e.g. a column that is empty in one case is null-typed there
+            schema = pa.unify_schemas([pq.read_schema(path, memory_map=True) for path in paths],
+                                      promote_options='permissive').remove_metadata()
+            frames.append(read_dataset(open_dataset(paths, schema=schema), columns=columns, exclude=exclude,
+                                       filters=filters))
+        legacy = [caseid for caseid in loose if not self._path(caseid).exists()]
+        if legacy:
+            if filters:
+                raise ValueError('filters are not supported for pickled cases; compact the store first')
+            frames.extend(df.drop(columns=exclude or [], errors='ignore') for df in self.iter_frames(legacy, columns))
+        frames = [df for df in frames if not df.empty] or frames[:1]
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+    def compact(self) -> int:
+        """
+        Folds the cases stored in their own files into the compacted dataset and removes their files. Cases without
+        rows stay in their own files, as the dataset has no rows to keep them by.
+
+        :return: number of cases compacted
+        """
+        loose = self._loose_caseids()
+        tables = {}
+        for caseid in loose:
+            if self._path(caseid).exists():
+                table = self._read_loose(caseid)
+            else:
+                df = self._get_loose(caseid)
+                table = None if df is None else to_table(df)
+            if table is not None and table.num_rows:
+                tables[caseid] = table.append_column(STORE_KEY, pa.array([caseid] * table.num_rows, pa.int64()))
+        if not tables:
+            return 0
+        parts = list(tables.values())
+        dataset = self._compacted()
+        if dataset is not None:
+            kept = dataset.to_table(columns=[name for name in dataset.schema.names if name != CASE_BUCKET],
+                                    filter=~ds.field(STORE_KEY).isin(loose))
+            parts.insert(0, kept.replace_schema_metadata(dataset.schema.metadata))
+        json_columns = sorted({column for table in parts for column in table_metadata(table.schema)['json_columns']})
+        # cases are written one at a time, so e.g. a column that is empty in one case is null-typed there
+        table = pa.concat_tables([table.replace_schema_metadata() for table in parts], promote_options='permissive')
+        table = table.sort_by(STORE_KEY)
+        write_dataset(with_metadata(table, json_columns, STORE_KEY), str(self.root / COMPACTED_DIR),
+                      partition_by=CASE_BUCKET, case_column=STORE_KEY)
+        self._compacted_caseids = None
+        for caseid in tables:
+            self._path(caseid).unlink(missing_ok=True)
+            self._legacy_path(caseid).unlink(missing_ok=True)
+        return len(tables)
+
+    def import_frames(self, frames: Iterable[pd.DataFrame], key_column: str) -> int:
+        """
+        Seeds the store from a list of per-case dataframes such as the legacy docket_entries.pkl
+
+        Usage:
+        with open('data_files/docket_entries.pkl', 'rb') as f:
+            store = CaseStore('data_files/docket_entries')
+            store.import_frames(pickle.load(f), 'de_caseid')
+            store.compact()
+
+        :param frames: per-case dataframes
+        :param key_column: column holding the case ID, e.g. 'de_caseid' or 'sd_caseid'
+        :return: number of cases written
+        """
+        count = 0
+        for df in frames:
+            if key_column in df.columns and not df.empty:
+                self.put(df[key_column].iloc[0], df)
+                count += 1
+        return count
+
+    def load_state(self) -> Dict:
+        try:
+            with open(self.root / STATE_FILE) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def save_state(self, state: Dict):
+        tmp_path = self.root / f'{STATE_FILE}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.root / STATE_FILE)
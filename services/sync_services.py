@@ -0,0 +1,138 @@
+"""
+Module that keeps a local CaseStore of docket entries up to date without re-downloading every docket. Cases that are
+already in the store are brought up to date with the docket-entries-by-date endpoint, which returns only the entries
+entered since the last sync watermark (de_date_enter). Cases that are not yet in the store are fetched in full, and so
+are stored cases that were left out of a sync the others took part in: watermarks are kept per case, and a case
+behind the rest is caught up with its full docket rather than widening the delta for every case.
+
+Entries that are deleted from a docket after they were synced are not detected by a delta sync; remove the case from
+the store to force a full refetch.
+
+"""
+import datetime
+from typing import Dict, Iterable, List, Optional
+
+import pandas as pd
+from aiohttp import ClientSession
+from colorama import Fore
+
+from configuration.config import Config
+from services.api_connection import TokenManager
+from services.fetch_services import FetchRequest, FetchResult, fetch_all, report_failures
+from services.store_services import CaseStore
+
+date_format = '%Y-%m-%d'
+entries_params = {'documents': 'false', 'docket_text': 'true'}
+
+
+def _max_date_entered(frames: Iterable[pd.DataFrame]) -> Optional[datetime.date]:
+    dates = [pd.to_datetime(df['de_date_enter'], errors='coerce').max() for df in frames
+             if 'de_date_enter' in df.columns and not df.empty]
+    dates = [date for date in dates if not pd.isnull(date)]
+    return max(dates).date() if dates else None
+
+
+def get_watermarks(store: CaseStore, caseids: Iterable[int]) -> Dict[int, Optional[datetime.date]]:
+    """
+    Returns the date each case was last synced up to. Cases synced before watermarks were kept per case fall back to
+    the store's single watermark, and stores that predate sync bookkeeping are scanned for each case's latest
+    de_date_enter.
+
+    :param store: CaseStore of docket entries
+    :param caseids: stored cases to look up
+    :return: case ID -> watermark date, None for a case without entries
+    """
+    state = store.load_state()
+    marks = state.get('watermarks', {})
+    fallback = state.get('watermark')
+    watermarks = {}
+    unmarked = []
+    for caseid in caseids:
+        mark = marks.get(str(caseid), fallback)
+        watermarks[caseid] = datetime.datetime.strptime(mark, date_format).date() if mark else None
+        if not mark:
+            unmarked.append(caseid)
+    for df in store.iter_frames(unmarked, columns=['de_caseid', 'de_date_enter']) if unmarked else []:
+        if not df.empty:
+            watermarks[int(df['de_caseid'].iloc[0])] = _max_date_entered([df])
+    return watermarks
+
+
+async def sync_docket_entries(session: ClientSession, caseids: Iterable[int], store: CaseStore,
+                              headers: Optional[Dict] = None, auth: Optional[TokenManager] = None) -> List[int]:
+    """
+    Brings the docket entries of the given cases in the store up to date
+
+    :param session: aiohttp session shared by all requests
+    :param caseids: cases to keep in sync
+    :param store: CaseStore of docket entries
+    :param headers: headers sent with every request
+    :param auth: TokenManager that supplies the Authorization header
+    :return: case IDs that could not be fetched
+    """
+    config = Config()
+    api_base_url = config.base_api_url
+    caseids = list(caseids)
+    known = [caseid for caseid in caseids if caseid in store]
+    new = [caseid for caseid in caseids if caseid not in store]
+    marks = get_watermarks(store, known)
+    watermark = max(filter(None, marks.values()), default=None)
+    # a case left out of earlier syncs is behind the others; a delta from their watermark would miss its entries in
+    # between, so it is fetched in full like a new case. Without a watermark there is nothing to take a delta from.
+    behind = {caseid for caseid in known if marks[caseid] is None or marks[caseid] < watermark}
+    new += [caseid for caseid in known if caseid in behind]
+    known = [caseid for caseid in known if caseid not in behind]
+    today = datetime.date.today()
+    failed = []
+    # latest de_date_enter fetched in this run, and the cases that are now synced up to it
+    latest = watermark
+    synced = []
+
+    def _write(result: FetchResult):
+        # each docket goes to disk as it arrives, so a first sync does not hold the whole district in memory
+        nonlocal latest
+        if result.ok:
+            store.put(result.key, result.data)
+            synced.append(result.key)
+            latest = max(filter(None, [latest, _max_date_entered([result.data])]), default=None)
+
+    # full refetch only for cases that have never been synced or were left out of a sync
+    if new:
+        print(Fore.YELLOW + f'Fetching full dockets for {len(new)} new or lagging case(s)...', flush=True)
+        requests = [FetchRequest(caseid, f'{api_base_url}/cases/entries/{caseid}', entries_params) for caseid in new]
+        results = await fetch_all(session, requests, headers=headers, on_result=_write, auth=auth)
+        failed.extend(report_failures(results))
+
+    # delta for every known case in one request
+    if known:
+        print(Fore.YELLOW + f'Fetching entries entered since {watermark:{date_format}}...', flush=True)
+        params = dict(entries_params, start_date=watermark.strftime(date_format), end_date=today.strftime(date_format))
+        url = f'{api_base_url}{config.docket_entries_by_date_endpoint}'
+        result, = await fetch_all(session, [FetchRequest('delta', url, params)], headers=headers, auth=auth)
+        if not result.ok:
+            # the known cases keep their watermark so the next run picks up the same window; the dockets fetched in
+            # full are complete, so they take the same watermark and are not counted as behind next time
+            _save_watermarks(store, synced, watermark)
+            return failed + known
+        delta = result.data
+        if not delta.empty:
+            delta = delta.loc[delta['de_caseid'].isin(known)]
+            for caseid, entries in delta.groupby('de_caseid', sort=False):
+                store.merge_entries(caseid, entries)
+            print(Fore.WHITE + f'Merged {delta.shape[0]} entries into '
+                               f'{delta["de_caseid"].nunique()} case(s)', flush=True)
+            latest = max(filter(None, [latest, _max_date_entered([delta])]), default=None)
+
+    # cases left out of this run keep their watermark
+    _save_watermarks(store, synced + known, latest)
+    return failed
+
+
+def _save_watermarks(store: CaseStore, caseids: List[int], watermark: Optional[datetime.date]):
+    if watermark is None or not caseids:
+        return
+    state = store.load_state()
+    marks = state.setdefault('watermarks', {})
+    for caseid in caseids:
+        marks[str(caseid)] = watermark.strftime(date_format)
+    store.save_state(state)
@@ -0,0 +1,130 @@
+"""
+Module that keeps docket text apart from the docket entries frame. The text is by far the largest column and most
+extractors never read it, so it is lowercased once when the entries are loaded, compressed case by case, and only
+decompressed for the case being processed.
+
+Usage:
+docket_text = DocketText.pop(df_entries)
+...
+target = docket_text.attach(df_entries.loc[df_entries['de_caseid'] == caseid])
+
+"""
+import zlib
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+TEXT_COLUMN = 'dt_text'
+# numbers the rows of a multi-part entry so that every row has its own key
+PART_COLUMN = 'dt_part'
+
+
+@dataclass
+class _CaseText:
+    keys: pd.Index
+    offsets: np.ndarray
+    nulls: Optional[np.ndarray]
+    blob: bytes
+
+    def texts(self) -> np.ndarray:
+        data = zlib.decompress(self.blob)
+        texts = np.array([data[start:end].decode() for start, end in zip(self.offsets[:-1], self.offsets[1:])],
+                         dtype=object)
+        if self.nulls is not None:
+            texts[self.nulls] = None
+        return texts
+
+
+def _keys(seqnos, parts) -> pd.Index:
+    return pd.Index(np.asarray(seqnos, dtype=np.int64) * 65536 + np.asarray(parts, dtype=np.int64))
+
+
+class DocketText:
+    """
+    Lowercased docket text keyed by (case, seqno, part), compressed per case
+    """
+
+    def __init__(self, level: int = 1):
+        """
+        :param level: zlib compression level; 1 compresses docket text about 3x at little cost
+        """
+        self.level = level
+        self._cases: Dict[int, _CaseText] = {}
+
+    @classmethod
+    def pop(cls, df_entries: pd.DataFrame, level: int = 1) -> 'DocketText':
+        """
+        Moves the docket text out of an entries frame into a new store. The entries frame loses dt_text and gains a
+        small dt_part column, which attach uses to put each text back on its row.
+
+        :param df_entries: dataframe of docket entries, changed in place
+        :param level: zlib compression level
+        :return: the store
+        """
+        store = cls(level)
+        df_entries[PART_COLUMN] = pd.to_numeric(df_entries.groupby(['de_caseid', 'de_seqno'], sort=False).cumcount(),
+                                                downcast='integer')
+        store.add(df_entries)
+        df_entries.drop(columns=TEXT_COLUMN, inplace=True)
+        return store
+
+    def add(self, df_entries: pd.DataFrame):
+        """
+        Normalizes and stores the text of the given entries, replacing the text of cases already stored
+
+        :param df_entries: dataframe with de_caseid, de_seqno, dt_part and dt_text
+        """
+        texts = df_entries[TEXT_COLUMN].str.lower().to_numpy()
+        seqnos = df_entries['de_seqno'].to_numpy()
+        parts = df_entries[PART_COLUMN].to_numpy()
+        for caseid, positions in df_entries.groupby('de_caseid', sort=False).indices.items():
+            case_texts = texts[positions]
+            nulls = pd.isna(case_texts)
+            encoded = [b'' if null else text.encode() for text, null in zip(case_texts, nulls)]
+            self._cases[int(caseid)] = _CaseText(keys=_keys(seqnos[positions], parts[positions]),
+                                                 offsets=np.cumsum([0] + [len(text) for text in encoded]),
+                                                 nulls=nulls if nulls.any() else None,
+                                                 blob=zlib.compress(b''.join(encoded), self.level))
+
+    def attach(self, target: pd.DataFrame) -> pd.DataFrame:
+        """
+        Returns the entries with their docket text as the last column, in place of dt_part
+
+        :param target: entries of one or more cases, as taken from the frame the text was popped from
+        :return: new dataframe
+        """
+        values = np.empty(len(target), dtype=object)
+        caseids = target['de_caseid'].to_numpy()
+        keys = _keys(target['de_seqno'], target[PART_COLUMN])
+        for caseid in pd.unique(caseids):
+            rows = np.flatnonzero(caseids == caseid)
+            case = self._cases.get(int(caseid))
+            if case is None:
+                continue
+            found = case.keys.get_indexer(keys[rows])
+            values[rows[found >= 0]] = case.texts()[found[found >= 0]]
+        return target.drop(columns=PART_COLUMN).assign(**{TEXT_COLUMN: values})
+
+    def subset(self, caseids: Iterable[int]) -> 'DocketText':
+        """
+        A store holding only the given cases, still compressed, e.g. to hand a batch of cases to a worker process
+        """
+        store = DocketText(self.level)
+        store._cases = {int(caseid): self._cases[int(caseid)] for caseid in caseids if int(caseid) in self._cases}
+        return store
+
+    def texts(self, caseid: int) -> List[Optional[str]]:
+        """
+        The lowercased text of every row of a case, in the order the rows were stored
+        """
+        case = self._cases.get(int(caseid))
+        return [] if case is None else case.texts().tolist()
+
+    def __len__(self) -> int:
+        return len(self._cases)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(case.blob) + case.offsets.nbytes + case.keys.nbytes for case in self._cases.values())
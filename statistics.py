@@ -1,25 +1,32 @@
 import pandas as pd
 import numpy as np
-import dill
 import openpyxl
 
-with open('data_files/case_metrics.pkl', 'rb') as f:
-    df = dill.load(f)
+from services.dataset_services import read_dataset
+from services.stage_cache_services import StageCache
 
-df = df.drop(['dispositive_deadline', 'limine_deadline', 'fptcnf_date', 'trial_date'], axis=1)
-closed = df.loc[df["Total Time Elapsed"].notnull()]
-closed_no_ltp = closed.loc[closed["ltp_date"].isnull()]
-closed_aggregate = closed[['Case Number', 'Judge', 'Group', 'CMP To UA Elapsed', 'UA To LTP Elapsed',
-                            'CMP To LTP Elapsed', 'LTP to PPTCNF Elapsed', 'Discovery Elapsed',
-                            'SJ to Disposition Elapsed', 'LTP to Termination Elapsed', 'Total Time Elapsed']]
-pending = df.loc[df["Total Time Elapsed"].isnull()]
-pending_aggregate = pending[['Case Number', 'Judge', 'Group', 'CMP To UA Elapsed', 'UA To LTP Elapsed',
-                             'CMP To LTP Elapsed', 'LTP to PPTCNF Elapsed', 'Discovery Elapsed',
-                             'SJ to Disposition Elapsed', 'LTP to Termination Elapsed', 'Total Time Elapsed']]
 
+def split_case_metrics():
+    df = read_dataset('data_files/case_metrics',
+                      exclude=['dispositive_deadline', 'limine_deadline', 'fptcnf_date', 'trial_date'])
+    closed = df.loc[df["Total Time Elapsed"].notnull()]
+    closed_no_ltp = closed.loc[closed["ltp_date"].isnull()]
+    closed_aggregate = closed[['Case Number', 'Judge', 'Group', 'CMP To UA Elapsed', 'UA To LTP Elapsed',
+                                'CMP To LTP Elapsed', 'LTP to PPTCNF Elapsed', 'Discovery Elapsed',
+                                'SJ to Disposition Elapsed', 'LTP to Termination Elapsed', 'Total Time Elapsed']]
+    pending = df.loc[df["Total Time Elapsed"].isnull()]
+    pending_aggregate = pending[['Case Number', 'Judge', 'Group', 'CMP To UA Elapsed', 'UA To LTP Elapsed',
+                                 'CMP To LTP Elapsed', 'LTP to PPTCNF Elapsed', 'Discovery Elapsed',
+                                 'SJ to Disposition Elapsed', 'LTP to Termination Elapsed', 'Total Time Elapsed']]
+    return {'closed': closed, 'closed_aggregate': closed_aggregate, 'pending': pending,
+            'pending_aggregate': pending_aggregate}
+
+
+# the sheets below can be reworked without reading and splitting the case metrics again
+outputs = StageCache().run('statistics', split_case_metrics, inputs=['data_files/case_metrics'])
 
 with pd.ExcelWriter('data_files/case_metrics.xlsx') as writer:
-    closed.to_excel(writer, sheet_name='Closed Cases Raw')
-    closed_aggregate.to_excel(writer, sheet_name='Closed Cases Aggregate')
-    pending.to_excel(writer, sheet_name='Pending Cases Raw')
-    pending_aggregate.to_excel(writer, sheet_name='Pending Cases Aggregate')
+    outputs['closed'].to_excel(writer, sheet_name='Closed Cases Raw')
+    outputs['closed_aggregate'].to_excel(writer, sheet_name='Closed Cases Aggregate')
+    outputs['pending'].to_excel(writer, sheet_name='Pending Cases Raw')
+    outputs['pending_aggregate'].to_excel(writer, sheet_name='Pending Cases Aggregate')
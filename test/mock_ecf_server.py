@@ -0,0 +1,342 @@
+"""
+Local stand-in for the ECF API so that the fetch layer can be tested and benchmarked without the court's server. It
+serves the token endpoint, docket entries (single case, multi-case, by type, by subtype and by date), case deadlines
+and civil cases. Responses are built from recorded fixtures when a fixture directory is given and generated otherwise.
+Generated data is deterministic per case ID so that repeated runs see the same dockets.
+
+Latency, error rate and payload size are configurable through MockEcfSettings. Every response carries an ETag and
+If-None-Match is answered with 304, so the response cache can be exercised as well.
+
+Usage:
+python -m test.mock_ecf_server --port 8080 --latency 0.05 --error-rate 0.01 --entries 200
+
+and point BASE_API_URL and API_TOKEN_URL at it, or call configure(base_url) from Python.
+
+"""
+import argparse
+import asyncio
+import datetime
+import hashlib
+import json
+import random
+import secrets
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from aiohttp import web
+
+from configuration.config import Config
+
+TOKEN_PATH = '/token'
+ENDPOINTS = {'docket_entries_multi_case_endpoint': '/cases/entries/multiple',
+             'docket_entries_by_case_and_type': '/cases/entries/type',
+             'docket_entries_by_case_and_typeSub': '/cases/entries/subtype',
+             'docket_entries_by_date_endpoint': '/cases/entries/date',
+             'civil_cases_endpoint': '/cases/civil'}
+
+# (de_type, dp_type, dp_sub_type, text) of the events the milestone code looks for
+EVENTS = [('cmp', 'cmp', 'cmp', 'COMPLAINT against defendants filed by plaintiff'),
+          ('motion', 'motion', 'ifp', 'MOTION for Leave to Proceed in forma pauperis'),
+          ('order', 'order', 'ifp', 'ORDER granting motion for leave to proceed without prepaying the filing fee'),
+          ('order', 'order', 'madv', 'ORDER directing plaintiff to pay an initial partial filing fee'),
+          ('motion', 'motion', 'pwrithc', 'PETITION for Writ of Habeas Corpus'),
+          ('motion', 'motion', '2255', 'MOTION to Vacate, Set Aside or Correct Sentence (2255)'),
+          ('notice', 'notice', 'ntcrem', 'NOTICE OF REMOVAL from state court'),
+          ('motion', 'motion', 'emerinj', 'MOTION for Emergency Injunction'),
+          ('order', 'order', 'ptcnf', 'PRETRIAL CONFERENCE ORDER'),
+          ('order', 'order', 'order', 'ORDER screening complaint'),
+          ('judgment', 'judgment', 'jgm', 'JUDGMENT in favor of defendants'),
+          ('notice', 'notice', 'ntcapp', 'NOTICE OF APPEAL')]
+FILLER = 'Text only docket entry regarding scheduling of the case and service on the parties. '
+
+
+@dataclass
+class MockEcfSettings:
+    """
+    :param latency: seconds added to every response
+    :param latency_per_row: seconds added per row returned, so large dockets are slower to build
+    :param jitter: fraction of the latency added or removed at random
+    :param error_rate: fraction of requests answered with one of error_statuses
+    :param error_statuses: statuses used for injected errors
+    :param retry_after: Retry-After seconds sent with injected 429 and 503 responses, none when None
+    :param entries: average number of docket entries per case
+    :param deadlines: average number of deadlines per case
+    :param text_size: approximate length of dt_text in characters
+    :param cases: number of civil cases returned by the civil cases endpoint
+    :param require_auth: reject requests without a token issued by the token endpoint
+    :param token_ttl: expires_in sent with new tokens
+    :param fixtures: directory of recorded responses, e.g. entries/41091.json and deadlines/41091.json
+    :param seed: seed for the generated data and injected errors
+    """
+    latency: float = 0.0
+    latency_per_row: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    error_statuses: Tuple[int, ...] = (503,)
+    retry_after: Optional[float] = None
+    entries: int = 60
+    deadlines: int = 6
+    text_size: int = 200
+    cases: int = 500
+    require_auth: bool = True
+    token_ttl: int = 3600
+    fixtures: Optional[str] = None
+    seed: int = 0
+    first_caseid: int = 41000
+
+
+@dataclass
+class MockEcfStats:
+    requests: Dict[str, int] = field(default_factory=dict)
+    errors: int = 0
+    not_modified: int = 0
+    tokens: int = 0
+
+
+def configure(base_url: str):
+    """
+    Points Config at a running mock server
+
+    :param base_url: URL the server listens on, e.g. http://127.0.0.1:8080
+    """
+    base_url = base_url.rstrip('/')
+    Config.base_api_url = base_url
+    Config.token_url = f'{base_url}{TOKEN_PATH}'
+    for name, path in ENDPOINTS.items():
+        setattr(Config, name, path)
+
+
+def _date(rng: random.Random, start: datetime.date, days: int) -> str:
+    return (start + datetime.timedelta(days=rng.randrange(days))).strftime('%Y-%m-%d')
+
+
+def generate_entries(caseid: int, settings: MockEcfSettings) -> List[Dict]:
+    rng = random.Random(caseid * 7919 + settings.seed)
+    count = max(1, int(rng.gauss(settings.entries, settings.entries / 3)))
+    filed = datetime.date(2018, 1, 1) + datetime.timedelta(days=caseid % 1500)
+    entries = []
+    for seqno in range(1, count + 1):
+        de_type, dp_type, sub_type, text = EVENTS[0] if seqno == 1 else rng.choice(EVENTS)
+        date = (filed + datetime.timedelta(days=seqno * 3)).strftime('%Y-%m-%d')
+        text = (text + '. ' + FILLER * (settings.text_size // len(FILLER) + 1))[:max(settings.text_size, len(text))]
+        entries.append({'de_caseid': caseid, 'de_seqno': seqno, 'dp_seqno': seqno,
+                        'dp_dpseqno_ptr': rng.randrange(1, seqno) if seqno > 1 and rng.random() < 0.3 else None,
+                        'dp_partno': 1, 'de_type': f'{de_type:<8}', 'dp_type': f'{dp_type:<8}',
+                        'dp_sub_type': f'{sub_type:<8}', 'de_document_num': seqno, 'de_date_filed': date,
+                        'de_date_enter': date, 'de_who_entered': 'mck', 'initials': 'mk', 'name': 'Mock Clerk',
+                        'pr_type': 'pty', 'pr_crttype': 'pla', 'dp_dispositive': 'n', 'dt_text': text})
+    return entries
+
+
+def generate_deadlines(caseid: int, settings: MockEcfSettings) -> List[Dict]:
+    rng = random.Random(caseid * 104729 + settings.seed)
+    start = datetime.date(2018, 1, 1) + datetime.timedelta(days=caseid % 1500)
+    deadlines = []
+    for seqno in range(1, max(1, int(rng.gauss(settings.deadlines, settings.deadlines / 3))) + 1):
+        sd_class = 'hrg' if rng.random() < 0.3 else 'ddl'
+        deadlines.append({'sd_caseid': caseid, 'sd_seqno': seqno, 'sd_class': f'{sd_class:<4}',
+                          'sd_type': f'{rng.choice(["ptc", "sch", "ans", "dis"]):<8}',
+                          'sd_dtset': _date(rng, start, 900),
+                          'sd_dtsatis': _date(rng, start, 900) if rng.random() < 0.7 else None,
+                          'de_seqno': rng.randrange(1, 40)})
+    return deadlines
+
+
+def generate_civil_cases(settings: MockEcfSettings, start_date: str, end_date: str) -> List[Dict]:
+    rng = random.Random(settings.seed)
+    cases = []
+    for caseid in range(settings.first_caseid, settings.first_caseid + settings.cases):
+        filed = datetime.date(2018, 1, 1) + datetime.timedelta(days=caseid % 1500)
+        if not start_date <= filed.strftime('%Y-%m-%d') <= end_date:
+            continue
+        terminated = filed + datetime.timedelta(days=rng.randrange(30, 900))
+        cases.append({'cs_caseid': caseid, 'cs_case_number': f'3:{filed:%y}-cv-{caseid % 1000:05d}',
+                      'cs_judge': rng.choice(['jdp', 'wmc', 'slc', 'bbc']),
+                      'cs_date_filed': filed.strftime('%Y-%m-%d'), 'cs_date_reopen': None,
+                      'cs_date_term': terminated.strftime('%Y-%m-%d'),
+                      'j5_nature_of_suit': rng.choice(['550', '555', '530', '440']),
+                      'cs_cause': '42:1983', 'j5_diversity_plaintiff': None, 'j5_diversity_defendant': None,
+                      'is_prose': 'y' if rng.random() < 0.6 else 'n'})
+    return cases
+
+
+def create_app(settings: Optional[MockEcfSettings] = None) -> web.Application:
+    """
+    Builds the mock API application. Request counts are kept in app['stats'].
+
+    :param settings: latency, error and payload settings
+    """
+    settings = settings or MockEcfSettings()
+    rng = random.Random(settings.seed)
+    tokens = set()
+    stats = MockEcfStats()
+    fixtures = Path(settings.fixtures) if settings.fixtures else None
+
+    def _fixture(kind: str, caseid: int) -> Optional[List[Dict]]:
+        if fixtures is None:
+            return None
+        try:
+            with open(fixtures / kind / f'{caseid}.json') as f:
+                return json.load(f)['data']
+        except FileNotFoundError:
+            return None
+
+    def _entries(caseid: int) -> List[Dict]:
+        return _fixture('entries', caseid) or generate_entries(caseid, settings)
+
+    def _deadlines(caseid: int) -> List[Dict]:
+        return _fixture('deadlines', caseid) or generate_deadlines(caseid, settings)
+
+    async def _respond(request: web.Request, name: str, rows: List[Dict]) -> web.Response:
+        stats.requests[name] = stats.requests.get(name, 0) + 1
+        delay = settings.latency + settings.latency_per_row * len(rows)
+        delay *= 1 + rng.uniform(-settings.jitter, settings.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if settings.require_auth:
+            token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+            if token not in tokens:
+                raise web.HTTPUnauthorized()
+        if rng.random() < settings.error_rate:
+            stats.errors += 1
+            status = rng.choice(settings.error_statuses)
+            headers = {'Retry-After': str(settings.retry_after)} \
+                if settings.retry_after is not None and status in (429, 503) else None
+            return web.Response(status=status, headers=headers)
+        body = json.dumps({'data': rows, 'count': len(rows)}).encode()
+        etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+        if request.headers.get('If-None-Match') == etag:
+            stats.not_modified += 1
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(body=body, content_type='application/json', headers={'ETag': etag})
+
+    async def _case_ids(request: web.Request) -> Tuple[List[int], Dict]:
+        query = await request.json()
+        return [int(caseid) for caseid in query.get('case_ids', [])], query
+
+    async def token(request: web.Request) -> web.Response:
+        await request.post()
+        stats.tokens += 1
+        access_token = secrets.token_hex(16)
+        tokens.add(access_token)
+        return web.json_response({'access_token': access_token, 'token_type': 'bearer',
+                                  'expires_in': settings.token_ttl})
+
+    async def entries(request: web.Request) -> web.Response:
+        return await _respond(request, 'entries', _entries(int(request.match_info['caseid'])))
+
+    async def deadlines(request: web.Request) -> web.Response:
+        rows = _deadlines(int(request.match_info['caseid']))
+        deadline_class = request.query.get('deadline_class')
+        if deadline_class:
+            rows = [row for row in rows if row['sd_class'].strip() == deadline_class]
+        return await _respond(request, 'deadlines', rows)
+
+    async def entries_multiple(request: web.Request) -> web.Response:
+        caseids, _ = await _case_ids(request)
+        return await _respond(request, 'entries_multiple', [row for caseid in caseids for row in _entries(caseid)])
+
+    async def entries_by_type(request: web.Request) -> web.Response:
+        caseids, query = await _case_ids(request)
+        overall_type = query.get('overall_type')
+        rows = [row for caseid in caseids for row in _entries(caseid) if row['dp_type'].strip() == overall_type]
+        return await _respond(request, 'entries_by_type', rows)
+
+    async def entries_by_subtype(request: web.Request) -> web.Response:
+        caseids, query = await _case_ids(request)
+        # subtype is a list of [type, subtype] pairs, see services.case_services.create_event
+        subtypes = {tuple(pair) for pair in query.get('subtype') or []}
+        rows = [row for caseid in caseids for row in _entries(caseid)
+                if (row['dp_type'].strip(), row['dp_sub_type'].strip()) in subtypes]
+        return await _respond(request, 'entries_by_subtype', rows)
+
+    async def entries_by_date(request: web.Request) -> web.Response:
+        start_date, end_date = request.query.get('start_date', ''), request.query.get('end_date', '9999')
+        caseids = range(settings.first_caseid, settings.first_caseid + settings.cases)
+        rows = [row for caseid in caseids for row in _entries(caseid)
+                if start_date <= row['de_date_enter'] <= end_date]
+        return await _respond(request, 'entries_by_date', rows)
+
+    async def civil_cases(request: web.Request) -> web.Response:
+        rows = generate_civil_cases(settings, request.query.get('start_date', ''),
+                                    request.query.get('end_date', '9999'))
+        return await _respond(request, 'civil_cases', rows)
+
+    app = web.Application()
+    app['settings'] = settings
+    app['stats'] = stats
+    app.router.add_post(TOKEN_PATH, token)
+    # literal routes first so that they are not taken for a case ID
+    app.router.add_post(ENDPOINTS['docket_entries_multi_case_endpoint'], entries_multiple)
+    app.router.add_post(ENDPOINTS['docket_entries_by_case_and_type'], entries_by_type)
+    app.router.add_post(ENDPOINTS['docket_entries_by_case_and_typeSub'], entries_by_subtype)
+    app.router.add_get(ENDPOINTS['docket_entries_by_date_endpoint'], entries_by_date)
+    app.router.add_get(ENDPOINTS['civil_cases_endpoint'], civil_cases)
+    app.router.add_get(r'/cases/entries/{caseid:\d+}', entries)
+    app.router.add_get(r'/cases/deadlines/{caseid:\d+}', deadlines)
+    return app
+
+
+@contextmanager
+def running_server(settings: Optional[MockEcfSettings] = None) -> Iterator[Tuple[str, web.Application]]:
+    """
+    Serves the mock API from a background thread with its own event loop, so that sync clients and asyncio.run can be
+    used against it from the calling thread
+
+    Usage:
+    with running_server(MockEcfSettings(latency=0.01)) as (base_url, app):
+        configure(base_url)
+        ...
+
+    :return: base URL of the server and the application, whose app['stats'] counts requests
+    """
+    app = create_app(settings)
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{port}', app
+    finally:
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+def run_server(settings: MockEcfSettings, host: str = '127.0.0.1', port: int = 8080):
+    """
+    Serves the mock API until interrupted. Also used as the target of the benchmark's server process.
+    """
+    web.run_app(create_app(settings), host=host, port=port, print=None)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a local stand-in for the ECF API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--latency-per-row', type=float, default=0.0, help='seconds added per row returned')
+    parser.add_argument('--jitter', type=float, default=0.0, help='fraction of the latency varied at random')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests that fail')
+    parser.add_argument('--error-status', type=int, action='append', help='status of injected errors, repeatable')
+    parser.add_argument('--retry-after', type=float, default=None, help='Retry-After sent with 429 and 503')
+    parser.add_argument('--entries', type=int, default=60, help='average docket entries per case')
+    parser.add_argument('--text-size', type=int, default=200, help='approximate length of the docket text')
+    parser.add_argument('--cases', type=int, default=500, help='cases returned by the civil cases endpoint')
+    parser.add_argument('--fixtures', default=None, help='directory of recorded responses')
+    parser.add_argument('--no-auth', action='store_true', help='accept requests without a token')
+    args = parser.parse_args()
+    settings = MockEcfSettings(latency=args.latency, latency_per_row=args.latency_per_row, jitter=args.jitter,
+                               error_rate=args.error_rate, error_statuses=tuple(args.error_status or (503,)),
+                               retry_after=args.retry_after, entries=args.entries, text_size=args.text_size,
+                               cases=args.cases, fixtures=args.fixtures, require_auth=not args.no_auth)
+    print(f'Serving mock ECF API on http://{args.host}:{args.port}', flush=True)
+    run_server(settings, args.host, args.port)
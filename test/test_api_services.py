@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from configuration.config import Config
+from services.api_services import ApiSession, get_data
+from services.fetch_services import FetchRequest, fetch_all
+from test.mock_ecf_server import ENDPOINTS, MockEcfSettings, configure, running_server
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    for name in ['base_api_url', 'token_url', *ENDPOINTS]:
+        monkeypatch.setattr(Config, name, getattr(Config, name))
+    monkeypatch.setattr(Config, 'token_cache_path', str(tmp_path / 'token.json'))
+    monkeypatch.setattr(ApiSession, '_instance', None)
+    with running_server(MockEcfSettings(entries=10, cases=20)) as (base_url, app):
+        configure(base_url)
+        api = ApiSession.instance()
+        yield api, app['stats']
+        api.close()
+
+
+def test_sync_requests_share_one_client_and_one_login(api):
+    api, stats = api
+    url = f'{Config.base_api_url}{Config.civil_cases_endpoint}'
+
+    cases = api.get(url, {'start_date': '2018-01-01', 'end_date': '2023-12-31'})
+    client = api.client
+    entries = api.post(f'{Config.base_api_url}{Config.docket_entries_multi_case_endpoint}',
+                       payload={'case_ids': cases['cs_caseid'].head(3).tolist()})
+
+    assert api.client is client
+    assert stats.tokens == 1
+    assert sorted(entries['de_caseid'].unique()) == cases['cs_caseid'].head(3).tolist()
+
+
+def test_async_callers_share_the_session_of_their_event_loop(api):
+    api, stats = api
+
+    async def _main():
+        async with api.session() as session:
+            async with api.session() as nested:
+                assert nested is session
+            requests = [FetchRequest(caseid, f'{Config.base_api_url}/cases/entries/{caseid}')
+                        for caseid in (41000, 41001)]
+            results = await fetch_all(session, requests, auth=api.tokens)
+        assert session.closed
+        return results
+
+    first = asyncio.run(_main())
+    second = asyncio.run(_main())
+
+    assert all(result.ok for result in first + second)
+    assert stats.tokens == 1
+
+
+def test_sync_wrappers_work_inside_a_running_event_loop(api):
+    api, stats = api
+    url = f'{Config.base_api_url}{Config.docket_entries_by_case_and_type}'
+    caseids = list(range(41000, 41004))
+
+    async def _notebook_cell():
+        return get_data(caseids, None, url, {}, None, 'motion', chunk_size=2, auth=api.tokens)
+
+    expected = get_data(caseids, None, url, {}, None, 'motion', chunk_size=2, auth=api.tokens)
+    df = asyncio.run(_notebook_cell())
+
+    assert not df.empty and df.equals(expected)
+    assert stats.tokens == 1
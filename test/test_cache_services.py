@@ -0,0 +1,102 @@
+import asyncio
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from services.cache_services import ResponseCache
+from services.concurrency_services import AdaptiveLimiter
+from services.fetch_services import FetchRequest, fetch_all
+
+
+def _create_app():
+    calls = {'full': 0, 'not_modified': 0}
+
+    async def entries(request):
+        if request.headers.get('If-None-Match') == '"v1"':
+            calls['not_modified'] += 1
+            return web.Response(status=304)
+        calls['full'] += 1
+        caseid = int(request.match_info['caseid'])
+        return web.json_response({'data': [{'de_caseid': caseid, 'de_seqno': 1}]}, headers={'ETag': '"v1"'})
+
+    app = web.Application()
+    app.router.add_get('/cases/entries/{caseid}', entries)
+    return app, calls
+
+
+def _run_twice(app, caseids, cache_factory):
+    """Fetches the same cases in two runs, each with a fresh ResponseCache over the same directory"""
+    async def _main():
+        async with TestServer(app) as server:
+            runs = []
+            for _ in range(2):
+                async with aiohttp.ClientSession() as session:
+                    requests = [FetchRequest(caseid, str(server.make_url(f'/cases/entries/{caseid}')))
+                                for caseid in caseids]
+                    runs.append(await fetch_all(session, requests, headers={'Authorization': 'Bearer test'},
+                                                cache=cache_factory()))
+            return runs[-1]
+
+    return asyncio.run(_main())
+
+
+def test_fresh_responses_are_served_from_disk(tmp_path):
+    app, calls = _create_app()
+
+    results = _run_twice(app, [1, 2], lambda: ResponseCache(str(tmp_path), ttl=3600))
+
+    assert calls == {'full': 2, 'not_modified': 0}
+    assert [result.data['de_caseid'].tolist() for result in results] == [[1], [2]]
+
+
+def test_stale_responses_are_revalidated(tmp_path):
+    app, calls = _create_app()
+
+    result, = _run_twice(app, [1], lambda: ResponseCache(str(tmp_path), ttl=0))
+
+    assert calls == {'full': 1, 'not_modified': 1}
+    assert result.data['de_caseid'].tolist() == [1]
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResponseCache(str(tmp_path), ttl=3600, max_bytes=10 ** 6)
+    keys = [cache.key('GET', f'/cases/entries/{caseid}') for caseid in range(3)]
+    for caseid, key in enumerate(keys):
+        cache.put(key, bytes([caseid]) * 1000)
+    cache.lookup(keys[0])
+
+    cache.evict(max_bytes=cache.size() - 1)
+
+    assert cache.lookup(keys[0]) is not None
+    assert cache.lookup(keys[1]) is None
+    assert cache.lookup(keys[2]) is not None
+
+
+def test_cache_hits_do_not_collapse_the_limit(tmp_path):
+    async def entries(request):
+        # a network response takes far longer than reading one from disk
+        await asyncio.sleep(0.02)
+        caseid = int(request.match_info['caseid'])
+        return web.json_response({'data': [{'de_caseid': caseid, 'de_seqno': 1}]})
+
+    app = web.Application()
+    app.router.add_get('/cases/entries/{caseid}', entries)
+    limiter = AdaptiveLimiter(initial=4, minimum=1, maximum=8, latency_tolerance=3)
+
+    async def _main():
+        async with TestServer(app) as server, aiohttp.ClientSession() as session:
+            def requests(caseids):
+                return [FetchRequest(caseid, str(server.make_url(f'/cases/entries/{caseid}'))) for caseid in caseids]
+
+            cache = ResponseCache(str(tmp_path), ttl=3600)
+            headers = {'Authorization': 'Bearer test'}
+            await fetch_all(session, requests(range(0, 40, 2)), headers=headers, cache=cache)
+            # even cases come from disk, odd ones from the server
+            return await fetch_all(session, requests(range(40)), headers=headers, cache=cache, limiter=limiter)
+
+    results = asyncio.run(_main())
+
+    assert all(result.ok for result in results)
+    assert limiter.best_latency > 0.01
+    assert limiter.limit >= 4
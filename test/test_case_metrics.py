@@ -0,0 +1,54 @@
+import pandas as pd
+
+from case_metrics import CaseEvents, find_first_events, get_case_milestone_dates, get_docker_entries_for_case
+from services.dataframe_services import create_dataframe_docket_entries
+from services.index_services import CaseIndex
+from services.text_services import DocketText
+
+
+def _entry(caseid, seqno, sub_type, date, text, dp_type='order', partno=1):
+    return {'de_caseid': caseid, 'de_seqno': seqno, 'dp_seqno': seqno, 'dp_dpseqno_ptr': None, 'dp_partno': partno,
+            'de_type': dp_type, 'dp_type': dp_type, 'dp_sub_type': sub_type, 'de_document_num': seqno,
+            'de_date_filed': date, 'dp_dispositive': 'n', 'dt_text': text}
+
+
+def test_first_events_match_the_per_case_functions():
+    rows = [_entry(41091, 1, 'cmp', '2020-01-02', 'COMPLAINT', 'cmp'),
+            _entry(41091, 2, 'ifp', '2020-01-03', 'MOTION for Leave to Proceed in forma pauperis', 'motion'),
+            _entry(41091, 3, 'madv', '2020-01-10', 'ORDER screening complaint under advisement'),
+            _entry(41091, 4, 'jgm', '2020-03-01', 'JUDGMENT', 'judgment'),
+            _entry(41091, 4, 'jgm', '2020-03-01', 'second part', 'judgment', partno=2),
+            _entry(41091, 5, 'ropncs', '2020-06-01', 'ORDER reopening case'),
+            _entry(41091, 6, 'ptcnf', '2020-08-01', 'PRETRIAL CONFERENCE'),
+            _entry(41091, 7, 'ptcnf', '2020-07-01', 'PRETRIAL CONFERENCE'),
+            _entry(41091, 8, 'jgm', '2020-09-01', 'JUDGMENT', 'judgment'),
+            _entry(52004, 1, 'distin', '2021-02-01', 'CASE transferred in'),
+            _entry(52004, 2, 'pdpro', '2021-02-03', 'Screening', 'motion'),
+            _entry(52004, 3, 'ifp', '2021-02-04', 'MOTION for Leave to Proceed in forma pauperis', 'motion')]
+    df_entries = create_dataframe_docket_entries([pd.DataFrame(rows)])
+    docket_text = DocketText.pop(df_entries)
+    first_events = find_first_events(df_entries, docket_text)
+    entries = CaseIndex(df_entries, 'de_caseid')
+
+    for caseid in (41091, 52004):
+        legacy = get_case_milestone_dates(caseid, get_docker_entries_for_case(caseid, entries, docket_text), 'Other')
+        vectorized = get_case_milestone_dates(caseid, get_docker_entries_for_case(caseid, entries, docket_text),
+                                              'Other', first_events[caseid])
+        assert vectorized == legacy
+    assert first_events[41091]['judgment_dates'][0]['judgment_text'] == 'judgment second part'
+    assert first_events[52004]['transfer_date'] == '2021-02-01'
+
+
+def test_case_events_route_rows_like_filters():
+    target = pd.DataFrame({'dp_type': ['order', 'motion', 'order', 'motion', None],
+                           'dp_sub_type': ['madv', '2255', 'leave', 'ifp', 'madv'],
+                           'de_seqno': [1, 2, 3, 4, 5]}, index=[7, 8, 9, 10, 11])
+    events = CaseEvents(target)
+
+    pd.testing.assert_frame_equal(events.select('madv', 'ifp'), target[target['dp_sub_type'].isin(['madv', 'ifp'])])
+    pd.testing.assert_frame_equal(events.select(dp_type='order'), target[target['dp_type'] == 'order'])
+    assert events.positions('2255', 'ifp', dp_type='motion') == [1, 3]
+    assert events.positions('2255', dp_type='order') == []
+    unordered = events.take(events.positions('ifp'), events.positions('madv'), in_docket_order=False)
+    assert unordered['de_seqno'].tolist() == [4, 1, 5]
+    assert events.select('jgm').empty and CaseEvents.of(events) is events
@@ -0,0 +1,60 @@
+import asyncio
+import email.utils
+import time
+
+import aiohttp
+from multidict import CIMultiDict
+
+from services.concurrency_services import AdaptiveLimiter, retry_after
+
+
+def _error(status, headers=None):
+    return aiohttp.ClientResponseError(None, (), status=status, headers=CIMultiDict(headers or {}))
+
+
+def test_limit_grows_per_full_window_and_halves_on_overload():
+    async def _main():
+        limiter = AdaptiveLimiter(initial=4, minimum=1, maximum=8, latency_tolerance=0)
+        for _ in range(4):
+            await limiter.acquire()
+        for _ in range(4):
+            limiter.release(0.1)
+            await limiter.acquire()
+        grown = limiter.limit
+        limiter.release(0.1, error=_error(503))
+        return grown, limiter.limit
+
+    grown, cut = asyncio.run(_main())
+
+    assert 4.9 < grown < 5.1
+    assert cut == grown / 2
+
+
+def test_client_errors_do_not_move_the_limit():
+    async def _main():
+        limiter = AdaptiveLimiter(initial=4)
+        await limiter.acquire()
+        limiter.release(0.1, error=_error(404))
+        return limiter.limit
+
+    assert asyncio.run(_main()) == 4
+
+
+def test_retry_after_pauses_new_requests():
+    async def _main():
+        limiter = AdaptiveLimiter(initial=2, latency_tolerance=0)
+        await limiter.acquire()
+        limiter.release(0.01, error=_error(429, {'Retry-After': '0.2'}))
+        start = time.monotonic()
+        await limiter.acquire()
+        return time.monotonic() - start
+
+    assert asyncio.run(_main()) >= 0.15
+
+
+def test_retry_after_accepts_seconds_and_http_dates():
+    in_a_minute = email.utils.formatdate(time.time() + 60, usegmt=True)
+
+    assert retry_after(_error(503, {'Retry-After': '7'})) == 7
+    assert 55 < retry_after(_error(503, {'Retry-After': in_a_minute})) <= 60
+    assert retry_after(_error(503)) is None
@@ -0,0 +1,88 @@
+import pandas as pd
+
+from case_metrics import combine_docket_text_into_one_row
+from services.dataframe_services import combine_docket_text, create_dataframe_deadlines, \
+    create_dataframe_docket_entries, create_merged_df, create_merged_df_from_candidates, split_deadlines_and_hearings
+from services.store_services import CaseStore
+from services.sync_services import get_watermarks
+
+
+def _entries(rows):
+    columns = ['de_caseid', 'de_seqno', 'dp_seqno', 'de_document_num', 'dp_type', 'dp_sub_type', 'de_date_filed',
+               'de_date_enter', 'de_who_entered', 'initials', 'name', 'pr_type', 'pr_crttype']
+    return pd.DataFrame([[caseid, seqno, seqno, seqno, 'motion', sub_type, '2021-01-02', '2021-01-02', 'abc', 'ab',
+                          'Name', 'pty', 'pla'] for caseid, seqno, sub_type in rows], columns=columns)
+
+
+def test_merge_from_candidates_matches_sequential_merges():
+    pro_se = pd.DataFrame({'Case ID': [1, 2, 3, 4], 'Cause of Action': 'c', 'Diversity Defendant': None,
+                           'Diversity Plaintiff': None, 'IsProse': 'y'})
+    candidates = [_entries([(3, 5, 'cmp'), (3, 2, 'cmp'), (9, 1, 'cmp')]),
+                  _entries([(1, 4, 'pwrithc'), (3, 7, 'pwrithc')]),
+                  _entries([(4, 1, '2255'), (1, 1, '2255')])]
+
+    sequential = pd.concat([create_merged_df(pro_se, candidate) for candidate in candidates], ignore_index=True)
+    sequential = sequential.drop_duplicates(subset=['Case ID'], keep='first').reset_index(drop=True)
+    merged = create_merged_df_from_candidates(pro_se, candidates).reset_index(drop=True)
+
+    pd.testing.assert_frame_equal(merged, sequential)
+    assert merged['Case ID'].tolist() == [3, 1, 4]
+    assert merged['DE SeqNum'].tolist() == [5, 4, 1]
+
+
+def test_docket_entries_use_shared_codes_and_small_integers():
+    entries = _entries([(41091, 1, 'cmp   '), (41091, 2, 'jgm   '), (52004, 1, 'cmp   ')])
+    entries['de_type'] = 'motion  '
+    entries['de_document_num'] = [1, None, 1]
+
+    df = create_dataframe_docket_entries([entries])
+
+    assert df['dp_sub_type'].cat.categories.tolist() == ['cmp', 'jgm', 'motion']
+    assert df['de_type'].dtype == df['dp_type'].dtype == df['dp_sub_type'].dtype
+    assert (df['dp_sub_type'] == 'jgm').tolist() == [False, True, False]
+    assert (df['de_type'] == df['dp_type']).all()
+    assert df['de_caseid'].dtype == 'int32' and df['de_seqno'].dtype == 'int8'
+    assert df['de_document_num'].dtype == 'float32'
+
+
+def test_combined_docket_text_matches_the_per_case_combine():
+    entries = pd.DataFrame({'de_caseid': [41091, 41091, 52004, 41091, 52004, 41091],
+                            'de_seqno': [1, 2, 2, 2, 1, 3],
+                            'dt_text': ['complaint', 'order', 'motion', 'part two', 'judgment', 'order']})
+
+    combined = combine_docket_text(entries)
+
+    assert combined['dt_text'].tolist() == ['complaint', 'order part two', 'motion', 'judgment', 'order']
+    for caseid in (41091, 52004):
+        per_case = combine_docket_text_into_one_row(entries.loc[entries['de_caseid'] == caseid].copy())
+        pd.testing.assert_frame_equal(combined.loc[combined['de_caseid'] == caseid].reset_index(drop=True), per_case)
+    assert combine_docket_text(combined) is combined
+
+
+def test_deadlines_without_a_class_hold_no_hearings():
+    df_deadlines = pd.DataFrame({'sd_caseid': [1, 1], 'sd_type': ['ptcnf', 'disp']})
+
+    deadlines, hearings = split_deadlines_and_hearings(df_deadlines)
+
+    assert deadlines.shape[0] == 2
+    assert hearings.empty and hearings.columns.tolist() == ['sd_caseid', 'sd_type']
+
+
+def test_empty_stores_load_as_empty_frames(tmp_path):
+    store = CaseStore(str(tmp_path / 'entries'))
+
+    for frames in ([], store.iter_frames(), [store.read()]):
+        df_entries = create_dataframe_docket_entries(frames)
+        assert df_entries.empty and {'de_caseid', 'dp_sub_type', 'dt_text'} <= set(df_entries.columns)
+    assert create_dataframe_deadlines([]).columns.tolist()[:2] == ['sd_caseid', 'sd_seqno']
+
+
+def test_watermark_is_taken_from_the_cases_of_the_run(tmp_path):
+    store = CaseStore(str(tmp_path / 'entries'))
+    store.put(1, pd.DataFrame({'de_caseid': [1], 'de_seqno': [1], 'de_date_enter': ['2023-01-05']}))
+    store.put(2, pd.DataFrame({'de_caseid': [2], 'de_seqno': [1], 'de_date_enter': ['2023-03-05']}))
+
+    assert {caseid: str(mark) for caseid, mark in get_watermarks(store, [1]).items()} == {1: '2023-01-05'}
+    store.save_state({'watermark': '2023-02-01', 'watermarks': {'2': '2023-03-05'}})
+    assert {caseid: str(mark) for caseid, mark in get_watermarks(store, [1, 2]).items()} == \
+        {1: '2023-02-01', 2: '2023-03-05'}
@@ -0,0 +1,62 @@
+import datetime
+import pickle
+
+import pandas as pd
+
+from services.dataset_services import FILING_YEAR, read_dataset, write_dataset
+from services.store_services import CaseStore
+
+
+def test_datasets_round_trip_nested_columns_and_read_only_requested_cases(tmp_path):
+    df = pd.DataFrame([{'caseid': 41091, 'complaint_date': datetime.datetime(2020, 1, 6),
+                        'ua_dates': [{'ua_date': '2020-02-01', 'ua_text': 'order screening complaint'}]},
+                       {'caseid': 52004, 'complaint_date': datetime.datetime(2021, 3, 2), 'ua_dates': []}])
+
+    write_dataset(df, str(tmp_path / 'ua_dates'), case_column='caseid')
+    result = read_dataset(str(tmp_path / 'ua_dates'), columns=['caseid', 'ua_dates'], caseids=[41091])
+
+    assert sorted(path.name for path in (tmp_path / 'ua_dates').iterdir()) == ['case_bucket=41', 'case_bucket=52']
+    assert result.to_dict('records') == [{'caseid': 41091, 'ua_dates': df['ua_dates'].iloc[0]}]
+
+
+def test_datasets_can_be_partitioned_by_filing_year(tmp_path):
+    df = pd.DataFrame({'Case ID': [41091, 52004], 'Date Filed': pd.to_datetime(['2020-01-06', '2021-03-02']),
+                       'Total Time Elapsed': [120.0, None]})
+
+    write_dataset(df, str(tmp_path / 'case_metrics'), partition_by=FILING_YEAR, case_column='Case ID',
+                  date_column='Date Filed')
+    result = read_dataset(str(tmp_path / 'case_metrics'), exclude=['Total Time Elapsed'], filters={FILING_YEAR: 2021})
+
+    assert result.to_dict('records') == [{'Case ID': 52004, 'Date Filed': pd.Timestamp('2021-03-02')}]
+
+
+def test_store_reads_parquet_and_pickled_cases_as_one_frame(tmp_path):
+    store = CaseStore(str(tmp_path))
+    store.put(1, pd.DataFrame({'de_caseid': [1, 1], 'de_seqno': [1, 2], 'dp_dpseqno_ptr': [None, None],
+                               'dt_text': ['complaint', 'order']}))
+    store.put(2, pd.DataFrame({'de_caseid': [2], 'de_seqno': [1], 'dp_dpseqno_ptr': [1.0], 'dt_text': ['motion']}))
+    with open(tmp_path / '3.pkl', 'wb') as f:
+        pickle.dump(pd.DataFrame({'de_caseid': [3], 'de_seqno': [1], 'dp_dpseqno_ptr': [2.0], 'dt_text': ['cmp']}), f)
+
+    df = store.read(exclude=['dt_text'], caseids=[1, 2, 3, 4])
+
+    assert store.caseids() == [1, 2, 3]
+    assert df['de_caseid'].tolist() == [1, 1, 2, 3]
+    assert list(df.columns) == ['de_caseid', 'de_seqno', 'dp_dpseqno_ptr']
+    assert df['dp_dpseqno_ptr'].tolist()[2:] == [1.0, 2.0]
+
+
+def test_compacted_cases_are_read_back_and_newer_case_files_take_precedence(tmp_path):
+    store = CaseStore(str(tmp_path))
+    for caseid in (41091, 52004):
+        store.put(caseid, pd.DataFrame({'de_caseid': [caseid], 'de_seqno': [1], 'dt_text': ['complaint']}))
+
+    assert store.compact() == 2
+    store.put(41091, pd.DataFrame({'de_caseid': [41091, 41091], 'de_seqno': [1, 2], 'dt_text': ['complaint', 'order']}))
+
+    assert [path.name for path in tmp_path.glob('*.parquet')] == ['41091.parquet']
+    assert store.caseids() == [41091, 52004]
+    assert store.get(52004)['dt_text'].tolist() == ['complaint']
+    assert store.read(columns=['de_caseid', 'de_seqno'])['de_seqno'].tolist() == [1, 1, 2]
+    assert store.read(caseids=[41091])['dt_text'].tolist() == ['complaint', 'order']
+    assert sorted(len(df) for df in store.iter_frames()) == [1, 2]
@@ -0,0 +1,33 @@
+import pandas as pd
+from sqlalchemy import create_engine
+
+from models.docket import DocketDeadline, DocketEntry
+from services.docket_db_services import DocketDatabase
+from services.store_services import CaseStore
+from test.mock_ecf_server import MockEcfSettings, generate_deadlines, generate_entries
+
+
+def test_loaded_cases_are_queried_by_case_and_by_subtype(tmp_path):
+    settings = MockEcfSettings(entries=20)
+    store = CaseStore(str(tmp_path / 'entries'))
+    for caseid in (41091, 41092, 52004):
+        store.put(caseid, pd.DataFrame(generate_entries(caseid, settings)))
+    db = DocketDatabase(create_engine(f'sqlite:///{tmp_path / "dockets.db"}', future=True))
+
+    db.load(DocketEntry, store)
+    # reloading a case replaces its rows
+    db.load_frame(DocketEntry, pd.DataFrame(generate_entries(41092, settings)))
+    db.load_frame(DocketDeadline, pd.DataFrame(generate_deadlines(41091, settings)))
+
+    expected = store.get(41091)
+    events = db.case_events(41091)
+    assert db.caseids() == [41091, 41092, 52004]
+    assert events['de_seqno'].tolist() == expected['de_seqno'].tolist()
+    assert events['dp_sub_type'].tolist() == expected['dp_sub_type'].str.strip().tolist()
+    assert events['de_date_filed'].tolist() == expected['de_date_filed'].tolist()
+    assert events['dt_text'].tolist() == expected['dt_text'].tolist()
+
+    complaints = db.cases_with_subtype('cmp', columns=['de_caseid', 'de_seqno'])
+    assert complaints.groupby('de_caseid')['de_seqno'].first().to_dict() == {41091: 1, 41092: 1, 52004: 1}
+    assert len(db.case_events(41092)) == len(store.get(41092))
+    assert db.case_deadlines(41091)['sd_caseid'].unique().tolist() == [41091]
@@ -0,0 +1,305 @@
+import asyncio
+import time
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from configuration.config import Config
+from services import api_connection
+from services.api_connection import TokenManager
+from services.cache_services import ResponseCache
+from services.checkpoint_services import Checkpoint
+from services.fetch_services import FetchRequest, fetch_all, fetch_batched, fetch_case_bundles, write_to_store, \
+    _is_transient
+from services.store_services import CaseStore
+from services.sync_services import sync_docket_entries
+
+
+def _create_app(failures_before_success):
+    calls = {}
+
+    async def entries(request):
+        caseid = request.match_info['caseid']
+        calls[caseid] = calls.get(caseid, 0) + 1
+        if caseid == 'missing':
+            raise web.HTTPNotFound()
+        if calls[caseid] <= failures_before_success:
+            raise web.HTTPServiceUnavailable()
+        return web.json_response({'data': [{'de_caseid': caseid, 'de_seqno': 1}]})
+
+    app = web.Application()
+    app.router.add_get('/cases/entries/{caseid}', entries)
+    return app, calls
+
+
+def _run(app, caseids, **kwargs):
+    async def _main():
+        async with TestServer(app) as server:
+            async with aiohttp.ClientSession() as session:
+                requests = [FetchRequest(caseid, str(server.make_url(f'/cases/entries/{caseid}')))
+                            for caseid in caseids]
+                headers = {} if 'auth' in kwargs else {'Authorization': 'Bearer test'}
+                return await fetch_all(session, requests, headers=headers, **kwargs)
+
+    return asyncio.run(_main())
+
+
+def test_transient_errors_are_retried():
+    app, calls = _create_app(failures_before_success=2)
+    results = _run(app, ['1', '2'], concurrency=1, retries=3, backoff_base=0.01)
+    assert [result.key for result in results] == ['1', '2']
+    assert all(result.ok for result in results)
+    assert results[0].attempts == 3
+    assert results[0].data['de_caseid'].iloc[0] == '1'
+
+
+def test_failed_case_does_not_abort_run():
+    app, calls = _create_app(failures_before_success=0)
+    results = _run(app, ['1', 'missing', '2'], retries=3, backoff_base=0.01)
+    assert [result.ok for result in results] == [True, False, True]
+    # 404 is not transient so it is attempted only once
+    assert calls['missing'] == 1
+
+
+
+def test_requests_without_headers_return_data():
+    app, calls = _create_app(failures_before_success=0)
+
+    async def _main():
+        async with TestServer(app) as server, aiohttp.ClientSession() as session:
+            return await fetch_all(session, [FetchRequest('1', str(server.make_url('/cases/entries/1')))])
+
+    result, = asyncio.run(_main())
+    assert result.ok and result.data['de_caseid'].tolist() == ['1']
+
+def test_is_transient():
+    assert _is_transient(asyncio.TimeoutError())
+    assert _is_transient(aiohttp.ClientResponseError(None, (), status=429))
+    assert not _is_transient(aiohttp.ClientResponseError(None, (), status=404))
+    assert not _is_transient(KeyError('data'))
+
+
+def test_case_bundles_split_deadlines_locally(monkeypatch):
+    seen = []
+
+    async def entries(request):
+        seen.append(request.path)
+        return web.json_response({'data': [{'de_caseid': 1, 'de_seqno': 1}]})
+
+    async def deadlines(request):
+        seen.append(request.path)
+        assert dict(request.query) == {'documents': 'false', 'docket_text': 'true'}
+        return web.json_response({'data': [{'sd_caseid': 1, 'sd_class': 'hrg ', 'sd_type': 'ptcnf'},
+                                           {'sd_caseid': 1, 'sd_class': 'ddl ', 'sd_type': 'disp'}]})
+
+    app = web.Application()
+    app.router.add_get('/cases/entries/{caseid}', entries)
+    app.router.add_get('/cases/deadlines/{caseid}', deadlines)
+
+    async def _main():
+        async with TestServer(app) as server:
+            monkeypatch.setattr(Config, 'base_api_url', str(server.make_url('')).rstrip('/'))
+            async with aiohttp.ClientSession() as session:
+                return await fetch_case_bundles(session, [1], headers={'Authorization': 'Bearer test'})
+
+    bundle, = asyncio.run(_main())
+    assert bundle.ok
+    assert sorted(seen) == ['/cases/deadlines/1', '/cases/entries/1']
+    assert bundle.deadlines.shape[0] == 2
+    assert bundle.hearings['sd_type'].tolist() == ['ptcnf']
+
+
+def test_checkpoint_resumes_missing_and_failed_cases(tmp_path):
+    app, calls = _create_app(failures_before_success=0)
+    store = CaseStore(str(tmp_path / 'entries'))
+    checkpoint = Checkpoint(str(tmp_path / 'manifest.jsonl'))
+    _run(app, ['1', 'missing'], retries=0, on_result=write_to_store(store, checkpoint))
+    # a crash before case 2 was attempted; the manifest survives a reload
+    checkpoint = Checkpoint(str(tmp_path / 'manifest.jsonl'))
+    assert checkpoint.summary() == {'completed': 1, 'failed': 1, 'timeout': 0}
+    assert checkpoint.failure_queue() == ['missing']
+    assert checkpoint.pending(['1', 'missing', '2']) == ['missing', '2']
+
+
+def test_batched_fetch_splits_chunks_per_case(monkeypatch):
+    chunks = []
+
+    async def multi(request):
+        caseids = (await request.json())['case_ids']
+        chunks.append(caseids)
+        if 13 in caseids:
+            raise web.HTTPBadRequest()
+        return web.json_response({'data': [{'de_caseid': caseid, 'de_seqno': seqno}
+                                           for caseid in caseids if caseid != 2 for seqno in (1, 2)]})
+
+    app = web.Application()
+    app.router.add_post('/cases/entries', multi)
+
+    async def _main():
+        async with TestServer(app) as server:
+            monkeypatch.setattr(Config, 'base_api_url', str(server.make_url('')).rstrip('/'))
+            monkeypatch.setattr(Config, 'docket_entries_multi_case_endpoint', '/cases/entries')
+            async with aiohttp.ClientSession() as session:
+                return await fetch_batched(session, [1, 2, 3, 13, 5], headers={}, chunk_size=4, concurrency=1)
+
+    results = asyncio.run(_main())
+    assert [result.key for result in results] == [1, 2, 3, 13, 5]
+    assert [result.ok for result in results] == [True, True, True, False, True]
+    assert results[0].data['de_seqno'].tolist() == [1, 2]
+    # a case without entries comes back empty rather than missing
+    assert results[1].data.empty
+    assert chunks[0] == [1, 2, 3, 13]
+
+
+def test_batched_chunks_are_cut_as_the_limit_lets_them_through(monkeypatch):
+    chunks = []
+
+    async def multi(request):
+        caseids = (await request.json())['case_ids']
+        chunks.append(caseids)
+        return web.json_response({'data': [{'de_caseid': caseid, 'de_seqno': 1} for caseid in caseids]})
+
+    app = web.Application()
+    app.router.add_post('/cases/entries', multi)
+
+    async def _main():
+        async with TestServer(app) as server:
+            monkeypatch.setattr(Config, 'base_api_url', str(server.make_url('')).rstrip('/'))
+            monkeypatch.setattr(Config, 'docket_entries_multi_case_endpoint', '/cases/entries')
+            async with aiohttp.ClientSession() as session:
+                return await fetch_batched(session, range(1, 41), headers={}, chunk_size=4, concurrency=1)
+
+    results = asyncio.run(_main())
+    assert all(result.ok for result in results)
+    # fast responses grow the chunks; they would all be 4 cases if the chunks were cut up front
+    assert len(chunks[0]) == 4 and len(chunks[1]) == 8
+    assert sorted(caseid for chunk in chunks for caseid in chunk) == list(range(1, 41))
+
+
+def test_batched_runs_with_a_cache_post_the_same_chunks(tmp_path, monkeypatch):
+    chunks = []
+
+    async def multi(request):
+        caseids = (await request.json())['case_ids']
+        chunks.append(caseids)
+        return web.json_response({'data': [{'de_caseid': caseid, 'de_seqno': 1} for caseid in caseids]})
+
+    app = web.Application()
+    app.router.add_post('/cases/entries', multi)
+
+    caseids = [caseid for caseid in range(1, 41) if caseid != 20]
+
+    async def _main():
+        async with TestServer(app) as server:
+            monkeypatch.setattr(Config, 'base_api_url', str(server.make_url('')).rstrip('/'))
+            monkeypatch.setattr(Config, 'docket_entries_multi_case_endpoint', '/cases/entries')
+            async with aiohttp.ClientSession() as session:
+                runs = []
+                # the third run adds a case
+                for run_caseids in (caseids, caseids[::-1], caseids + [20]):
+                    runs.append(await fetch_batched(session, run_caseids, headers={}, chunk_size=4, concurrency=2,
+                                                    cache=ResponseCache(str(tmp_path), ttl=3600)))
+                    runs.append(len(chunks))
+                return runs
+
+    first, sent, second, sent_again, _, sent_with_added = asyncio.run(_main())
+    assert all(result.ok for result in first)
+    # a repeated run is answered from the cache whatever order the cases come in
+    assert sent > 1 and sent_again == sent
+    assert [result.data['de_caseid'].tolist() for result in second] == [[caseid] for caseid in caseids[::-1]]
+    # an added case only changes the chunk it falls in
+    assert sent_with_added == sent + 1 and 20 in chunks[-1]
+
+
+def test_expired_token_is_refreshed_once_on_401(tmp_path, monkeypatch):
+    logins = []
+
+    def _request_token():
+        logins.append(1)
+        return {'access_token': f'token-{len(logins)}', 'expires_in': 3600}
+
+    monkeypatch.setattr(api_connection, '_request_token', _request_token)
+    auth = TokenManager(cache_path=str(tmp_path / 'token.json'))
+
+    async def entries(request):
+        if request.headers['Authorization'] != 'Bearer token-2':
+            raise web.HTTPUnauthorized()
+        return web.json_response({'data': [{'de_caseid': 1}]})
+
+    app = web.Application()
+    app.router.add_get('/cases/entries/{caseid}', entries)
+    results = _run(app, ['1', '2', '3'], auth=auth, retries=0)
+    assert all(result.ok for result in results)
+    assert len(logins) == 2
+    # a new manager picks the refreshed token up from disk without logging in
+    assert TokenManager(cache_path=str(tmp_path / 'token.json')).get_token() == 'token-2'
+    assert len(logins) == 2
+
+
+def test_token_refresh_does_not_block_the_event_loop(tmp_path, monkeypatch):
+    logins = []
+
+    def _request_token():
+        logins.append(1)
+        time.sleep(0.2)
+        return {'access_token': 'token', 'expires_in': 3600}
+
+    monkeypatch.setattr(api_connection, '_request_token', _request_token)
+    auth = TokenManager(cache_path=str(tmp_path / 'token.json'))
+
+    async def _main():
+        ticks = []
+
+        async def _tick():
+            for _ in range(10):
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        tokens = await asyncio.gather(*[auth.get_token_async() for _ in range(5)], _tick())
+        return tokens[:5], ticks
+
+    tokens, ticks = asyncio.run(_main())
+    assert tokens == ['token'] * 5
+    assert len(logins) == 1
+    # the loop kept running while the login was in progress
+    assert max(b - a for a, b in zip(ticks, ticks[1:])) < 0.15
+
+
+def test_cases_left_out_of_a_sync_are_caught_up(tmp_path, monkeypatch):
+    dockets = {caseid: [] for caseid in (1, 2, 3)}
+
+    def _enter(date):
+        for caseid, entries in dockets.items():
+            entries.append({'de_caseid': caseid, 'de_seqno': len(entries) + 1, 'de_date_enter': date})
+
+    async def entries(request):
+        return web.json_response({'data': dockets[int(request.match_info['caseid'])]})
+
+    async def entries_by_date(request):
+        start_date, end_date = request.query['start_date'], request.query['end_date']
+        return web.json_response({'data': [entry for docket in dockets.values() for entry in docket
+                                           if start_date <= entry['de_date_enter'] <= end_date]})
+
+    app = web.Application()
+    app.router.add_get('/cases/entries/date', entries_by_date)
+    app.router.add_get('/cases/entries/{caseid}', entries)
+    store = CaseStore(str(tmp_path / 'entries'))
+
+    async def _main():
+        async with TestServer(app) as server:
+            monkeypatch.setattr(Config, 'base_api_url', str(server.make_url('')).rstrip('/'))
+            monkeypatch.setattr(Config, 'docket_entries_by_date_endpoint', '/cases/entries/date')
+            async with aiohttp.ClientSession() as session:
+                _enter('2023-01-01')
+                await sync_docket_entries(session, [1, 2, 3], store, headers={})
+                # case 3 drops out of one run, e.g. a regenerated case list, while every docket grows
+                _enter('2023-02-01')
+                _enter('2023-02-15')
+                await sync_docket_entries(session, [1, 2], store, headers={})
+                _enter('2023-03-01')
+                await sync_docket_entries(session, [1, 2, 3], store, headers={})
+
+    asyncio.run(_main())
+    for caseid in (1, 2, 3):
+        assert store.get(caseid)['de_date_enter'].tolist() == ['2023-01-01', '2023-02-01', '2023-02-15', '2023-03-01']
@@ -0,0 +1,17 @@
+import pandas as pd
+
+from services.index_services import CaseIndex
+
+
+def test_case_slices_match_masks():
+    df = pd.DataFrame({'de_caseid': [3, 1, 3, 2, 1, 3], 'de_seqno': [1, 1, 2, 1, 2, 3]}, index=[10, 11, 12, 13, 14, 15])
+    index = CaseIndex(df, 'de_caseid')
+    for caseid in (1, 2, 3):
+        pd.testing.assert_frame_equal(index.get(caseid), df.loc[df['de_caseid'] == caseid])
+    assert index.first(3, 'de_seqno') == 1
+    assert index.get(4).empty and list(index.get(4).columns) == ['de_caseid', 'de_seqno']
+    assert 4 not in index and len(index) == 3
+
+    # slices are copies
+    index.get(1)['de_seqno'] = 0
+    assert index.get(1)['de_seqno'].tolist() == [1, 2]
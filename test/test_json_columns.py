@@ -0,0 +1,33 @@
+import json
+
+import pandas as pd
+
+from util.json_columns import decode_data
+
+
+def _records(body):
+    return pd.DataFrame(json.loads(body)['data'])
+
+
+def test_decode_data_matches_record_decode():
+    rows = [{'de_caseid': 41000, 'de_seqno': 1, 'dp_dpseqno_ptr': None, 'de_date_filed': '2021-01-02',
+             'dt_text': 'COMPLAINT', 'dp_action_type': None},
+            {'de_seqno': 2, 'de_caseid': 41000, 'dp_dpseqno_ptr': 1, 'de_date_filed': '2021-01-05',
+             'dt_text': 'ORDER granting IFP', 'dp_sub_type': 'ifp'},
+            {'de_caseid': 41000, 'de_seqno': 3, 'de_date_filed': '2021-02-01', 'dt_text': 'résumé',
+             'dp_action_type': None, 'dp_sub_type': None}]
+    body = json.dumps({'data': rows, 'count': 3}).encode()
+
+    df = decode_data(body)
+
+    pd.testing.assert_frame_equal(df, _records(body))
+    # dates stay strings for the strptime based milestone code
+    assert df['de_date_filed'].tolist() == ['2021-01-02', '2021-01-05', '2021-02-01']
+
+
+def test_decode_data_falls_back_for_mixed_and_empty_data():
+    mixed = json.dumps({'data': [{'a': 'x', 'b': [1]}, {'a': 2, 'b': None}]}).encode()
+    empty = json.dumps({'data': []}).encode()
+
+    pd.testing.assert_frame_equal(decode_data(mixed), _records(mixed))
+    pd.testing.assert_frame_equal(decode_data(empty), _records(empty))
@@ -0,0 +1,31 @@
+import pandas as pd
+from flashtext import KeywordProcessor
+
+from services.keyword_services import KeywordRule, keyword_rule
+
+
+def test_rules_match_like_substring_checks():
+    keywords = ['fee', 'fees', 'filing fee', 'leave to proceed', 'e', '[12]']
+    texts = pd.Series(['initial partial filing fees', 'order on leave to proceed', 'see doc [12]', 'none', None],
+                      index=[7, 8, 9, 10, 11])
+
+    for require_all in (False, True):
+        rule = KeywordRule(keywords, require_all=require_all)
+        check = all if require_all else any
+        expected = [isinstance(text, str) and check(keyword in text for keyword in keywords) for text in texts]
+        assert rule.mask(texts).tolist() == expected
+        assert rule.mask(texts).index.tolist() == [7, 8, 9, 10, 11]
+    assert KeywordRule(keywords).found(texts[7]) == {'fee', 'fees', 'filing fee', 'e'}
+    leave_granted = KeywordRule(['order on leave to proceed', 'granted'], require_all=True)
+    assert leave_granted.search('granted: order on leave to proceed') and not leave_granted.search('granted')
+    assert keyword_rule(('fee',)) is keyword_rule(('fee',))
+
+
+def test_whole_word_rules_match_like_flashtext():
+    keyword_processor = KeywordProcessor()
+    keyword_processor.add_keyword('trust fund account')
+    rule = KeywordRule(['trust fund account'], whole_words=True, ignore_case=True)
+
+    for text in ['trust trust fund account', 'the trust fund accounts', 'xtrust fund account', 'trust fund account.',
+                 'TRUST FUND ACCOUNT', 'trust fund account_1', 'trust-fund account']:
+        assert rule.search(text) == (len(keyword_processor.extract_keywords(text)) > 0)
@@ -0,0 +1,59 @@
+import asyncio
+
+import aiohttp
+from aiohttp.test_utils import TestServer
+
+from services.fetch_services import FetchRequest, fetch_all, fetch_batched
+from test.mock_ecf_server import TOKEN_PATH, MockEcfSettings, configure, create_app
+
+
+def _run(settings, fetch):
+    app = create_app(settings)
+
+    async def _main():
+        async with TestServer(app) as server:
+            base = str(server.make_url('')).rstrip('/')
+            configure(base)
+            async with aiohttp.ClientSession() as session:
+                return await fetch(session, base)
+
+    return asyncio.run(_main()), app['stats']
+
+
+def test_mock_server_serves_the_same_dockets_to_single_and_batched_fetches(monkeypatch):
+    # configure points Config at the server for the duration of the test
+    for name in ('base_api_url', 'token_url', 'docket_entries_multi_case_endpoint'):
+        monkeypatch.setattr(f'configuration.config.Config.{name}', None)
+
+    async def fetch(session, base):
+        requests = [FetchRequest(caseid, f'{base}/cases/entries/{caseid}') for caseid in (41000, 41001)]
+        headers = {'Authorization': 'Bearer unused'}
+        single = await fetch_all(session, requests, headers=headers)
+        return single, await fetch_batched(session, [41000, 41001], headers)
+
+    (single, batched), stats = _run(MockEcfSettings(entries=20, require_auth=False), fetch)
+
+    assert stats.requests == {'entries': 2, 'entries_multiple': 1}
+    for one, many in zip(single, batched):
+        assert one.ok and many.ok
+        assert one.data['de_seqno'].tolist() == many.data['de_seqno'].tolist()
+        assert one.data['de_caseid'].unique().tolist() == [one.key]
+
+
+def test_mock_server_checks_tokens_and_injects_errors(monkeypatch):
+    for name in ('base_api_url', 'token_url', 'docket_entries_multi_case_endpoint'):
+        monkeypatch.setattr(f'configuration.config.Config.{name}', None)
+
+    async def fetch(session, base):
+        async with session.post(f'{base}{TOKEN_PATH}', data={'username': 'u', 'password': 'p'}) as response:
+            token = (await response.json())['access_token']
+        requests = [FetchRequest(caseid, f'{base}/cases/deadlines/{caseid}') for caseid in range(41000, 41005)]
+        rejected = await fetch_all(session, requests, headers={'Authorization': 'Bearer forged'}, retries=0)
+        failed = await fetch_all(session, requests, headers={'Authorization': f'Bearer {token}'}, retries=0)
+        return rejected, failed
+
+    (rejected, failed), stats = _run(MockEcfSettings(error_rate=1.0), fetch)
+
+    assert all('401' in result.error for result in rejected)
+    assert stats.errors == 5
+    assert not any(result.ok for result in failed)
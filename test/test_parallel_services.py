@@ -0,0 +1,59 @@
+from services import parallel_services
+from services.parallel_services import balanced_chunks, run_chunks
+
+
+def _square_all(numbers):
+    return {number: number ** 2 for number in numbers}
+
+
+def test_chunks_are_balanced_and_cover_every_case():
+    weights = {caseid: caseid % 7 * 100 for caseid in range(100)}
+    chunks = balanced_chunks(list(range(100)) + [5, 6], weights, jobs=2)
+    assert len(chunks) == 8
+    assert sorted(caseid for chunk in chunks for caseid in chunk) == list(range(100))
+    assert all(chunk == sorted(chunk) for chunk in chunks)
+    loads = [sum(max(weights[caseid], 1) for caseid in chunk) for chunk in chunks]
+    assert max(loads) - min(loads) <= max(weights.values())
+    assert balanced_chunks(range(10), {}, jobs=1) == [list(range(10))]
+
+
+def test_results_come_back_in_payload_order():
+    payloads = [([caseid for caseid in range(start, 30, 3)],) for start in range(3)]
+    assert run_chunks(_square_all, payloads, jobs=2) == run_chunks(_square_all, payloads, jobs=1)
+
+
+def test_payloads_are_built_only_as_chunks_are_submitted(monkeypatch):
+    outstanding = []
+
+    class _Executor:
+        # runs each chunk when its result is asked for, and records how many were waiting then
+        def __init__(self, max_workers):
+            self.pending = 0
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def submit(self, func, *args):
+            self.pending += 1
+            executor = self
+
+            class _Future:
+                def result(self):
+                    outstanding.append(executor.pending)
+                    executor.pending -= 1
+                    return func(*args)
+
+            return _Future()
+
+    def payloads():
+        for start in range(20):
+            yield [start],
+
+    monkeypatch.setattr(parallel_services, 'ProcessPoolExecutor', _Executor)
+    results = run_chunks(_square_all, payloads(), jobs=2)
+
+    assert results == [{start: start ** 2} for start in range(20)]
+    assert max(outstanding) <= 2 * parallel_services.CHUNKS_IN_FLIGHT_PER_JOB
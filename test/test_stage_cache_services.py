@@ -0,0 +1,58 @@
+import os
+
+import pandas as pd
+
+from services.stage_cache_services import StageCache
+
+
+def _stage(tmp_path, calls):
+    def totals(scale: int):
+        calls.append(scale)
+        df = pd.read_csv(tmp_path / 'cases.csv')
+        by_judge = df.groupby('judge')['days'].sum() * scale
+        return {'cases': df.loc[df['days'] > 1], 'by_judge': by_judge.to_frame()}
+
+    return totals
+
+
+def test_stage_is_served_from_cache_until_inputs_change(tmp_path):
+    pd.DataFrame({'judge': ['a', 'b', 'a'], 'days': [1, 2, 3]}).to_csv(tmp_path / 'cases.csv', index=False)
+    calls = []
+    totals = _stage(tmp_path, calls)
+    cache = StageCache(root=str(tmp_path / 'cache'), max_bytes=10 ** 9, enabled=True)
+
+    def run(**kwargs):
+        return cache.run('totals', totals, inputs=[str(tmp_path / 'cases.csv')], params={'scale': 2}, **kwargs)
+
+    first = run()
+    second = StageCache(root=str(tmp_path / 'cache'), enabled=True).run(
+        'totals', totals, inputs=[str(tmp_path / 'cases.csv')], params={'scale': 2})
+    assert calls == [2]
+    for name in first:
+        pd.testing.assert_frame_equal(second[name], first[name])
+
+    # rewritten with the same content: hashed again, still a hit
+    content = (tmp_path / 'cases.csv').read_bytes()
+    (tmp_path / 'cases.csv').write_bytes(content)
+    os.utime(tmp_path / 'cases.csv', ns=(0, 0))
+    run()
+    assert calls == [2]
+
+    (tmp_path / 'cases.csv').write_bytes(content + b'b,5\n')
+    assert run()['by_judge'].loc['b', 'days'] == 14
+    assert calls == [2, 2]
+    run(refresh=True)
+    assert calls == [2, 2, 2]
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = StageCache(root=str(tmp_path), max_bytes=10 ** 9, enabled=True)
+    entries = []
+    for scale in range(3):
+        cache.run('stage', lambda scale: pd.DataFrame({'value': range(1000)}) * scale, params={'scale': scale})
+        entries.extend(path for path in cache._entries() if path not in entries)
+        os.utime(entries[-1] / 'manifest.json', (scale, scale))
+    cache.evict(max_bytes=cache.size() - 1)
+    assert sorted(cache._entries()) == sorted(entries[1:])
+    cache.clear()
+    assert cache.size() == 0
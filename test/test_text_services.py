@@ -0,0 +1,17 @@
+import pandas as pd
+
+from services.text_services import DocketText
+
+
+def test_text_is_lowercased_once_and_put_back_on_its_rows():
+    df = pd.DataFrame({'de_caseid': [41091, 41091, 41091, 52004], 'de_seqno': [1, 2, 2, 1],
+                       'dt_text': ['COMPLAINT', 'ORDER Part One', 'Part Two', None]})
+
+    docket_text = DocketText.pop(df)
+    target = docket_text.attach(df.loc[df['de_caseid'] == 41091].iloc[[2, 0]])
+
+    assert 'dt_text' not in df.columns
+    assert docket_text.texts(41091) == ['complaint', 'order part one', 'part two']
+    assert target['dt_text'].tolist() == ['part two', 'complaint']
+    assert list(target.columns) == ['de_caseid', 'de_seqno', 'dt_text']
+    assert docket_text.attach(df.loc[df['de_caseid'] == 52004])['dt_text'].tolist() == [None]
@@ -1,15 +1,15 @@
 import functools
 from functools import wraps
-import json
 import time
-from typing import Callable, Any, Optional
+from typing import Callable, Any, Optional, Tuple
 import asyncio
-import aiohttp
 from aiohttp import ClientSession
 from colorama import Fore
 import httpx
 import pandas as pd
 
+from util.json_columns import decode_data, read_body
+
 
 def async_timed():
     """Decorator to time async functions"""
@@ -39,20 +39,68 @@ async def delay(delay_seconds: int) -> int:
     return delay_seconds
 
 
-async def get(session: ClientSession, url: str, params: Optional = None, headers: Optional = None) -> int:
-    """Retrieve data asynchronously from an endpoint with aiohttp"""
-    to = aiohttp.ClientTimeout(total=5 * 60)
+def read_cached(cache: Optional, method: str, url: str, params: Optional = None,
+                json_body: Any = None) -> Optional[pd.DataFrame]:
+    """
+    Decodes the cached response of a request when it is still fresh, so that it can be used without the server
+
+    :return: dataframe, or None when the request has to go to the server
+    """
+    if cache is None:
+        return None
+    entry = cache.lookup(cache.key(method, url, params, json_body))
+    if entry is None or not cache.is_fresh(entry):
+        return None
+    return decode_data(cache.read(entry))
+
+
+async def _request_data(session: ClientSession, method: str, url: str, params: Optional = None,
+                        headers: Optional = None, json_body: Any = None,
+                        cache: Optional = None) -> Tuple[pd.DataFrame, bool]:
+    """
+    Sends a request and decodes the data array of the response. With a ResponseCache a fresh cached body is used
+    without contacting the server and a stale one is revalidated with its ETag/Last-Modified validators.
+
+    :return: dataframe, and whether the server was contacted; False when a fresh cached body was used
+    """
+    key = entry = None
+    if cache is not None:
+        key = cache.key(method, url, params, json_body)
+        entry = cache.lookup(key)
+        if entry is not None and cache.is_fresh(entry):
+            return decode_data(cache.read(entry)), False
+        if entry is not None:
+            headers = dict(headers or {}, **cache.conditional_headers(entry))
+    # timeouts come from the session, see ApiSession.session
+    async with session.request(method, url, params=params, headers=headers, json=json_body, ssl=False) as result:
+        if entry is not None and result.status == 304:
+            cache.revalidated(entry)
+            return decode_data(cache.read(entry)), True
+        # surface 4xx/5xx as aiohttp.ClientResponseError so callers can decide whether to retry
+        result.raise_for_status()
+        body = await read_body(result)
+    if cache is not None:
+        cache.put(key, body, etag=result.headers.get('ETag'), last_modified=result.headers.get('Last-Modified'))
+    return decode_data(body), True
+
+
+async def get(session: ClientSession, url: str, params: Optional = None, headers: Optional = None,
+              cache: Optional = None) -> Tuple[pd.DataFrame, bool]:
+    """Retrieve data asynchronously from an endpoint with aiohttp; also says whether the server was contacted"""
     caseid = url.split('/')[-1]
     print(Fore.YELLOW + f'Getting docket entries for case {caseid}...', flush=True)
-    if headers:
-        async with session.get(url, timeout=to, params=params, headers=headers, ssl=False) as result:
-            res = await result.read()
-            df = pd.DataFrame(json.loads(res)['data'])
-            df.head()
-            return df
-    else:
-        async with session.get(url, timeout=to, params=params, ssl=False) as result:
-            return result.status
+    return await _request_data(session, 'GET', url, params=params, headers=headers, cache=cache)
+
+
+async def post(session: ClientSession, url: str, json_body: Any, params: Optional = None,
+               headers: Optional = None, cache: Optional = None) -> Tuple[pd.DataFrame, bool]:
+    """
+    Post a query asynchronously to an endpoint with aiohttp and load the returned data into a DataFrame; also says
+    whether the server was contacted
+    """
+    print(Fore.YELLOW + f'Posting query to {url.split("/")[-1]}...', flush=True)
+    return await _request_data(session, 'POST', url, params=params, headers=headers, json_body=json_body,
+                               cache=cache)
 
 
 async def get_httpx(url: str, params: Optional = None, headers: Optional = None) -> int:
@@ -0,0 +1,129 @@
+"""
+Module that decodes ecfapi responses of the form {"data": [{...}, ...]} straight into column arrays. The body is
+streamed into a single buffer and parsed by the Arrow JSON reader, so no Python dict is created per row and the
+resulting frame is built from typed columns instead of from a list of records.
+
+The frame matches what pd.DataFrame(json.loads(body)['data']) returns: columns in order of first appearance, string
+dates left as strings, ints with missing values as float NaN. Responses the columnar path cannot reproduce exactly
+(nested values, mixed types in a column, empty data) are decoded the old way.
+
+"""
+import json
+from typing import Dict, Optional, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.json as pa_json
+from aiohttp import ClientResponse
+
+CHUNK_SIZE = 1 << 16
+# bytes of the body scanned for the first row before giving up on the columnar path
+FIRST_ROW_LIMIT = 1 << 22
+
+Body = Union[bytes, bytearray]
+
+
+async def read_body(response: ClientResponse) -> bytearray:
+    """
+    Streams a response body into one growing buffer instead of a list of chunks that is joined at the end
+    """
+    body = bytearray()
+    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+        body += chunk
+    return body
+
+
+def _decode_records(body: Body) -> pd.DataFrame:
+    return pd.DataFrame(json.loads(body)['data'])
+
+
+def _first_row(body: Body) -> Optional[Dict]:
+    """
+    Decodes only the first element of the data array. Its key order and value types are used to build the schema
+    hints for the Arrow reader.
+    """
+    key = body.find(b'"data"')
+    start = body.find(b'[', key)
+    if key < 0 or start < 0:
+        return None
+    decoder = json.JSONDecoder()
+    size = CHUNK_SIZE
+    while size <= FIRST_ROW_LIMIT:
+        text = bytes(body[start + 1:start + 1 + size]).decode('utf-8', errors='ignore').lstrip()
+        try:
+            row, _ = decoder.raw_decode(text)
+        except json.JSONDecodeError:
+            if start + 1 + size >= len(body):
+                return None
+            size *= 2
+            continue
+        return row if isinstance(row, dict) else None
+    return None
+
+
+def _read_table(body: Body, row_type: Optional[pa.StructType] = None) -> pa.Table:
+    schema = pa.schema([pa.field('data', pa.list_(row_type))]) if row_type is not None else None
+    # one block covering the whole body: the reader splits blocks on newlines, which a single JSON object lacks
+    return pa_json.read_json(pa.py_buffer(body),
+                             read_options=pa_json.ReadOptions(block_size=len(body) + 1),
+                             parse_options=pa_json.ParseOptions(explicit_schema=schema,
+                                                                unexpected_field_behavior='infer'))
+
+
+def _missing_in_some_rows(body: Body, name: str, rows: int) -> bool:
+    """
+    Counts the rows that carry a key. A quote inside a JSON string is always escaped, so a quoted name directly
+    followed by ':' can only be an object key.
+    """
+    key = json.dumps(name).encode()
+    return body.count(key + b':') + body.count(key + b' :') < rows
+
+
+def _is_flat(data_type: pa.DataType) -> bool:
+    return not (pa.types.is_nested(data_type) or pa.types.is_timestamp(data_type))
+
+
+def decode_data(body: Body) -> pd.DataFrame:
+    """
+    Decodes the data array of an ecfapi response into a DataFrame
+
+    :param body: raw response body
+    :return: one row per element of data
+    """
+    first_row = _first_row(body)
+    if not first_row:
+        return _decode_records(body)
+
+    # declaring the string fields of the first row keeps the reader from turning ISO dates into timestamps
+    hints = pa.struct([pa.field(name, pa.string()) for name, value in first_row.items() if isinstance(value, str)])
+    try:
+        table = _read_table(body, hints)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        # e.g. a field that holds a string in the first row and a number further down
+        return _decode_records(body)
+    if 'data' not in table.column_names:
+        return _decode_records(body)
+
+    rows = table.column('data').combine_chunks()
+    row_type = rows.type.value_type
+    if any(pa.types.is_timestamp(field.type) for field in row_type):
+        # a date string first seen after the first row; read again with those fields declared as strings
+        row_type = pa.struct([pa.field(field.name, pa.string()) if pa.types.is_timestamp(field.type) else field
+                              for field in row_type])
+        try:
+            rows = _read_table(body, row_type).column('data').combine_chunks()
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            return _decode_records(body)
+    values = rows.flatten()
+    if rows.null_count or values.null_count or not all(_is_flat(field.type) for field in row_type):
+        return _decode_records(body)
+
+    names = [field.name for field in row_type]
+    # explicit fields come first in the Arrow schema; restore the order in which keys first appear
+    order = list(first_row) + [name for name in names if name not in first_row]
+    columns = dict(zip(names, values.flatten()))
+    for name, column in columns.items():
+        # pandas keeps an all None column as objects, but fills it with NaN when the key is absent from some rows
+        if pa.types.is_null(column.type) and _missing_in_some_rows(body, name, len(values)):
+            columns[name] = pa.nulls(len(values), pa.float64())
+    return pa.Table.from_arrays([columns[name] for name in order], names=order).to_pandas()